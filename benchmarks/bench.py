@@ -0,0 +1,331 @@
+"""
+Benchmark suite for the context_store build and query paths.
+
+Generates synthetic Python, Markdown and notebook repositories (see synthetic.py) at the
+requested chunk counts, then times each case in its own subprocess so peak RSS is measured
+per case. Embeddings come from a deterministic hashing embedder, so no model is downloaded,
+and the embedding cache and query daemon are disabled.
+
+Cases: build_index, build_prose_index, build_json_indices (builds: throughput in chunks/s),
+get_code_context, get_prose_context, query_json_file (queries: latency percentiles, queries/s).
+Every case also reports peak RSS and the on-disk size of its index.
+
+Usage:
+  python benchmarks/bench.py run [--sizes 1000 10000] [--cases build_index,get_code_context]
+                                 [--queries 200] [--workdir DIR] [--out results.json]
+  python benchmarks/bench.py compare baseline.json results.json [--threshold 0.1] [--fail-on-regression]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+BUILD_CASES = ("build_index", "build_prose_index", "build_json_indices")
+QUERY_CASES = ("get_code_context", "get_prose_context", "query_json_file")
+CASES = BUILD_CASES + QUERY_CASES
+RESULTS_FORMAT = "context_store_bench"
+
+# (metric, higher_is_better) pairs checked by `compare`.
+_COMPARED_METRICS = (("seconds", False), ("throughput_per_s", True), ("latency_ms.p50", False),
+                     ("latency_ms.p95", False), ("peak_rss_mb", False), ("index_bytes", False))
+
+# ---------- Case execution (runs in a child process) ----------
+
+def _paths(workdir, size):
+    base = Path(workdir) / f"size_{size}"
+    return {"base": base, "code_repo": base / "code_repo", "prose_repo": base / "prose_repo",
+            "code_index": base / "indices" / "code_index", "prose_dir": base / "indices" / "prose",
+            "prose_index": base / "indices" / "prose" / "prose_repo_prose_index.npz",
+            "json_dir": base / "indices" / "json"}
+
+
+def _disk_bytes(*paths):
+    total = 0
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            total += path.stat().st_size
+        elif path.is_dir():
+            total += sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return total
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _percentiles(latencies_ms):
+    ordered = sorted(latencies_ms)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"mean": round(statistics.fmean(ordered), 3), "p50": round(pick(0.50), 3),
+            "p95": round(pick(0.95), 3), "p99": round(pick(0.99), 3)}
+
+
+def _build(case, paths, workers):
+    import context_store
+    from context_store_json import build_json_indices
+    from synthetic import BENCH_MODEL_NAME
+    if case == "build_index":
+        context_store.build_index(paths["code_repo"], paths["code_index"], model_name=BENCH_MODEL_NAME,
+                                  workers=workers, index_format="mmap")
+    elif case == "build_prose_index":
+        context_store.build_prose_index(paths["prose_repo"], paths["prose_dir"], model_name=BENCH_MODEL_NAME)
+    else:
+        build_json_indices(paths["code_repo"], paths["json_dir"], workers=workers)
+
+
+def _index_info(case, paths):
+    # (chunk count, index paths) of the index a case builds or queries.
+    if case in ("build_index", "get_code_context"):
+        with open(paths["code_index"] / "manifest.json", encoding="utf-8") as f:
+            return json.load(f)["count"], [paths["code_index"]]
+    if case in ("build_prose_index", "get_prose_context"):
+        import numpy as np
+        with np.load(paths["prose_index"], allow_pickle=True) as data:
+            return len(data["texts"]), [paths["prose_index"]]
+    with open(paths["json_dir"] / "code_repo_signatures.json", encoding="utf-8") as f:
+        n_signatures = len(json.load(f))
+    return n_signatures, [p for p in paths["json_dir"].iterdir()]
+
+
+def _query_fn(case, paths):
+    import context_store
+    from context_store_json import query_json_file
+    from synthetic import BENCH_MODEL_NAME
+    if case == "get_code_context":
+        return lambda q: context_store.get_code_context(q, paths["code_index"], k=5, query_model_name=BENCH_MODEL_NAME)
+    if case == "get_prose_context":
+        return lambda q: context_store.get_prose_context(q, paths["prose_index"], k=5, model_name=BENCH_MODEL_NAME)
+    return lambda q: query_json_file(q, paths["json_dir"] / "code_repo_signatures.json", k=5)
+
+
+def run_case(case, workdir, size, n_queries, seed, workers):
+    """
+    Runs one benchmark case in the current process and returns its measurements.
+    Query cases build the index they need first (untimed) when it is missing.
+    """
+    import context_store
+    from synthetic import BENCH_MODEL_NAME, HashingEmbedder, make_queries
+    context_store._CACHED_MODELS[BENCH_MODEL_NAME] = HashingEmbedder()
+    paths = _paths(workdir, size)
+    result = {"case": case, "size": size}
+
+    if case in BUILD_CASES:
+        started = time.perf_counter()
+        _build(case, paths, workers)
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        chunks, index_paths = _index_info(case, paths)
+        result["throughput_per_s"] = round(chunks / result["seconds"], 1) if result["seconds"] else None
+    else:
+        build_case = BUILD_CASES[QUERY_CASES.index(case)]
+        try:
+            chunks, index_paths = _index_info(case, paths)
+        except (OSError, KeyError, ValueError):
+            _build(build_case, paths, workers)
+            chunks, index_paths = _index_info(case, paths)
+        query_fn = _query_fn(case, paths)
+        queries = make_queries(n_queries, seed)
+        started = time.perf_counter()
+        query_fn(queries[0])  # Cold: loads the index (and model) into the process caches.
+        result["first_query_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        latencies = []
+        started = time.perf_counter()
+        for query in queries:
+            t0 = time.perf_counter()
+            query_fn(query)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        result["throughput_per_s"] = round(len(queries) / result["seconds"], 1) if result["seconds"] else None
+        result["latency_ms"] = _percentiles(latencies)
+
+    result["chunks"] = chunks
+    result["index_bytes"] = _disk_bytes(*index_paths)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+# ---------- Orchestration ----------
+
+def _prepare_corpus(workdir, size, seed):
+    from synthetic import generate_prose_repo, generate_python_repo
+    paths = _paths(workdir, size)
+    marker = paths["base"] / "corpus.json"
+    params = {"size": size, "seed": seed}
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return
+    import shutil
+    shutil.rmtree(paths["base"], ignore_errors=True)
+    started = time.perf_counter()
+    n_py = generate_python_repo(paths["code_repo"], size, seed)
+    n_prose = generate_prose_repo(paths["prose_repo"], size, seed)
+    marker.write_text(json.dumps(params))
+    print(f"Generated corpus for {size} chunks ({n_py} .py, {n_prose} prose files) "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR.parent, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "numpy": numpy_version,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def run_suite(sizes, cases, n_queries=200, seed=0, workers=None, workdir=None):
+    """
+    Runs every case at every size, each in a fresh subprocess.
+
+    Returns:
+        dict[str, any]: {"format", "environment", "settings", "results": [per-case measurements]}.
+    """
+    owned_tmp = None
+    if workdir is None:
+        owned_tmp = tempfile.TemporaryDirectory(prefix="context_store_bench_")
+        workdir = owned_tmp.name
+    env = {**os.environ, "CONTEXT_STORE_NO_CACHE": "1", "CONTEXT_STORE_NO_DAEMON": "1"}
+    results = []
+    try:
+        for size in sizes:
+            _prepare_corpus(workdir, size, seed)
+            for case in cases:
+                with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                    result_file = f.name
+                cmd = [sys.executable, str(Path(__file__).resolve()), "_case", "--case", case, "--size", str(size),
+                       "--workdir", str(workdir), "--queries", str(n_queries), "--seed", str(seed),
+                       "--result-file", result_file] + (["--workers", str(workers)] if workers else [])
+                proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+                try:
+                    if proc.returncode != 0:
+                        print(f"Error: case {case} at size {size} failed:\n{proc.stderr[-3000:]}", file=sys.stderr)
+                        continue
+                    result = json.loads(Path(result_file).read_text())
+                finally:
+                    Path(result_file).unlink(missing_ok=True)
+                results.append(result)
+                latency = result.get("latency_ms")
+                print(f"{case:>20} size={size:<8} chunks={result['chunks']!s:<8} {result['seconds']:>9.3f}s "
+                      f"{result['throughput_per_s']!s:>10}/s"
+                      + (f"  p50={latency['p50']}ms p95={latency['p95']}ms" if latency else "")
+                      + f"  rss={result['peak_rss_mb']}MB  disk={result['index_bytes']}B", file=sys.stderr)
+    finally:
+        if owned_tmp:
+            owned_tmp.cleanup()
+    return {"format": RESULTS_FORMAT, "environment": _environment(),
+            "settings": {"sizes": list(sizes), "cases": list(cases), "queries": n_queries, "seed": seed,
+                         "workers": workers},
+            "results": results}
+
+
+def _metric(result, name):
+    value = result
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compares two result files case by case.
+
+    Returns:
+        list[dict[str, any]]: One row per (case, size, metric) present in both, with the relative
+        change and whether it is a regression beyond `threshold`.
+    """
+    base_by_key = {(r["case"], r["size"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        base = base_by_key.get((result["case"], result["size"]))
+        if base is None:
+            continue
+        for metric, higher_is_better in _COMPARED_METRICS:
+            old, new = _metric(base, metric), _metric(result, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append({"case": result["case"], "size": result["size"], "metric": metric, "baseline": old,
+                         "current": new, "change": change,
+                         "regression": (-change if higher_is_better else change) > threshold})
+    return rows
+
+# ---------- Command-Line Interface ----------
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark context_store build and query paths.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_run = subparsers.add_parser("run", help="Run the benchmark suite.")
+    p_run.add_argument("--sizes", type=int, nargs="+", default=[1000],
+                       help="Corpus sizes in chunks (e.g. 1000 10000 100000 1000000).")
+    p_run.add_argument("--cases", default="all", help=f"Comma-separated cases or 'all' ({', '.join(CASES)}).")
+    p_run.add_argument("--queries", type=int, default=200, help="Timed queries per query case.")
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--workers", type=int, default=None, help="Parser processes for builds (default: CPU count).")
+    p_run.add_argument("--workdir", default=None,
+                       help="Keep corpora and indices here (reused across runs); default: a temporary directory.")
+    p_run.add_argument("--out", default=None, help="Write results JSON here (default: stdout).")
+
+    p_cmp = subparsers.add_parser("compare", help="Compare two results files.")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression.")
+    p_cmp.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on any regression.")
+
+    p_case = subparsers.add_parser("_case")  # Internal: one case in a fresh process.
+    p_case.add_argument("--case", choices=CASES, required=True)
+    p_case.add_argument("--size", type=int, required=True)
+    p_case.add_argument("--workdir", required=True)
+    p_case.add_argument("--queries", type=int, required=True)
+    p_case.add_argument("--seed", type=int, default=0)
+    p_case.add_argument("--workers", type=int, default=None)
+    p_case.add_argument("--result-file", required=True)
+
+    args = parser.parse_args()
+    if args.command == "_case":
+        result = run_case(args.case, args.workdir, args.size, args.queries, args.seed, args.workers)
+        Path(args.result_file).write_text(json.dumps(result))
+    elif args.command == "run":
+        cases = CASES if args.cases == "all" else [c.strip() for c in args.cases.split(",") if c.strip()]
+        unknown = sorted(set(cases) - set(CASES))
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(unknown)}")
+        report = json.dumps(run_suite(args.sizes, cases, args.queries, args.seed, args.workers, args.workdir), indent=2)
+        if args.out:
+            Path(args.out).write_text(report, encoding="utf-8")
+        else:
+            print(report)
+    else:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        current = json.loads(Path(args.current).read_text(encoding="utf-8"))
+        rows = compare_results(baseline, current, args.threshold)
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['case']:>20} {row['size']:>8} {row['metric']:>18} {row['baseline']:>12} -> "
+                  f"{row['current']:>12} ({row['change']:+.1%}){flag}")
+        if args.fail_on_regression and any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
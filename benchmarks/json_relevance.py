@@ -0,0 +1,123 @@
+"""
+Relevance and latency benchmark for JSON index queries.
+
+Generates a synthetic repository whose functions share a common vocabulary, asks one query
+per target function built from words of its name and docstring, and compares the BM25F
+ranking of `query_json_file` with the previous substring-count scorer (number of query tokens
+found anywhere in name + docstring, ties broken by start line).
+
+Usage:
+  python benchmarks/json_relevance.py [--functions 2000] [--queries 300] [--seed 0] [--json-out results.json]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from context_store_json import _get_json_index, build_json_indices, query_json_file  # noqa: E402
+
+VERBS = ["load", "save", "parse", "build", "render", "merge", "split", "fetch", "update", "validate",
+         "encode", "decode", "compute", "resolve", "register", "flush", "scan", "convert", "apply", "reset"]
+NOUNS = ["config", "user", "profile", "index", "cache", "token", "session", "record", "batch", "query",
+         "chunk", "model", "schema", "report", "request", "response", "buffer", "layout", "metric", "node",
+         "graph", "table", "column", "window", "widget", "stream", "packet", "header", "manifest", "shard"]
+FILLER = ["the", "data", "value", "values", "result", "given", "into", "from", "with", "return", "returns",
+          "object", "current", "default", "helper", "list", "dict", "item", "items", "input", "output"]
+
+
+def generate_repo(repo_dir, n_functions, rng):
+    """Writes `n_functions` functions over 50-function modules; returns (name, docstring) per function."""
+    functions = []
+    for i in range(n_functions):
+        verb, noun1, noun2 = rng.choice(VERBS), rng.choice(NOUNS), rng.choice(NOUNS)
+        name = f"{verb}_{noun1}_{noun2}_{i}" if rng.random() < 0.5 else f"{verb}{noun1.title()}{noun2.title()}{i}"
+        doc_words = rng.sample(FILLER, 6) + [rng.choice(NOUNS), rng.choice(VERBS), noun2]
+        rng.shuffle(doc_words)
+        functions.append((name, " ".join(doc_words).capitalize() + "."))
+    repo_dir.mkdir(parents=True, exist_ok=True)
+    for start in range(0, n_functions, 50):
+        body = "".join(f'def {name}(data, value=None):\n    """{doc}"""\n    return data\n\n'
+                       for name, doc in functions[start:start + 50])
+        (repo_dir / f"module_{start // 50:04d}.py").write_text(body, encoding="utf-8")
+    return functions
+
+
+def make_queries(functions, n_queries, rng):
+    """One query per sampled target: verb + both nouns of its name, plus a common docstring word."""
+    queries = []
+    for name in (name for name, _ in rng.sample(functions, min(n_queries, len(functions)))):
+        words = [w.lower() for w in name.replace("_", " ").split()] if "_" in name else None
+        if words is None:
+            words, current = [], ""
+            for ch in name:
+                if ch.isupper() and current: words.append(current.lower()); current = ""
+                current += ch
+            words.append(current.lower())
+        parts = [w.rstrip("0123456789") for w in words[:3]]
+        queries.append((" ".join(parts + [rng.choice(FILLER)]), name))
+    return queries
+
+
+def legacy_rank(query_str, elements, k):
+    """The substring-count scorer `query_json_file` used before BM25 ranking."""
+    tokens = {token.lower() for token in query_str.split() if token}
+    scored = []
+    for element in elements:
+        text = f"{element.get('element_name', '').lower()} {element.get('docstring', '').lower()}"
+        hits = sum(1 for token in tokens if token in text)
+        if hits: scored.append((hits, element.get("start_line", 0), element))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [element["element_name"] for _, _, element in scored[:k]]
+
+
+def evaluate(rank_fn, queries, k):
+    reciprocal_ranks, hits_at_3, latencies = [], 0, []
+    for query_str, target in queries:
+        started = time.perf_counter()
+        names = rank_fn(query_str, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        rank = names.index(target) + 1 if target in names else None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        hits_at_3 += bool(rank and rank <= 3)
+    latencies.sort()
+    return {"mrr_at_k": statistics.fmean(reciprocal_ranks), "hit_at_3": hits_at_3 / len(queries),
+            "latency_ms_mean": statistics.fmean(latencies),
+            "latency_ms_p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare BM25F and legacy substring ranking of JSON index queries.")
+    parser.add_argument("--functions", type=int, default=2000, help="Number of synthetic functions.")
+    parser.add_argument("--queries", type=int, default=300, help="Number of labelled queries.")
+    parser.add_argument("--k", type=int, default=10, help="Result depth for MRR (default: 10).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json-out", default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        functions = generate_repo(Path(tmp) / "bench_repo", args.functions, rng)
+        build_json_indices(Path(tmp) / "bench_repo", Path(tmp) / "out", workers=1)
+        index_path = Path(tmp) / "out" / "bench_repo_signatures.json"
+        queries = make_queries(functions, args.queries, rng)
+
+        elements = _get_json_index(index_path).elements  # Both scorers run warm, on the same loaded elements.
+        results = {
+            "functions": args.functions, "queries": len(queries), "k": args.k, "seed": args.seed,
+            "legacy_substring": evaluate(lambda q, k: legacy_rank(q, elements, k), queries, args.k),
+            "bm25f": evaluate(lambda q, k: [r["element_name"] for r in query_json_file(q, index_path, k)],
+                              queries, args.k),
+        }
+    print(json.dumps(results, indent=2))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
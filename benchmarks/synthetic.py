@@ -0,0 +1,151 @@
+"""
+Synthetic corpora and a deterministic embedder for the benchmark suite.
+
+The generators write Python, Markdown and notebook repositories that yield approximately
+the requested number of chunks, from a fixed vocabulary and a seed, so two runs (or two
+commits) benchmark identical inputs. `HashingEmbedder` stands in for SentenceTransformer:
+a signed bag-of-words hashed into a fixed number of dimensions, with no downloads.
+"""
+import json
+import random
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+BENCH_MODEL_NAME = "bench/hashing-embedder"
+
+VERBS = ["load", "save", "parse", "build", "render", "merge", "split", "fetch", "update", "validate",
+         "encode", "decode", "compute", "resolve", "register", "flush", "scan", "convert", "apply", "reset"]
+NOUNS = ["config", "user", "profile", "index", "cache", "token", "session", "record", "batch", "query",
+         "chunk", "model", "schema", "report", "request", "response", "buffer", "layout", "metric", "node",
+         "graph", "table", "column", "window", "widget", "stream", "packet", "header", "manifest", "shard"]
+FILLER = ["the", "data", "value", "result", "given", "into", "from", "with", "returns", "object",
+          "current", "default", "list", "item", "input", "output", "each", "when", "before", "after"]
+
+PY_CHUNKS_PER_FILE = 50  # 10 classes with 3 methods each, plus 10 functions.
+PROSE_CHUNKS_PER_FILE = 20  # Heading sections per Markdown file or notebook.
+FILES_PER_DIR = 100
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """Deterministic SentenceTransformer stand-in: signed bag-of-words hashed into `dim` buckets."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, normalize_embeddings=True, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD_RE.findall(text.lower()):
+                h = zlib.crc32(word.encode())
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            out /= norms
+        return out
+
+
+def _sentence(rng, n_words=10):
+    words = rng.sample(FILLER, 5) + [rng.choice(NOUNS) for _ in range(n_words - 6)] + [rng.choice(VERBS)]
+    rng.shuffle(words)
+    return " ".join(words).capitalize() + "."
+
+
+def _file_path(root, index, suffix):
+    return Path(root) / f"pkg{index // FILES_PER_DIR:04d}" / f"part{index % FILES_PER_DIR:03d}{suffix}"
+
+
+def _python_module(rng, file_index):
+    parts = []
+    for c in range(10):
+        cls = f"{rng.choice(NOUNS).title()}{rng.choice(NOUNS).title()}{file_index}x{c}"
+        methods = "".join(
+            f"    def {rng.choice(VERBS)}_{rng.choice(NOUNS)}_{m}(self, {rng.choice(NOUNS)}, value=None):\n"
+            f"        \"\"\"{_sentence(rng)}\"\"\"\n"
+            f"        result = [self.{rng.choice(NOUNS)} for _ in range({m + 2})]\n"
+            f"        return result if value is None else value\n\n" for m in range(3))
+        parts.append(f"class {cls}:\n    \"\"\"{_sentence(rng, 14)}\"\"\"\n\n{methods}")
+    for f in range(10):
+        parts.append(
+            f"def {rng.choice(VERBS)}_{rng.choice(NOUNS)}_{rng.choice(NOUNS)}_{file_index}_{f}(data, limit=10):\n"
+            f"    \"\"\"{_sentence(rng, 12)}\"\"\"\n"
+            f"    items = [item for item in data if item][:limit]\n"
+            f"    return {{\"{rng.choice(NOUNS)}\": items, \"count\": len(items)}}\n\n")
+    return "\n".join(parts)
+
+
+def generate_python_repo(root, n_chunks, seed=0):
+    """
+    Writes a Python repository of about `n_chunks` AST chunks (functions, classes and methods).
+
+    Args:
+        root (str | pathlib.Path): Directory to create.
+        n_chunks (int): Approximate number of chunks; rounded up to whole modules.
+        seed (int, optional): Random seed.
+
+    Returns:
+        int: Number of files written.
+    """
+    rng = random.Random(seed)
+    n_files = max(1, -(-n_chunks // PY_CHUNKS_PER_FILE))
+    for i in range(n_files):
+        path = _file_path(root, i, ".py")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(_python_module(rng, i), encoding="utf-8")
+    return n_files
+
+
+def _markdown_sections(rng, file_index, n_sections):
+    sections = []
+    for s in range(n_sections):
+        level = "#" if s == 0 else "##" if s % 5 == 1 else "###"
+        title = f"{rng.choice(VERBS).title()} the {rng.choice(NOUNS)} {rng.choice(NOUNS)} ({file_index}.{s})"
+        body = " ".join(_sentence(rng, 12) for _ in range(3))
+        code = f"\n```python\n{rng.choice(VERBS)}_{rng.choice(NOUNS)}(data)\n```\n" if s % 4 == 3 else ""
+        sections.append(f"{level} {title}\n\n{body}\n{code}\n")
+    return sections
+
+
+def generate_prose_repo(root, n_chunks, seed=0):
+    """
+    Writes Markdown files and Jupyter notebooks (alternately) with about `n_chunks` heading sections.
+
+    Args:
+        root (str | pathlib.Path): Directory to create.
+        n_chunks (int): Approximate number of chunks; rounded up to whole files.
+        seed (int, optional): Random seed.
+
+    Returns:
+        int: Number of files written.
+    """
+    rng = random.Random(seed)
+    n_files = max(1, -(-n_chunks // PROSE_CHUNKS_PER_FILE))
+    for i in range(n_files):
+        sections = _markdown_sections(rng, i, PROSE_CHUNKS_PER_FILE)
+        if i % 2 == 0:
+            path = _file_path(root, i, ".md")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("".join(sections), encoding="utf-8")
+            continue
+        cells = []
+        for s, section in enumerate(sections):
+            cells.append({"cell_type": "markdown", "metadata": {}, "source": section})
+            if s % 3 == 0:
+                cells.append({"cell_type": "code", "metadata": {}, "execution_count": None, "outputs": [],
+                              "source": f"{rng.choice(VERBS)}_{rng.choice(NOUNS)}({s})"})
+        path = _file_path(root, i, ".ipynb")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}),
+                        encoding="utf-8")
+    return n_files
+
+
+def make_queries(n_queries, seed=0):
+    """Returns `n_queries` short natural-language/identifier queries over the corpus vocabulary."""
+    rng = random.Random(seed + 1)
+    return [f"{rng.choice(VERBS)} {rng.choice(NOUNS)} {rng.choice(NOUNS)}" for _ in range(n_queries)]
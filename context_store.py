@@ -1,484 +1,2106 @@
-# context_store.py
-"""
-AST-based Dense-index helper for codebases.
-
-Build Index CLI:
-  python context_store.py build --repo <src_dir> --index <index_file.npz> \
-                                [--model intfloat/e5-base-v2]
-
-Query Index CLI:
-  python context_store.py query --index <index_file.npz> --query "<your_query_string>" \
-                                [--k 3] [--max_tokens 1500] [--model intfloat/e5-base-v2]
-
-Import for programmatic querying:
-  from context_store import get_code_context
-"""
-from __future__ import annotations
-
-import argparse
-import ast
-import gc
-import sys
-from pathlib import Path
-from typing import List, Tuple, Dict, Any, Iterator
-import nbformat
-import json
-import itertools
-import pdb
-
-import numpy as np
-import torch
-
-try:
-    from context_store_json import export_ast_chunks_to_json, query_json_context
-except ImportError:
-    pass 
-# sentence_transformers is imported only within functions that use it.
-
-# ---------------------------------------------------------------------
-DEFAULT_MODEL = "intfloat/e5-base-v2"
-
-_CACHED_INDICES = {}
-_CACHED_MODELS = {}
-# ---------------------------------------------------------------------
-
-def _get_ast_node_source_segment(source_lines, node):
-    if not (hasattr(node, 'lineno') and hasattr(node, 'end_lineno')):
-        return None
-    start_line_idx = node.lineno - 1
-    end_line_idx = node.end_lineno
-    if hasattr(node, 'decorator_list') and node.decorator_list:
-        first_decorator = node.decorator_list[0]
-        if hasattr(first_decorator, 'lineno'):
-            decorator_start_line_idx = first_decorator.lineno - 1
-            if decorator_start_line_idx < start_line_idx:
-                start_line_idx = decorator_start_line_idx
-    if start_line_idx < 0 or end_line_idx > len(source_lines):
-        try: return ast.unparse(node) # Fallback for Python 3.9+
-        except: return f"# Error: Could not reliably get source for {getattr(node, 'name', 'unknown_node')}"
-    segment_lines = source_lines[start_line_idx:end_line_idx]
-    actual_def_line_in_segment_idx = (node.lineno - 1) - start_line_idx
-    if 0 <= actual_def_line_in_segment_idx < len(segment_lines):
-        first_def_line = segment_lines[actual_def_line_in_segment_idx]
-        indentation = len(first_def_line) - len(first_def_line.lstrip())
-        dedented_lines = [line[indentation:] if line.startswith(' ' * indentation) else line for line in segment_lines]
-        return "".join(dedented_lines)
-    return "".join(segment_lines)
-
-def _extract_ast_chunks_from_file(py_file_path, repo_root_path):
-    try:
-        file_content = py_file_path.read_text(encoding="utf-8", errors="ignore")
-        source_lines = file_content.splitlines(True)
-        tree = ast.parse(file_content, filename=str(py_file_path))
-    except Exception as e:
-        return
-    file_rel_path_str = str(py_file_path.relative_to(repo_root_path))
-    for node in ast.walk(tree):
-        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-            source_code_snippet = _get_ast_node_source_segment(source_lines, node)
-            if source_code_snippet:
-                yield {
-                    "file_path": file_rel_path_str, "element_name": node.name,
-                    "element_type": node.__class__.__name__, "start_line": node.lineno,
-                    "end_line": node.end_lineno, "docstring": ast.get_docstring(node) or "",
-                    "source_code": source_code_snippet
-                }
-
-def _get_sentence_transformer_model(model_name):
-    if model_name not in _CACHED_MODELS:
-        from sentence_transformers import SentenceTransformer
-        print(f"Info: Loading SentenceTransformer model: {model_name}...", file=sys.stderr)
-        _CACHED_MODELS[model_name] = SentenceTransformer(model_name, device="cpu")
-        print(f"Info: Model {model_name} loaded.", file=sys.stderr)
-    return _CACHED_MODELS[model_name]
-
-def _embed_texts_batch(texts, model_name, is_query=False):
-    if not texts: return np.array([])
-    texts_to_embed = [f"query: {text}" for text in texts] if is_query else texts
-    show_progress = not is_query
-    model = _get_sentence_transformer_model(model_name)
-    return model.encode(texts_to_embed, batch_size=32 if not is_query else 1,
-                        show_progress_bar=show_progress, normalize_embeddings=True)
-
-def build_index(repo_root_path, index_output_path, model_name=DEFAULT_MODEL):
-    repo_root, index_file = Path(repo_root_path).resolve(), Path(index_output_path).resolve()
-    if not repo_root.is_dir(): raise FileNotFoundError(f"Repo root not found: {repo_root}")
-    all_src_texts, all_meta = [], []
-    print(f"Info: Scanning Python files in: {repo_root} for AST chunking...", file=sys.stderr)
-    py_files = [p for p in repo_root.rglob("*.py") if not any(ex in p.parts for ex in
-                ['.git', '.vscode', '.idea', '__pycache__', 'node_modules', 'build', 'dist',
-                 'venv', 'env', '.env', 'site-packages', '.ipynb_checkpoints', 'tests', 'test', 'docs/_build'])]
-    print(f"Info: Found {len(py_files)} Python files to process.", file=sys.stderr)
-    for py_path in py_files:
-        for chunk_dict in _extract_ast_chunks_from_file(py_path, repo_root):
-            all_src_texts.append(chunk_dict["source_code"])
-            all_meta.append(chunk_dict)
-    if not all_src_texts:
-        print("Warning: No AST chunks found to index. Creating an empty index.", file=sys.stderr)
-        index_file.parent.mkdir(parents=True, exist_ok=True)
-        np.savez_compressed(index_file, embeddings=np.array([]), meta=np.array([], dtype=object))
-        print(f"Info: Empty index written to {index_file}", file=sys.stderr)
-        return
-    embeddings = _embed_texts_batch(all_src_texts, model_name, is_query=False)
-    index_file.parent.mkdir(parents=True, exist_ok=True)
-    np.savez_compressed(index_file, embeddings=embeddings, meta=np.array(all_meta, dtype=object))
-    print(f"✓ Index with {len(all_meta)} AST chunks written to {index_file}", file=sys.stderr)
-
-def _load_index_from_file(index_file_path):
-    data = np.load(index_file_path, allow_pickle=True)
-    embeds_np, meta_np = data.get("embeddings"), data.get("meta")
-    if embeds_np is None or meta_np is None: raise ValueError(f"Index missing 'embeddings' or 'meta': {index_file_path}")
-    meta_list = [dict(item) for item in meta_np]
-    return torch.tensor(embeds_np, dtype=torch.float32), meta_list
-
-def get_code_context(query, index_file_path, k=3, max_tokens=2000, query_model_name=DEFAULT_MODEL):
-    idx_path = Path(index_file_path).resolve()
-    if idx_path not in _CACHED_INDICES:
-        if not idx_path.exists(): raise FileNotFoundError(f"Index file not found: {idx_path}")
-        _CACHED_INDICES[idx_path] = _load_index_from_file(idx_path)
-    embeds_tensor, meta_list = _CACHED_INDICES[idx_path]
-    if embeds_tensor.nelement() == 0: return []
-    q_embed_np = _embed_texts_batch([query], query_model_name, is_query=True)[0]
-    q_tensor = torch.tensor(q_embed_np, dtype=torch.float32).to(embeds_tensor.device)
-    if embeds_tensor.ndim == 1: embeds_tensor = embeds_tensor.unsqueeze(0)
-    if q_tensor.ndim > 1: q_tensor = q_tensor.squeeze()
-    if embeds_tensor.shape[0] == 0 or embeds_tensor.shape[1] != q_tensor.shape[0]:
-        return []
-    sims = (embeds_tensor @ q_tensor).cpu().numpy()
-    actual_k = min(k, len(sims))
-    if actual_k == 0: return []
-    top_indices = sims.argsort()[-actual_k:][::-1]
-    results, current_tokens = [], 0
-    for hit_idx in top_indices:
-        chunk_meta = meta_list[hit_idx]
-        snippet_text = chunk_meta["source_code"]
-        token_count = len(snippet_text.split())
-        if current_tokens + token_count > max_tokens and len(results) > 0:
-            if k == 1 and not results: pass
-            else: continue
-        results.append({
-            "file": chunk_meta["file_path"], "lines": f"{chunk_meta['start_line']}-{chunk_meta['end_line']}",
-            "snippet": snippet_text, "element_name": chunk_meta["element_name"],
-            "element_type": chunk_meta["element_type"], "docstring": chunk_meta["docstring"]
-        })
-        current_tokens += token_count
-        if len(results) >= k: break
-    return results
-
-def _handle_build_cli(args):
-    build_index(repo_root_path=args.repo, index_output_path=args.index, model_name=args.model)
-
-def _handle_query_cli(args):
-    try:
-        results = get_code_context(query=args.query, index_file_path=args.index, k=args.k,
-                                   max_tokens=args.max_tokens, query_model_name=args.model)
-        if results:
-            print("=== Query Results ===")
-            for res_idx, res in enumerate(results):
-                print(f"\n--- Result {res_idx+1} ---")
-                print(f"File: {res['file']}")
-                print(f"Element: {res['element_name']} ({res['element_type']})")
-                print(f"Lines: {res['lines']}")
-                if res.get('docstring'): print(f"Docstring: {res['docstring'][:200]}{'...' if len(res['docstring']) > 200 else ''}")
-                print(f"Snippet:\n{res['snippet']}")
-        else:
-            print("No relevant snippets found.")
-    except FileNotFoundError as e: print(f"Error: {e}. Ensure index file exists.", file=sys.stderr)
-    except Exception as e: print(f"An error occurred during query: {e}", file=sys.stderr)
-
-def process_source(path, text, elem_type, chunks, meta, repo):
-    lines = text.splitlines(True)
-    if not lines:
-        return
-
-    active_headings_stack = []
-    discovered_headings_info = []
-    inside_code_block = False
-
-    for i, line_content in enumerate(lines):
-        stripped_line = line_content.lstrip()
-        # Toggle fenced code block state and skip the fence lines
-        if stripped_line.startswith("```"):
-            inside_code_block = not inside_code_block
-            continue
-        # Skip heading detection inside fenced code blocks
-        if inside_code_block:
-            continue
-        # Detect Markdown headings outside code blocks
-        if stripped_line.startswith("#"):
-            heading_level = len(stripped_line) - len(stripped_line.lstrip("#"))
-            heading_title = stripped_line[heading_level:].strip()
-
-            while active_headings_stack and active_headings_stack[-1][0] >= heading_level:
-                active_headings_stack.pop()
-            active_headings_stack.append((heading_level, heading_title))
-            discovered_headings_info.append((i, heading_level, list(active_headings_stack)))
-
-            print(f"Heading detected: Level {heading_level} - {heading_title} at line {i + 1}")
-
-    # Sentinel to mark end of last section
-    discovered_headings_info.append((len(lines), 0, []))
-
-    for idx in range(len(discovered_headings_info) - 1):
-        current_start, _, current_path = discovered_headings_info[idx]
-        next_start, _, _ = discovered_headings_info[idx + 1]
-
-        snippet_lines = lines[current_start:next_start]
-        # Ensure we don't skip chunks with valid content, even if small
-        if sum(1 for l in snippet_lines if l.strip()) < 1:
-            continue
-
-        snippet_text = ''.join(snippet_lines)
-        heading_path_str = " > ".join(title for _, title in current_path)
-
-        # Debugging the chunk addition
-        print(f"Adding chunk for heading path: {heading_path_str} (Lines {current_start + 1} to {next_start})")
-        print(f"Chunk content: {snippet_text[:100]}...")  # Print first 100 chars of the chunk
-
-        meta.append({
-            "file_path": str(path.relative_to(repo)),
-            "heading_path": heading_path_str,
-            "element_type": elem_type,
-            "start_line": current_start + 1,
-            "end_line": next_start,
-        })
-        chunks.append(snippet_text)
-
-    # Debugging to confirm chunks are being processed
-    if not chunks:
-        print(f"No chunks added for {path}")
-
-
-def build_prose_index(repo_root_path, index_output_path, model_name=DEFAULT_MODEL):
-    repo_root_path = Path(repo_root_path).resolve()
-    index_output_path = Path(index_output_path)
-
-    all_chunks_text = []
-    all_chunks_meta = []
-
-    prose_extensions = {".md", ".txt", ".rst"}
-    notebook_extensions = {".ipynb"}
-
-    EXCLUDE_DIR_NAMES_EXACT = {
-        '.ipynb_checkpoints', 'build', 'dist', '__pycache__', 
-        'venv', 'node_modules'
-    }
-
-    print("Starting build_prose_index")
-
-    for file_path in repo_root_path.rglob("*"):
-        should_skip = False
-        try:
-            relative_parent_dirs = file_path.relative_to(repo_root_path).parts[:-1]
-            for part_name in relative_parent_dirs:
-                if part_name.startswith('.') or part_name in EXCLUDE_DIR_NAMES_EXACT:
-                    should_skip = True
-                    break
-        except ValueError:
-            should_skip = True
-        
-        if should_skip:
-            print(f"Skipping file due to exclusion: {file_path}")
-            continue
-
-        if not file_path.is_file():
-            continue
-
-        if file_path.suffix in prose_extensions:
-            print(f"Processing prose file: {file_path}")
-            try:
-                text_content = file_path.read_text(encoding="utf-8")
-                elem_type = "Markdown" if file_path.suffix == ".md" else "ProseText"
-                process_source(file_path, text_content, elem_type, 
-                               all_chunks_text, all_chunks_meta, repo_root_path)
-            except Exception as e:
-                print(f"Error processing prose file {file_path}: {e}", file=sys.stderr)
-
-        elif file_path.suffix in notebook_extensions:
-            print(f"Processing notebook file: {file_path}")
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    notebook = nbformat.read(f, as_version=nbformat.NO_CONVERT)
-
-                markdown_cell_sources = []
-                for cell in notebook.cells:
-                    if "ignore" in cell.metadata.get("tags", []):
-                        continue
-
-                    if cell.cell_type == "markdown":
-                        print(f"Markdown cell detected in {file_path}: {cell.source[:100]}...")  # Debugging first 100 chars
-                        markdown_cell_sources.append(cell.source)
-                    elif cell.cell_type == "code":
-                        cell_source_stripped = cell.source.strip()
-                        if cell_source_stripped.startswith(("!", "%")):
-                            continue
-
-                if markdown_cell_sources:
-                    concatenated_markdown_content = "\n\n".join(markdown_cell_sources)
-                    process_source(file_path, concatenated_markdown_content, "Notebook",
-                                   all_chunks_text, all_chunks_meta, repo_root_path)
-            except Exception as e:
-                print(f"Error processing notebook {file_path}: {e}", file=sys.stderr)
-
-    if not all_chunks_text:
-        print(f"No text chunks found after exclusions. Prose index will not be built.")
-        return
-
-    # Deriving the repository name for the .npz file
-    repo_name = repo_root_path.name
-    index_output_path = index_output_path / f"{repo_name}_prose_index.npz"
-
-    # Ensure the directory exists
-    print(f"Ensuring directory exists: {index_output_path.parent}")
-    index_output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # Debugging output before saving
-    print(f"Saving the .npz file to {index_output_path}...")
-    
-    try:
-        embeddings_array = _embed_texts_batch(all_chunks_text, model_name, is_query=False) 
-
-        # Saving the .npz file with the correct path and name
-        np.savez_compressed(
-            index_output_path,
-            embeddings=embeddings_array,
-            texts=np.array(all_chunks_text, dtype=object), 
-            metadata=all_chunks_meta 
-        )
-        
-        # Confirmation of saving completion
-        print(f"Prose index built with {len(all_chunks_text)} chunks and saved to {index_output_path}")
-
-    except Exception as e:
-        print(f"Failed to build or save prose index for {repo_root_path}: {e}", file=sys.stderr)
-
-
-def get_prose_context(query, index_file_path, k=3, model_name=DEFAULT_MODEL):
-    try:
-        data = np.load(str(index_file_path), allow_pickle=True)
-        embeddings = data["embeddings"]
-        texts = data["texts"]
-        meta = list(data["metadata"])
-    except FileNotFoundError:
-        print(f"Error: Index file not found at {index_file_path}", file=sys.stderr)
-        return []
-    except KeyError as e:
-        print(f"Error: Index file {index_file_path} is missing expected field: {e}", file=sys.stderr)
-        return []
-
-    if embeddings.size == 0 or len(texts) == 0:
-        print(f"Warning: Index {index_file_path} contains no data.", file=sys.stderr)
-        return []
-        
-    query_embedding = _embed_texts_batch([query], model_name, is_query=True)
-    if query_embedding.ndim > 1:
-        query_embedding = query_embedding[0]
-
-    q_norm = np.linalg.norm(query_embedding)
-    e_norm = np.linalg.norm(embeddings, axis=1)
-
-    if q_norm == 0:
-        similarities = np.zeros(embeddings.shape[0])
-    else:
-        valid_e_norm_mask = e_norm > 0
-        similarities = np.zeros(embeddings.shape[0])
-        if np.any(valid_e_norm_mask):
-            dot_product = np.dot(embeddings[valid_e_norm_mask], query_embedding)
-            similarities[valid_e_norm_mask] = dot_product / (e_norm[valid_e_norm_mask] * q_norm)
-        
-    num_items = len(similarities)
-    actual_k = min(k, num_items)
-    if actual_k == 0 and num_items > 0:
-        return []
-    elif num_items == 0:
-        return []
-
-    ids = np.argsort(similarities)[::-1][:actual_k].astype(int)
-
-    results = []
-    for i in ids:
-        m = meta[i]
-        results.append({
-            "file": m["file_path"],
-            "heading_path": m["heading_path"],
-            "element_type": m["element_type"],
-            "lines": f"{m['start_line']}-{m['end_line']}",
-            "snippet": texts[i],
-        })
-    return results
-
-def _cli_main(argv=None):
-    if argv is None: argv = sys.argv[1:]
-    parser = argparse.ArgumentParser(description="Build or query AST-based dense code index.",
-                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    subparsers = parser.add_subparsers(dest="command", help="Sub-command to execute", required=True if argv else False)
-    
-    _json_build = subparsers.add_parser("build-json",
-                                        help="Export AST chunks to JSON context files")
-    _json_build.add_argument("--repo", required=True,
-                             help="Path to repository root")
-    _json_build.add_argument("--output-base-name", required=True,
-                             help="Base name for output JSON files")
-    _json_build.set_defaults(
-        func=lambda a: export_ast_chunks_to_json(a.repo, a.output_base_name))
-    
-    _json_query = subparsers.add_parser("query-json",
-                                        help="Query a JSON context store")
-    _json_query.add_argument("--signatures-file", required=True,
-                             help="Path to signatures JSON")
-    _json_query.add_argument("--source-file", required=True,
-                             help="Path to fullsource JSON")
-    _json_query.add_argument("--query", required=True,
-                             help="Search query string")
-    _json_query.add_argument("--k", type=int, default=3,
-                             help="Number of results to return")
-    _json_query.set_defaults(
-        func=lambda a: print(json.dumps(
-            query_json_context(a.query,
-                               a.signatures_file,
-                               a.source_file,
-                               a.k),
-            ensure_ascii=False, indent=2)))
-
-    _pb = subparsers.add_parser("build-prose", help="Build prose embedding index")
-    _pb.add_argument("--repo", required=True, help="Path to repo root")
-    _pb.add_argument("--output", required=True, help="Output base path for prose index")
-    _pb.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model name")
-    _pb.set_defaults(func=lambda args: build_prose_index(args.repo, args.output, args.model))
-
-    _pq = subparsers.add_parser("query-prose", help="Query prose embedding index")
-    _pq.add_argument("--index", required=True, help="Path to prose index (.npz)")
-    _pq.add_argument("--query", required=True, help="Query text")
-    _pq.add_argument("--k", type=int, default=3, help="Number of results")
-    _pq.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model name")
-    _pq.set_defaults(func=lambda args: print(
-        json.dumps(
-            get_prose_context(
-                query=args.query,
-                index_file_path=args.index,
-                k=args.k,
-                model_name=args.model
-            ),
-            ensure_ascii=False, indent=2
-        )
-    ))
-    # Build
-    p_build = subparsers.add_parser("build", help="Build dense code index.")
-    p_build.add_argument("--repo", type=str, required=True, help="Path to code repository root.")
-    p_build.add_argument("--index", type=str, required=True, help="Path to save output .npz index file.")
-    p_build.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model name.")
-    p_build.set_defaults(func=_handle_build_cli)
-    # Query
-    p_query = subparsers.add_parser("query", help="Query dense code index.")
-    p_query.add_argument("--index", type=str, required=True, help="Path to .npz index file.")
-    p_query.add_argument("--query", type=str, required=True, help="Natural language query string.")
-    p_query.add_argument("--k", type=int, default=3, help="Number of top results.")
-    p_query.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model for query.")
-    p_query.set_defaults(func=_handle_query_cli)
-
-    if not argv: parser.print_help(sys.stderr); sys.exit(1)
-    args = parser.parse_args(argv)
-    args.func(args)
-
-if __name__ == "__main__":
-    _cli_main()
+# context_store.py
+"""
+AST-based Dense-index helper for codebases.
+
+Build Index CLI:
+  python context_store.py build --repo <src_dir> --index <index_file.npz> \
+                                [--model intfloat/e5-base-v2] [--incremental] [--workers N]
+
+  An --index path ending in .npz produces the legacy compressed archive; any other path
+  (or --format mmap) produces a pickle-free index directory that queries memory-map.
+
+Build every index in one pass (one walk, one parse per file, one model load):
+  python context_store.py build-all --repo <src_dir> [--index <index_file.npz>] [--output-base-name <base>] \
+                                    [--lexical-format sqlite] [--prose-output <dir>]
+
+Convert an existing .npz index to the memory-mapped format:
+  python context_store.py convert-index --src <index_file.npz> --dst <index_dir>
+
+Query Index CLI:
+  python context_store.py query --index <index_file.npz> --query "<your_query_string>" \
+                                [--k 3] [--max_tokens 1500] [--model intfloat/e5-base-v2] \
+                                [--tokenizer approx|whitespace|tiktoken[:enc]|hf:<model>] [--trim-classes]
+
+Batch Query CLI (one query per line, encoded and scored together):
+  python context_store.py query --index <index_file.npz> --queries-file <queries.txt> [--k 3]
+
+Lexical JSON / SQLite indices (standard library only):
+  python context_store.py build-json --repo <src_dir> --output-base-name <base> [--format sqlite]
+  python context_store.py query-json --signatures-file <base>_signatures.json --source-file <base>_fullsource.json --query "..."
+  python context_store.py lookup --index <base>.db --name <function_or_class> [--file <path>]
+
+Hybrid Query CLI (lexical + dense, fused by reciprocal rank; exact identifier hits skip the model):
+  python context_store.py query-hybrid --index <index_file.npz> --lexical-index <base>_signatures.json \
+                                       --source-file <base>_fullsource.json --query "<query>" [--k 3]
+
+Distributed Build (each shard on its own machine, then one merged index or a shard manifest):
+  python context_store.py build --repo <src_dir> --index <shard_1.npz> --shard 1/4
+  python context_store.py merge-index --inputs <shard_1.npz> ... <shard_4.npz> --output <index_file.npz | all.shards.json>
+
+Sharded Indices (many independently built indices queried as one, e.g. one per service):
+  python context_store.py shard-add --manifest <all.shards.json> --name <shard> --index <index_file.npz>
+  python context_store.py query --index <all.shards.json> --query "<query>" [--shard-timeout 30]
+
+Query Daemon (query, query-prose, query-json, lookup and query-hybrid use it automatically while it runs):
+  python context_store.py serve [--preload-index <index_file.npz>]
+
+Live Index Updates (re-chunk only changed files whenever the repository changes):
+  python context_store.py watch --repo <src_dir> [--index <index_file.npz>] [--output-base-name <base>] \
+                                [--prose-output <dir>] [--interval 1.0] [--debounce 0.5]
+
+Every subcommand also takes -v/-vv (progress, then per-chunk debugging on stderr) and
+--metrics <trace.jsonl | metrics.prom>, which writes timing spans and counters for the run.
+
+Import for programmatic querying:
+  from context_store import get_code_context, get_code_context_batch
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import gc
+import hashlib
+import os
+import queue
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from collections.abc import Sequence
+from typing import List, Tuple, Dict, Any, Iterator
+import json
+import itertools
+import mmap
+
+from context_store_daemon import NO_DAEMON, QueryDaemon, daemon_request
+from context_store_dedup import DEDUP_MODES, DEFAULT_DEDUP_MODE, OCCURRENCE_FIELDS, ChunkDeduplicator, occurrence
+from context_store_json import (_EXCLUDE_DIRS, _iter_tree_chunks, build_json_indices, chunk_id, exact_identifier_matches,
+                                format_occurrences, iter_file_chunks, lookup_element, query_json_context)
+from context_store_shards import (DEFAULT_SHARD_TIMEOUT, SHARD_KINDS, add_shard, is_shard_manifest, load_manifest,
+                                  parse_shard_spec, remove_shard, scatter, shard_of, write_manifest)
+from context_store_metrics import (METRICS_FORMATS, configure_metrics, count, log, set_verbosity, span,
+                                   write_metrics)
+from context_store_tokens import active_tokenizer, configure_tokenizer, count_tokens, select_within_budget
+from context_store_watch import DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL, RepoWatcher
+from context_store_walk import is_excluded, walk_files
+# NumPy, nbformat, context_store_vectors and sentence_transformers are imported only within the
+# functions that use them, so the lexical subcommands (build-json, query-json, lookup) start with
+# the standard library alone.
+
+# ---------------------------------------------------------------------
+DEFAULT_MODEL = "intfloat/e5-base-v2"
+MMAP_INDEX_FORMAT, MMAP_INDEX_VERSION = "context_store.mmap", 1
+DEFAULT_NPROBE = 8
+QUANTIZE_CHOICES = ("float16", "int8", "binary")  # context_store_vectors.QUANTIZATION_SCHEMES, without importing NumPy.
+HYBRID_RRF_K = 60  # Reciprocal-rank fusion constant: score = sum(weight / (HYBRID_RRF_K + rank)).
+TRIMMED_CLASS_RELEVANCE = 0.5  # Relevance kept by a class cut down to its signature and docstring.
+CHUNKER_VERSION = 3  # Bump when chunk boundaries change; incremental builds re-chunk files chunked by another version.
+CHUNK_WINDOW_LINES = 60  # Functions longer than this are split into windows of this many lines...
+CHUNK_WINDOW_OVERLAP = 10  # ...each overlapping the previous one by this many lines.
+EMBED_BATCH_CHUNKS = 256  # Chunks handed to the embedder at a time by the streaming build pipeline.
+_PIPELINE_MAX_PENDING_BATCHES = 4
+
+_CACHED_INDICES = {}
+_CACHED_PROSE_INDICES = {}
+_CACHED_ANN = {}
+_CACHED_QUANT = {}
+_CACHED_MODELS = {}
+_CACHE_LOCK = threading.RLock()  # Guards the caches above; the query daemon serves requests concurrently.
+_LOAD_LOCKS = {}  # (cache name, key) -> lock held while that entry loads
+_EMBEDDING_CACHE = None  # Lazily created by _get_embedding_cache(); False when disabled.
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("CONTEXT_STORE_CACHE_DIR", Path.home() / ".cache" / "context_store"))
+DEFAULT_CACHE_MAX_MB = int(os.environ.get("CONTEXT_STORE_CACHE_MAX_MB", "2048"))
+# ---------------------------------------------------------------------
+
+def _get_ast_node_source_segment(source_lines, node):
+    if not (hasattr(node, 'lineno') and hasattr(node, 'end_lineno')):
+        return None
+    start_line_idx = node.lineno - 1
+    end_line_idx = node.end_lineno
+    if hasattr(node, 'decorator_list') and node.decorator_list:
+        first_decorator = node.decorator_list[0]
+        if hasattr(first_decorator, 'lineno'):
+            decorator_start_line_idx = first_decorator.lineno - 1
+            if decorator_start_line_idx < start_line_idx:
+                start_line_idx = decorator_start_line_idx
+    if start_line_idx < 0 or end_line_idx > len(source_lines):
+        try: return ast.unparse(node) # Fallback for Python 3.9+
+        except: return f"# Error: Could not reliably get source for {getattr(node, 'name', 'unknown_node')}"
+    segment_lines = source_lines[start_line_idx:end_line_idx]
+    actual_def_line_in_segment_idx = (node.lineno - 1) - start_line_idx
+    if 0 <= actual_def_line_in_segment_idx < len(segment_lines):
+        first_def_line = segment_lines[actual_def_line_in_segment_idx]
+        indentation = len(first_def_line) - len(first_def_line.lstrip())
+        dedented_lines = [line[indentation:] if line.startswith(' ' * indentation) else line for line in segment_lines]
+        return "".join(dedented_lines)
+    return "".join(segment_lines)
+
+def _dedent_lines(lines, indentation):
+    return [line[indentation:] if line.startswith(' ' * indentation) else line for line in lines]
+
+def _first_line(node):
+    # A definition starts at its first decorator.
+    return min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno])
+
+def _header_lines(source_lines, node):
+    # Decorators and the def/class statement, up to the line before its body (the whole line for one-liners).
+    body_start = _first_line(node.body[0])
+    last = body_start - 1 if body_start > node.lineno else node.lineno
+    return source_lines[_first_line(node) - 1:last]
+
+def _class_outline_source(source_lines, node):
+    # A class chunk holds its header, docstring, class attributes and member signatures; each
+    # method is a chunk of its own, so the class body is not embedded twice.
+    lines = _header_lines(source_lines, node)
+    first = node.body[0]
+    if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+        if first.lineno > node.lineno: lines += source_lines[first.lineno - 1:first.end_lineno]
+    for member in node.body:
+        if member.lineno == node.lineno: continue  # Already in the header of a one-line class.
+        if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            lines += _header_lines(source_lines, member)
+            if member.body[0].lineno > member.lineno: lines.append(" " * (member.col_offset + 4) + "...\n")
+        elif isinstance(member, (ast.Assign, ast.AnnAssign)):
+            lines += source_lines[member.lineno - 1:member.end_lineno]
+    return "".join(_dedent_lines(lines, node.col_offset))
+
+def _line_windows(first, last, size=CHUNK_WINDOW_LINES, overlap=CHUNK_WINDOW_OVERLAP):
+    # 1-based inclusive line ranges covering first..last, `size` lines each (the last one may be shorter),
+    # each overlapping the previous one by `overlap`.
+    windows, start = [], first
+    while True:
+        windows.append((start, min(start + size - 1, last)))
+        if start + size - 1 >= last: return windows
+        start += size - overlap
+
+def _iter_hierarchical_chunks(nodes, source_lines, file_rel_path_str, parent=None):
+    for node in nodes:
+        if isinstance(node, ast.ClassDef):
+            qualname = f"{parent}.{node.name}" if parent else node.name
+            yield {
+                "file_path": file_rel_path_str, "element_name": node.name, "element_type": "ClassDef",
+                "start_line": node.lineno, "end_line": node.end_lineno, "docstring": ast.get_docstring(node) or "",
+                "source_code": _class_outline_source(source_lines, node), "parent": parent
+            }
+            yield from _iter_hierarchical_chunks(node.body, source_lines, file_rel_path_str, qualname)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # Nested functions stay in their enclosing function's chunk; long functions become windows.
+            chunk = {"file_path": file_rel_path_str, "element_name": node.name,
+                     "element_type": node.__class__.__name__, "docstring": ast.get_docstring(node) or "",
+                     "parent": parent}
+            windows = _line_windows(_first_line(node), node.end_lineno)
+            if len(windows) == 1:
+                source_code_snippet = _get_ast_node_source_segment(source_lines, node)
+                if source_code_snippet:
+                    yield {**chunk, "start_line": node.lineno, "end_line": node.end_lineno,
+                           "source_code": source_code_snippet}
+                continue
+            for i, (start, end) in enumerate(windows, start=1):
+                yield {**chunk, "start_line": start, "end_line": end, "window": f"{i}/{len(windows)}",
+                       "source_code": "".join(_dedent_lines(source_lines[start - 1:end], node.col_offset))}
+        elif not isinstance(node, ast.expr):
+            # Definitions under if/try/with blocks (e.g. platform-specific or optional imports).
+            yield from _iter_hierarchical_chunks(ast.iter_child_nodes(node), source_lines, file_rel_path_str, parent)
+
+def _extract_ast_chunks_from_file(py_file_path, repo_root_path):
+    try:
+        file_content = py_file_path.read_text(encoding="utf-8", errors="ignore")
+        source_lines = file_content.splitlines(True)
+        tree = ast.parse(file_content, filename=str(py_file_path))
+    except Exception as e:
+        log(f"Skipping {py_file_path}: {e}")
+        return
+    file_rel_path_str = str(py_file_path.relative_to(repo_root_path))
+    yield from _iter_hierarchical_chunks(tree.body, source_lines, file_rel_path_str)
+
+def _extract_shared_chunks(py_file_path, repo_root_path):
+    # build-all reads and parses each file once for both chunkings: (dense chunks, lexical elements).
+    try:
+        file_content = py_file_path.read_text(encoding="utf-8", errors="ignore")
+        source_lines = file_content.splitlines(True)
+        tree = ast.parse(file_content, filename=str(py_file_path))
+    except Exception as e:
+        log(f"Skipping {py_file_path}: {e}")
+        return [], []
+    file_rel_path_str = str(py_file_path.relative_to(repo_root_path))
+    return (list(_iter_hierarchical_chunks(tree.body, source_lines, file_rel_path_str)),
+            list(_iter_tree_chunks(tree, source_lines, file_rel_path_str)))
+
+def _load_lock(cache_name, key):
+    # Loads hold a lock for their own entry only, never _CACHE_LOCK: a cold load must not block
+    # requests for other, already cached entries, and concurrent requests for one entry load it once.
+    with _CACHE_LOCK:
+        return _LOAD_LOCKS.setdefault((cache_name, key), threading.Lock())
+
+def _load_cached(cache_name, cache, key, stamp, load):
+    # cache[key] is (value, stamp); `load()` runs when the entry is missing or its file stamp changed.
+    cached = cache.get(key)
+    if cached is not None and cached[1] == stamp: return cached[0]
+    with _load_lock(cache_name, key):
+        cached = cache.get(key)
+        if cached is None or cached[1] != stamp:
+            cached = (load(), stamp)
+            with _CACHE_LOCK: cache[key] = cached
+        return cached[0]
+
+def _get_sentence_transformer_model(model_name):
+    if model_name in _CACHED_MODELS: return _CACHED_MODELS[model_name]
+    with _load_lock("model", model_name):
+        if model_name not in _CACHED_MODELS:
+            from sentence_transformers import SentenceTransformer
+            print(f"Info: Loading SentenceTransformer model: {model_name}...", file=sys.stderr)
+            model = SentenceTransformer(model_name, device="cpu")
+            with _CACHE_LOCK: _CACHED_MODELS[model_name] = model
+            print(f"Info: Model {model_name} loaded.", file=sys.stderr)
+        return _CACHED_MODELS[model_name]
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (model name, prefix, SHA-256 of the text), with LRU eviction.
+
+    Shared by the code and prose builders and the query path, so identical chunks are
+    only ever encoded once per model. Backed by a single SQLite file, safe to share
+    between processes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = Path(cache_dir) / "embeddings.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, "
+                           "vec BLOB NOT NULL, nbytes INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, prefix, text):
+        text_sha = hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        return f"{model_name}\x00{prefix}\x00{text_sha}"
+
+    def get_many(self, keys):
+        with self._lock:
+            return self._get_many(keys)
+
+    def _get_many(self, keys):
+        import numpy as np
+        found, now = {}, time.time()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._conn.execute(f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                                      batch).fetchall()
+            found.update((key, np.frombuffer(vec, dtype=np.float32)) for key, vec in rows)
+        if found:
+            self._conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, key) for key in found])
+            self._conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys, vectors):
+        with self._lock:
+            self._put_many(keys, vectors)
+
+    def _put_many(self, keys, vectors):
+        import numpy as np
+        now = time.time()
+        rows = []
+        for key, vec in zip(keys, vectors):
+            blob = np.asarray(vec, dtype=np.float32).tobytes()
+            rows.append((key, len(vec), blob, len(blob), now))
+        self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+        self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes: return
+        # Drop least recently used entries until we are comfortably under the limit.
+        target, freed = total - int(self.max_bytes * 0.9), 0
+        stale_keys = []
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_used ASC"):
+            stale_keys.append((key,))
+            freed += nbytes
+            if freed >= target: break
+        self._conn.executemany("DELETE FROM embeddings WHERE key=?", stale_keys)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+def configure_embedding_cache(cache_dir=None, max_mb=None, enabled=True):
+    global _EMBEDDING_CACHE
+    if _EMBEDDING_CACHE: _EMBEDDING_CACHE.close()
+    if not enabled:
+        _EMBEDDING_CACHE = False
+        return None
+    _EMBEDDING_CACHE = EmbeddingCache(cache_dir or DEFAULT_CACHE_DIR,
+                                      (max_mb if max_mb is not None else DEFAULT_CACHE_MAX_MB) * 1024 * 1024)
+    return _EMBEDDING_CACHE
+
+def _get_embedding_cache():
+    if _EMBEDDING_CACHE is None:
+        if os.environ.get("CONTEXT_STORE_NO_CACHE"): return configure_embedding_cache(enabled=False)
+        try: return configure_embedding_cache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Embedding cache unavailable ({e}); encoding without it.", file=sys.stderr)
+            return configure_embedding_cache(enabled=False)
+    return _EMBEDDING_CACHE or None
+
+def _embed_texts_batch(texts, model_name, is_query=False, show_progress=True):
+    import numpy as np
+    if not texts: return np.array([])
+    prefix = "query: " if is_query else ""
+    cache = _get_embedding_cache()
+    keys = [EmbeddingCache.make_key(model_name, prefix, text) for text in texts] if cache else []
+    cached = cache.get_many(keys) if cache else {}
+    missing = [i for i in range(len(texts)) if not cache or keys[i] not in cached]
+    if cache: count("cache_hits", len(texts) - len(missing)); count("cache_misses", len(missing))
+    if missing:
+        texts_to_embed = [f"{prefix}{texts[i]}" for i in missing]
+        model = _get_sentence_transformer_model(model_name)
+        with span("encode_query" if is_query else "embed", texts=len(missing)):
+            encoded = model.encode(texts_to_embed, batch_size=32,
+                                   show_progress_bar=show_progress and not is_query and len(missing) > 1,
+                                   normalize_embeddings=True)
+            encoded = np.asarray(encoded, dtype=np.float32)
+        if cache: cache.put_many([keys[i] for i in missing], encoded)
+        if len(missing) == len(texts): return encoded
+    if cache and not is_query and show_progress:
+        print(f"Info: Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses.", file=sys.stderr)
+    result = np.empty((len(texts), len(next(iter(cached.values())) if cached else encoded.shape[1])),
+                      dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached: result[i] = cached[key]
+    if missing: result[missing] = encoded
+    return result
+
+_CODE_EXCLUDE_DIRS = ['.git', '.vscode', '.idea', '__pycache__', 'node_modules', 'build', 'dist',
+                      'venv', 'env', '.env', 'site-packages', '.ipynb_checkpoints', 'tests', 'test', 'docs/_build']
+_PROSE_EXCLUDE_DIRS = {'.ipynb_checkpoints', 'build', 'dist', '__pycache__', 'venv', 'node_modules'}  # And hidden dirs.
+
+def _file_state(file_path, repo_root_path, previous=None, st=None):
+    # Cheap mtime/size check first (with the stat taken during discovery, when given); only
+    # re-hash when the stat changed.
+    st = st or file_path.stat()
+    rel_path_str = str(file_path.relative_to(repo_root_path))
+    if previous and previous.get("mtime_ns") == st.st_mtime_ns and previous.get("size") == st.st_size:
+        return {**previous, "file_path": rel_path_str}
+    return {"file_path": rel_path_str, "sha256": hashlib.sha256(file_path.read_bytes()).hexdigest(),
+            "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+def _read_build(index_file):
+    # A dense index with the state needed to reuse its rows: per-file hashes, the model and,
+    # for each file, its chunks as (start_line, row, occurrence). Those are its own rows plus
+    # the deduplicated copies it holds of chunks stored in other rows (whose files it then
+    # depends on).
+    import numpy as np
+    if index_file.is_dir():
+        manifest = _read_mmap_manifest(index_file)
+        model, shard = manifest["model"], manifest.get("shard")
+        embeds_np, meta_list = _load_mmap_index(index_file)
+        with open(index_file / "files.jsonl", encoding="utf-8") as f:
+            files = {rec["file_path"]: rec for rec in map(json.loads, f)}
+        records = meta_list.iter_records(with_source=False)
+    else:
+        data = np.load(index_file, allow_pickle=True)
+        if "files" not in data or "model" not in data:
+            raise ValueError(f"{index_file} has no per-file state")
+        model, shard = str(data["model"]), str(data["shard"]) if "shard" in data else None
+        embeds_np, meta_list = data["embeddings"], [dict(item) for item in data["meta"]]
+        files = {rec["file_path"]: dict(rec) for rec in data["files"]}
+        records = meta_list
+    chunks_by_file, depends_on = {}, {}
+    for row_idx, chunk_meta in enumerate(records):
+        chunks_by_file.setdefault(chunk_meta["file_path"], []).append((chunk_meta["start_line"], row_idx, None))
+        for occ in chunk_meta.get("occurrences", ()):
+            chunks_by_file.setdefault(occ["file_path"], []).append((occ["start_line"], row_idx, occ))
+            depends_on.setdefault(occ["file_path"], set()).add(chunk_meta["file_path"])
+    for entries in chunks_by_file.values(): entries.sort(key=lambda entry: entry[0])
+    return {"model": model, "shard": shard, "embeddings": embeds_np, "meta": meta_list, "files": files,
+            "chunks_by_file": chunks_by_file, "depends_on": depends_on}
+
+def _load_previous_build(index_file, model_name):
+    if not index_file.exists(): return None
+    try:
+        previous = _read_build(index_file)
+    except Exception as e:
+        print(f"Warning: Could not read previous index {index_file} ({e}); doing a full rebuild.", file=sys.stderr)
+        return None
+    if previous["model"] != model_name:
+        print(f"Info: {index_file} was built with {previous['model']}; doing a full rebuild.", file=sys.stderr)
+        return None
+    return previous
+
+def _located_chunk(chunk_meta, occ=None):
+    # A stored chunk as it appears at one of its locations: itself, or a deduplicated copy.
+    chunk = {key: value for key, value in chunk_meta.items()
+             if key != "occurrences" and (occ is None or key not in OCCURRENCE_FIELDS)}
+    return {**chunk, **(occ or {})}
+
+class _StreamingNpzWriter:
+    """Spills embedding batches to disk as they arrive and assembles the .npz on close().
+
+    Embeddings are appended to a raw float32 file and copied into the archive in fixed-size
+    blocks, so they never sit in memory as a whole. They are stored uncompressed, so queries
+    memory-map them in place (`_npz_memmap`) instead of loading them. The .npz container pickles its metadata
+    as one object array, so metadata is only read back into memory while finalizing.
+    """
+
+    def __init__(self, index_file, store_texts=False):
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        self._spill_dir = Path(tempfile.mkdtemp(prefix=f".{self.index_file.name}.", dir=self.index_file.parent))
+        self._embeds_f = open(self._spill_dir / "embeddings.f32", "wb")
+        self._meta_f = open(self._spill_dir / "meta.jsonl", "w", encoding="utf-8")
+        self._texts_f = open(self._spill_dir / "texts.jsonl", "w", encoding="utf-8") if store_texts else None
+        self.count, self.dim = 0, None
+
+    def add(self, embeddings, metas, texts=None):
+        import numpy as np
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not len(metas): return
+        if self.dim is None: self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed mid-build: {embeddings.shape[1]} != {self.dim}")
+        self._embeds_f.write(embeddings.tobytes())
+        for chunk_meta in metas: self._meta_f.write(json.dumps(chunk_meta, ensure_ascii=False) + "\n")
+        if self._texts_f:
+            for text in texts: self._texts_f.write(json.dumps(text, ensure_ascii=False) + "\n")
+        self.count += len(metas)
+
+    def _read_jsonl(self, name):
+        with open(self._spill_dir / name, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def close(self, meta_key="meta", occurrences=None, **extra_arrays):
+        import numpy as np
+        for f in (self._embeds_f, self._meta_f, self._texts_f):
+            if f: f.close()
+        tmp_file = self._spill_dir / "index.npz"
+        with zipfile.ZipFile(tmp_file, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            embeddings_info = zipfile.ZipInfo("embeddings.npy", date_time=time.localtime()[:6])
+            embeddings_info.compress_type = zipfile.ZIP_STORED
+            with zf.open(embeddings_info, "w", force_zip64=True) as fid:
+                if self.count:
+                    np.lib.format.write_array_header_1_0(
+                        fid, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                              "fortran_order": False, "shape": (self.count, self.dim)})
+                    with open(self._spill_dir / "embeddings.f32", "rb") as src: shutil.copyfileobj(src, fid, 1 << 20)
+                else:
+                    np.lib.format.write_array(fid, np.array([]))
+            metas = self._read_jsonl("meta.jsonl")
+            for row, row_occurrences in (occurrences or {}).items(): metas[row]["occurrences"] = row_occurrences
+            arrays = {meta_key: np.array(metas, dtype=object), **extra_arrays}
+            if self._texts_f: arrays["texts"] = np.array(self._read_jsonl("texts.jsonl"), dtype=object)
+            for key, value in arrays.items():
+                with zf.open(f"{key}.npy", "w", force_zip64=True) as fid:
+                    np.lib.format.write_array(fid, np.asanyarray(value), allow_pickle=True)
+        os.replace(tmp_file, self.index_file)
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def abort(self):
+        for f in (self._embeds_f, self._meta_f, self._texts_f):
+            if f: f.close()
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+def _swap_into_place(staged_path, target_path):
+    # Directories cannot be os.replace()d over a non-empty target, so move the old one aside
+    # first; open memory maps of the old files stay valid until their readers drop them.
+    if not target_path.exists() and not target_path.is_symlink():
+        os.rename(staged_path, target_path)
+        return
+    retired = target_path.with_name(f".{target_path.name}.old-{os.getpid()}-{time.monotonic_ns()}")
+    os.rename(target_path, retired)
+    os.rename(staged_path, target_path)
+    if retired.is_dir(): shutil.rmtree(retired, ignore_errors=True)
+    else: retired.unlink()
+
+class _StreamingMmapWriter:
+    """Writes the pickle-free, memory-mappable index directory incrementally.
+
+    Layout: manifest.json (format, model, count, dim), embeddings.f32 (raw row-major float32
+    matrix), meta.jsonl + meta_offsets.i64 (one JSON record per chunk without its source, and
+    the byte offset of each line), sources.bin + source_offsets.i64 (UTF-8 source snippets,
+    read lazily by offset) and files.jsonl (per-file state for incremental builds).
+    """
+
+    def __init__(self, index_dir, store_texts=False):
+        self.index_dir = Path(index_dir)
+        self.index_dir.parent.mkdir(parents=True, exist_ok=True)
+        self._staging = Path(tempfile.mkdtemp(prefix=f".{self.index_dir.name}.", dir=self.index_dir.parent))
+        self._files = {name: open(self._staging / name, "wb") for name in
+                       ("embeddings.f32", "meta.jsonl", "meta_offsets.i64", "sources.bin", "source_offsets.i64")}
+        self._meta_pos = self._source_pos = 0
+        self.count, self.dim = 0, None
+
+    def add(self, embeddings, metas, texts=None):
+        import numpy as np
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not len(metas): return
+        if self.dim is None: self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed mid-build: {embeddings.shape[1]} != {self.dim}")
+        self._files["embeddings.f32"].write(embeddings.tobytes())
+        meta_offsets, source_offsets = [], []
+        for chunk_meta in metas:
+            record = {key: value for key, value in chunk_meta.items() if key != "source_code"}
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            source = chunk_meta.get("source_code", "").encode("utf-8", errors="surrogatepass")
+            meta_offsets.append(self._meta_pos)
+            source_offsets.append(self._source_pos)
+            self._files["meta.jsonl"].write(line)
+            self._files["sources.bin"].write(source)
+            self._meta_pos += len(line)
+            self._source_pos += len(source)
+        self._files["meta_offsets.i64"].write(np.asarray(meta_offsets, dtype=np.int64).tobytes())
+        self._files["source_offsets.i64"].write(np.asarray(source_offsets, dtype=np.int64).tobytes())
+        self.count += len(metas)
+
+    def close(self, files=(), model=None, occurrences=None, **extra):
+        import numpy as np
+        # Offset tables get a trailing end offset so record i spans [offsets[i], offsets[i + 1]).
+        self._files["meta_offsets.i64"].write(np.int64(self._meta_pos).tobytes())
+        self._files["source_offsets.i64"].write(np.int64(self._source_pos).tobytes())
+        for f in self._files.values(): f.close()
+        with open(self._staging / "files.jsonl", "w", encoding="utf-8") as f:
+            for rec in files: f.write(json.dumps(dict(rec), ensure_ascii=False) + "\n")
+        # Rows whose meta.jsonl record was written before later copies of the chunk were seen.
+        with open(self._staging / "occurrences.jsonl", "w", encoding="utf-8") as f:
+            for row, row_occurrences in sorted((occurrences or {}).items()):
+                f.write(json.dumps({"row": row, "occurrences": row_occurrences}, ensure_ascii=False) + "\n")
+        manifest = {"format": MMAP_INDEX_FORMAT, "version": MMAP_INDEX_VERSION,
+                    "model": None if model is None else str(model), "count": self.count,
+                    "dim": self.dim or 0, "dtype": "float32", **extra}
+        with open(self._staging / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        _swap_into_place(self._staging, self.index_dir)
+
+    def abort(self):
+        for f in self._files.values(): f.close()
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+def _run_embedding_pipeline(produce_batches, writer, model_name):
+    # Producer (discovery + chunking) runs in a thread and feeds a bounded queue of
+    # (metas, texts, embeddings-or-None) batches; this thread embeds each batch and hands it
+    # straight to the writer, so parsing overlaps encoding and only a few batches are in memory.
+    batches, producer_error = queue.Queue(maxsize=_PIPELINE_MAX_PENDING_BATCHES), []
+    stop, done = threading.Event(), object()
+
+    def _produce():
+        try:
+            for batch in produce_batches():
+                if stop.is_set(): break
+                batches.put(batch)
+        except BaseException as e:
+            producer_error.append(e)
+        finally:
+            batches.put(done)
+
+    producer = threading.Thread(target=_produce, name="index-producer", daemon=True)
+    producer.start()
+    embedded = 0
+    try:
+        while (batch := batches.get()) is not done:
+            metas, texts, embeddings = batch
+            if embeddings is None:
+                embeddings = _embed_texts_batch(texts, model_name, is_query=False, show_progress=False)
+                embedded += len(texts)
+                log(f"Info: Embedded {embedded} chunks...")
+            count("chunks", len(metas))
+            writer.add(embeddings, metas, texts)
+    finally:
+        stop.set()
+        while producer.is_alive():  # Unblock a producer stuck on a full queue.
+            try: batches.get(timeout=0.1)
+            except queue.Empty: pass
+    if producer_error: raise producer_error[0]
+    return embedded
+
+def _keep_unique(deduplicator, chunks, first_row, occurrences):
+    # Indices of the chunks that get rows (numbered from first_row); the others are recorded
+    # as occurrences of the row holding their canonical chunk.
+    kept = []
+    for i, chunk in enumerate(chunks):
+        row = deduplicator.canonical(chunk["source_code"], first_row + len(kept))
+        if row is None: kept.append(i)
+        else: occurrences.setdefault(row, []).append(occurrence(chunk))
+    return kept
+
+def build_index(repo_root_path, index_output_path, model_name=DEFAULT_MODEL, incremental=False, workers=None,
+                batch_size=EMBED_BATCH_CHUNKS, index_format=None, ann=None, nlist=None, quantize=None, tokenizer=None,
+                dedup=DEFAULT_DEDUP_MODE, shard=None, walked=None, parse_files=None):
+    import numpy as np
+    repo_root, index_file = Path(repo_root_path).resolve(), Path(index_output_path).resolve()
+    if not repo_root.is_dir(): raise FileNotFoundError(f"Repo root not found: {repo_root}")
+    # Format follows the output path unless given: "foo.npz" is the legacy archive, anything else a mmap directory.
+    index_format = index_format or ("npz" if index_file.suffix == ".npz" else "mmap")
+    previous = _load_previous_build(index_file, model_name) if incremental else None
+    print(f"Info: Scanning Python files in: {repo_root} for AST chunking...", file=sys.stderr)
+    # Unchanged files reuse rows of the previous index, the rest are parsed (in parallel) and
+    # embedded; keeping everything in file order makes an incremental build identical to a clean one.
+    file_records, reused_chunks = [], {}
+    with span("discovery"):
+        # build_all() hands in its shared file listing and parse stream.
+        if walked is None: walked = walk_files(repo_root, (".py",), _CODE_EXCLUDE_DIRS, workers=workers)
+        if shard:
+            # Only this shard's part of the repository; merge-index combines the parts.
+            shard_index, shard_total = parse_shard_spec(shard)
+            walked = [w for w in walked if shard_of(w.rel_path, shard_total) == shard_index]
+            shard = f"{shard_index}/{shard_total}"
+        py_files = [w.path for w in walked]
+        for py_path, rel_path_str, st in walked:
+            prev_state = previous["files"].get(rel_path_str) if previous else None
+            state = {**_file_state(py_path, repo_root, prev_state, st), "chunker": CHUNKER_VERSION}
+            file_records.append(state)
+            if prev_state and prev_state["sha256"] == state["sha256"] and prev_state.get("chunker") == CHUNKER_VERSION:
+                reused_chunks[rel_path_str] = previous["chunks_by_file"].get(rel_path_str, [])
+        # Copies of a chunk whose canonical file changed may become canonical themselves, and a
+        # copy's own source (a near duplicate, or different whitespace) is not stored: re-parse them.
+        for rel_path_str in [f for f in reused_chunks if not previous["depends_on"].get(f, set()) <= reused_chunks.keys()]:
+            del reused_chunks[rel_path_str]
+        changed_files = [p for p in py_files if str(p.relative_to(repo_root)) not in reused_chunks]
+    count("files", len(py_files)); count("bytes", sum(rec["size"] for rec in file_records))
+    print(f"Info: Found {len(py_files)} Python files to process" + (f" in shard {shard}." if shard else "."),
+          file=sys.stderr)
+    if previous:
+        dropped = set(previous["files"]) - {rec["file_path"] for rec in file_records}
+        print(f"Info: Incremental build: {len(reused_chunks)} unchanged, {len(changed_files)} added/changed, "
+              f"{len(dropped)} deleted files.", file=sys.stderr)
+
+    # Chunks are deduplicated before embedding: the first chunk with a given content gets a row,
+    # later copies (reused or freshly parsed alike) are recorded as occurrences of that row.
+    deduplicator, occurrences, n_rows = ChunkDeduplicator(dedup), {}, [0]
+
+    def _unique(chunks):
+        kept = _keep_unique(deduplicator, chunks, n_rows[0], occurrences)
+        n_rows[0] += len(kept)
+        return kept
+
+    def _produce():
+        if parse_files: parsed = parse_files(changed_files)
+        else: parsed = iter_file_chunks(changed_files, repo_root, workers=workers, extract_fn=_extract_ast_chunks_from_file)
+        pending = []
+        for rec in file_records:
+            if rec["file_path"] in reused_chunks:
+                if pending: yield (pending, [c["source_code"] for c in pending], None)
+                pending, entries = [], reused_chunks[rec["file_path"]]
+                chunks = [_located_chunk(previous["meta"][row], occ) for _, row, occ in entries]
+                kept = _unique(chunks)
+                if kept: yield (_add_token_counts([chunks[i] for i in kept], tokenizer), None,
+                                previous["embeddings"][[entries[i][1] for i in kept]])
+                continue
+            with span("parse", file=rec["file_path"]):
+                chunks = next(parsed)[1]
+                pending.extend(_add_token_counts([chunks[i] for i in _unique(chunks)], tokenizer))
+            while len(pending) >= batch_size:
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                yield (batch, [c["source_code"] for c in batch], None)
+        if pending: yield (pending, [c["source_code"] for c in pending], None)
+
+    writer = _StreamingNpzWriter(index_file) if index_format == "npz" else _StreamingMmapWriter(index_file)
+    try:
+        _run_embedding_pipeline(_produce, writer, model_name)
+        if not writer.count:
+            print("Warning: No AST chunks found to index. Creating an empty index.", file=sys.stderr)
+        with span("save"):
+            writer.close(files=np.array(file_records, dtype=object), model=np.array(model_name),
+                         occurrences=occurrences, **({"shard": shard} if shard else {}))
+    except BaseException:
+        writer.abort()
+        raise
+    if not writer.count:
+        print(f"Info: Empty index written to {index_file}", file=sys.stderr)
+        return
+    print(f"✓ Index with {writer.count} AST chunks written to {index_file}"
+          + (f" ({deduplicator.duplicates} duplicates stored as occurrences)" if deduplicator.duplicates else ""),
+          file=sys.stderr)
+    if ann == "ivf": build_ann_index(index_file, nlist=nlist)
+    if quantize: quantize_index(index_file, quantize)
+
+def _check_shard_specs(inputs, builds):
+    # Pieces of one `build --shard i/N` split must agree on N and not repeat a shard.
+    specs = [(path, parse_shard_spec(build["shard"])) for path, build in zip(inputs, builds) if build["shard"]]
+    if not specs: return
+    totals = {total for _, (_, total) in specs}
+    if len(totals) > 1: raise ValueError(f"Shards come from different splits: {', '.join(f'1/{t}' for t in sorted(totals))}.")
+    seen = {}
+    for path, (index, total) in specs:
+        if index in seen: raise ValueError(f"Shard {index}/{total} given twice: {seen[index]} and {path}.")
+        seen[index] = path
+    missing = sorted(set(range(1, totals.pop() + 1)) - set(seen))
+    if missing:
+        print(f"Warning: Shards {', '.join(map(str, missing))} of {specs[0][1][1]} are missing; their files "
+              f"will not be in the merged index.", file=sys.stderr)
+
+def merge_indices(input_paths, output_path, index_format=None, dedup=DEFAULT_DEDUP_MODE, model_name=None):
+    """
+    Combines dense code indices, typically the pieces of a `build --shard i/N` split.
+
+    An output path ending in .json becomes a shard manifest listing the inputs. Any other path
+    becomes one index (npz or mmap, as for build_index), with chunks in file order and
+    duplicates across inputs collapsed: the same index a single unsharded build produces.
+
+    Args:
+        input_paths (list[str | pathlib.Path]): Indices built with per-file state (any `build`).
+        output_path (str | pathlib.Path): Merged index, or shard manifest (*.json).
+        index_format (str, optional): "npz" or "mmap". Defaults to npz for *.npz paths, else mmap.
+        dedup (str, optional): "exact" (default), "near" or "off".
+        model_name (str, optional): Model every input must have been built with.
+
+    Raises:
+        FileNotFoundError: An input does not exist.
+        ValueError: The inputs disagree on model or embedding dimension, index the same file,
+            or are inconsistent shards of a split.
+    """
+    import numpy as np
+    inputs, output = [Path(p).resolve() for p in input_paths], Path(output_path).resolve()
+    if not inputs: raise ValueError("No indices to merge.")
+    for path in inputs:
+        if not path.exists(): raise FileNotFoundError(f"Index file not found: {path}")
+    builds = [_read_build(path) for path in inputs]
+    models = {build["model"] for build in builds} | ({model_name} if model_name else set())
+    if len(models) != 1: raise ValueError(f"Indices were built with different models: {', '.join(sorted(map(str, models)))}.")
+    dims = {build["embeddings"].shape[1] for build in builds if len(build["meta"])}
+    if len(dims) > 1: raise ValueError(f"Indices have different embedding dimensions: {sorted(dims)}.")
+    _check_shard_specs(inputs, builds)
+    owners = {}
+    for path, build in zip(inputs, builds):
+        for rel_path_str in build["files"]:
+            if rel_path_str in owners: raise ValueError(f"{rel_path_str} is indexed by both {owners[rel_path_str]} and {path}.")
+            owners[rel_path_str] = path
+
+    if output.suffix == ".json":
+        names = [f"shard-{parse_shard_spec(build['shard'])[0]}" if build["shard"] else path.stem
+                 for path, build in zip(inputs, builds)]
+        if len(set(names)) < len(names): names = [f"{name}-{i}" for i, name in enumerate(names, start=1)]
+        write_manifest(output, "code", [{"name": name, "path": path} for name, path in zip(names, inputs)])
+        print(f"✓ Shard manifest with {len(inputs)} indices written to {output}", file=sys.stderr)
+        return
+
+    model = models.pop()
+    by_path = dict(zip(inputs, builds))
+    deduplicator, occurrences, n_rows = ChunkDeduplicator(dedup), {}, [0]
+
+    def _produce():
+        # Every file's chunks and embeddings come from the input that built it, in global file order.
+        for rel_path_str in sorted(owners):
+            build = by_path[owners[rel_path_str]]
+            entries = build["chunks_by_file"].get(rel_path_str, [])
+            chunks = [_located_chunk(build["meta"][row], occ) for _, row, occ in entries]
+            kept = _keep_unique(deduplicator, chunks, n_rows[0], occurrences)
+            n_rows[0] += len(kept)
+            if kept: yield (_add_token_counts([chunks[i] for i in kept]), None,
+                            build["embeddings"][[entries[i][1] for i in kept]])
+
+    index_format = index_format or ("npz" if output.suffix == ".npz" else "mmap")
+    writer = _StreamingNpzWriter(output) if index_format == "npz" else _StreamingMmapWriter(output)
+    try:
+        _run_embedding_pipeline(_produce, writer, model)
+        with span("save"):
+            files = [by_path[owners[rel_path_str]]["files"][rel_path_str] for rel_path_str in sorted(owners)]
+            writer.close(files=np.array(files, dtype=object), model=np.array(model), occurrences=occurrences)
+    except BaseException:
+        writer.abort()
+        raise
+    print(f"✓ Merged {len(inputs)} indices ({writer.count} chunks, {len(owners)} files) into {output}", file=sys.stderr)
+
+class _LazyMetaList(Sequence):
+    """Read-only sequence of chunk metadata backed by a mmap index directory.
+
+    Records are decoded from meta.jsonl and sources.bin only when indexed, so opening an
+    index costs the same regardless of its size.
+    """
+
+    def __init__(self, index_dir, count):
+        import numpy as np
+        self._count = count
+        self._meta_offsets = _memmap_or_empty(index_dir / "meta_offsets.i64", np.int64, (count + 1,))
+        self._source_offsets = _memmap_or_empty(index_dir / "source_offsets.i64", np.int64, (count + 1,))
+        self._meta_buf = _mmap_bytes(index_dir / "meta.jsonl")
+        self._source_buf = _mmap_bytes(index_dir / "sources.bin")
+        self._occurrences = {}
+        if (index_dir / "occurrences.jsonl").exists():
+            with open(index_dir / "occurrences.jsonl", encoding="utf-8") as f:
+                self._occurrences = {rec["row"]: rec["occurrences"] for rec in map(json.loads, f)}
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, idx, with_source=True):
+        record = json.loads(self._meta_buf[int(self._meta_offsets[idx]):int(self._meta_offsets[idx + 1])])
+        if idx in self._occurrences: record["occurrences"] = self._occurrences[idx]
+        if with_source:
+            start, end = int(self._source_offsets[idx]), int(self._source_offsets[idx + 1])
+            record["source_code"] = self._source_buf[start:end].decode("utf-8", errors="surrogatepass")
+        return record
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice): return [self._record(i) for i in range(*idx.indices(self._count))]
+        idx = int(idx)
+        if idx < 0: idx += self._count
+        if not 0 <= idx < self._count: raise IndexError(idx)
+        return self._record(idx)
+
+    def iter_records(self, with_source=True):
+        for idx in range(self._count): yield self._record(idx, with_source)
+
+def _memmap_or_empty(path, dtype, shape):
+    import numpy as np
+    # np.memmap refuses zero-length files, which empty indices legitimately have.
+    if not shape[0] or 0 in shape: return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+def _mmap_bytes(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _read_mmap_manifest(index_dir):
+    with open(Path(index_dir) / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MMAP_INDEX_FORMAT:
+        raise ValueError(f"Not a {MMAP_INDEX_FORMAT} index: {index_dir}")
+    if manifest.get("version", 0) > MMAP_INDEX_VERSION:
+        raise ValueError(f"Index {index_dir} has format version {manifest['version']}; "
+                         f"this tool reads up to {MMAP_INDEX_VERSION}.")
+    return manifest
+
+def _load_mmap_index(index_dir):
+    import numpy as np
+    index_dir = Path(index_dir)
+    manifest = _read_mmap_manifest(index_dir)
+    count, dim = manifest["count"], manifest["dim"]
+    embeds = _memmap_or_empty(index_dir / "embeddings.f32", np.dtype(manifest["dtype"]), (count, dim))
+    return embeds, _LazyMetaList(index_dir, count)
+
+def _npz_memmap(npz_path, member="embeddings.npy"):
+    # An uncompressed float32 matrix in an .npz archive, memory-mapped in place, so a query only
+    # pages in the rows it reads; None for compressed (older) archives, which are loaded whole.
+    import numpy as np
+    with zipfile.ZipFile(npz_path) as zf:
+        try: info = zf.getinfo(member)
+        except KeyError: return None
+    if info.compress_type != zipfile.ZIP_STORED: return None
+    with open(npz_path, "rb") as f:
+        f.seek(info.header_offset)
+        name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])  # Of the local file header.
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    if fortran_order or dtype != np.float32 or len(shape) != 2 or not shape[0]: return None
+    return np.memmap(npz_path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+def _load_index_from_file(index_file_path):
+    import numpy as np
+    if Path(index_file_path).is_dir(): return _load_mmap_index(index_file_path)
+    data = np.load(index_file_path, allow_pickle=True)
+    if "embeddings" not in data or "meta" not in data:
+        raise ValueError(f"Index missing 'embeddings' or 'meta': {index_file_path}")
+    meta_list = [dict(item) for item in data["meta"]]
+    embeds_np = _npz_memmap(index_file_path)
+    if embeds_np is None: embeds_np = np.asarray(data["embeddings"], dtype=np.float32)
+    return embeds_np, meta_list
+
+def convert_npz_index(npz_path, output_dir, batch_size=EMBED_BATCH_CHUNKS):
+    import numpy as np
+    npz_path, output_dir = Path(npz_path).resolve(), Path(output_dir).resolve()
+    data = np.load(npz_path, allow_pickle=True)
+    if "embeddings" not in data or "meta" not in data:
+        raise ValueError(f"Index missing 'embeddings' or 'meta': {npz_path}")
+    embeds_np, meta_np = data["embeddings"], data["meta"]
+    writer = _StreamingMmapWriter(output_dir)
+    try:
+        for start in range(0, len(meta_np), batch_size):
+            writer.add(embeds_np[start:start + batch_size], [dict(m) for m in meta_np[start:start + batch_size]])
+        writer.close(files=data["files"] if "files" in data else (),
+                     model=str(data["model"]) if "model" in data else None)
+    except BaseException:
+        writer.abort()
+        raise
+    print(f"✓ Converted {npz_path} ({writer.count} chunks) to {output_dir}", file=sys.stderr)
+
+def _ann_path(index_file_path):
+    index_file_path = Path(index_file_path)
+    if index_file_path.is_dir(): return index_file_path / "ivf.npz"
+    return index_file_path.with_name(f"{index_file_path.stem}.ivf.npz")
+
+def build_ann_index(index_file_path, nlist=None):
+    from context_store_vectors import build_ivf, save_ivf
+    idx_path = Path(index_file_path).resolve()
+    embeds, _ = _load_index_from_file(idx_path)
+    if embeds.size == 0:
+        print(f"Warning: {idx_path} is empty; no ANN index built.", file=sys.stderr)
+        return None
+    start = time.perf_counter()
+    ivf = build_ivf(embeds, nlist=nlist)
+    save_ivf(_ann_path(idx_path), ivf)
+    print(f"✓ IVF index with {len(ivf['centroids'])} lists written to {_ann_path(idx_path)} "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return ivf
+
+def _file_stamp(path):
+    # (mtime, size, inode) of an index file, or of the manifest of an index directory;
+    # lets long-running processes such as the query daemon notice rebuilt indices.
+    target = path / "manifest.json" if path.is_dir() else path
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+def _get_cached_index(idx_path):
+    def load():
+        if not idx_path.exists(): raise FileNotFoundError(f"Index file not found: {idx_path}")
+        if idx_path in _CACHED_INDICES: print(f"Info: {idx_path} changed on disk; reloading.", file=sys.stderr)
+        with span("load", index=str(idx_path)):
+            return _load_index_from_file(idx_path)
+    return _load_cached("code", _CACHED_INDICES, idx_path, _file_stamp(idx_path), load)
+
+def _get_ann_index(idx_path, embeds):
+    from context_store_vectors import load_ivf, sidecar_matches
+    ann_file = _ann_path(idx_path)
+    def load():
+        if not ann_file.exists(): return None
+        ivf = load_ivf(ann_file)
+        if sidecar_matches(ivf, embeds): return ivf
+        print(f"Warning: {ann_file} is stale for {idx_path}; using exact search. "
+              f"Re-run build-ann to refresh it.", file=sys.stderr)
+        return None
+    return _load_cached("ann", _CACHED_ANN, idx_path, (_file_stamp(ann_file), _file_stamp(idx_path)), load)
+
+def _quant_path(index_file_path):
+    index_file_path = Path(index_file_path)
+    if index_file_path.is_dir(): return index_file_path / "quant.npz"
+    return index_file_path.with_name(f"{index_file_path.stem}.quant.npz")
+
+def _sample_queries(embeds, n_queries, seed=0):
+    # Perturbed index rows stand in for real queries so recall can be measured without a model.
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(embeds.shape[0], size=min(n_queries, embeds.shape[0]), replace=False))
+    queries = np.asarray(embeds[sample], dtype=np.float32) + rng.normal(0, 0.05, (len(sample), embeds.shape[1]))
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def _print_quantization_report(rows, k):
+    # total_MB is what the index takes on disk: the codes plus the float32 matrix kept for rescoring.
+    print(f"scheme   bytes/vec  codes_MB  total_MB  recall@{k}  rescored")
+    for row in rows:
+        print(f"{row['scheme']:<8} {row['bytes_per_vector']:>9} {row['code_bytes'] / 2**20:>9.2f} "
+              f"{row['total_bytes'] / 2**20:>9.2f} {row['recall']:>9.3f} {row['recall_rescored']:>9.3f}")
+
+def quantize_index(index_file_path, scheme, report_queries=100, k=10):
+    import numpy as np
+    from context_store_vectors import quantization_report, quantize_embeddings, save_quantized
+    idx_path = Path(index_file_path).resolve()
+    embeds, _ = _load_index_from_file(idx_path)
+    if embeds.size == 0:
+        print(f"Warning: {idx_path} is empty; nothing to quantize.", file=sys.stderr)
+        return None
+    quantized = quantize_embeddings(embeds, scheme)
+    save_quantized(_quant_path(idx_path), quantized)
+    code_mb, float_mb = _quant_path(idx_path).stat().st_size / 2**20, embeds.nbytes / 2**20
+    print(f"✓ {scheme} codes written to {_quant_path(idx_path)}: the index now takes {code_mb + float_mb:.2f} MB "
+          f"on disk ({float_mb:.2f} MB float32 kept for rescoring + {code_mb:.2f} MB codes).", file=sys.stderr)
+    if not isinstance(embeds, np.memmap):
+        print(f"Warning: {idx_path} stores its embeddings compressed, so every query process loads them whole. "
+              f"Rebuild it to have queries memory-map them and read only the rescored rows.", file=sys.stderr)
+    if report_queries:
+        _print_quantization_report(quantization_report(embeds, _sample_queries(embeds, report_queries), k=k,
+                                                       schemes=(scheme,)), k)
+    return quantized
+
+def _get_quantized(idx_path, embeds):
+    from context_store_vectors import load_quantized, sidecar_matches
+    quant_file = _quant_path(idx_path)
+    def load():
+        if not quant_file.exists(): return None
+        quantized = load_quantized(quant_file)
+        if sidecar_matches(quantized, embeds): return quantized
+        print(f"Warning: {quant_file} is stale for {idx_path}; searching full-precision embeddings. "
+              f"Re-run quantize to refresh it.", file=sys.stderr)
+        return None
+    return _load_cached("quant", _CACHED_QUANT, idx_path, (_file_stamp(quant_file), _file_stamp(idx_path)), load)
+
+def _search_index(idx_path, embeds, q_embed, k, search, nprobe, rescore=True):
+    from context_store_vectors import exact_search, ivf_candidates, ivf_search, quantized_search
+    ivf = _get_ann_index(idx_path, embeds) if search != "exact" else None
+    if search == "ivf" and ivf is None:
+        print(f"Warning: No usable ANN index for {idx_path}; falling back to exact search.", file=sys.stderr)
+    quantized = _get_quantized(idx_path, embeds) if search != "exact" else None
+    if quantized is not None:
+        candidates = ivf_candidates(ivf, q_embed, nprobe) if ivf is not None else None
+        if candidates is not None and len(candidates) < k: candidates = None
+        return quantized_search(quantized, q_embed, k, full_embeddings=embeds if rescore else None,
+                                candidates=candidates)[0]
+    if ivf is not None: return ivf_search(embeds, ivf, q_embed, k, nprobe=nprobe)[0]
+    return exact_search(embeds, q_embed, k)[0]
+
+def _chunk_token_count(chunk_meta, tokenizer=None):
+    # Counts stored at build time are keyed by tokenizer name; other tokenizers count on the fly.
+    stored = chunk_meta.get("token_counts", {}).get(tokenizer or active_tokenizer())
+    return stored if stored is not None else count_tokens(chunk_meta["source_code"], tokenizer)
+
+def _add_token_counts(chunks, tokenizer=None):
+    tokenizer = tokenizer or active_tokenizer()
+    for chunk in chunks:
+        counts = chunk.setdefault("token_counts", {})
+        if tokenizer not in counts: counts[tokenizer] = count_tokens(chunk["source_code"], tokenizer)
+    return chunks
+
+def _format_code_hits(meta_list, top_indices, tokenizer=None):
+    results = []
+    for hit_idx in top_indices:
+        chunk_meta = meta_list[hit_idx]
+        results.append({
+            "chunk_id": chunk_id(chunk_meta["file_path"], chunk_meta["element_name"],
+                                 chunk_meta["start_line"], chunk_meta["end_line"]),
+            "file": chunk_meta["file_path"], "lines": f"{chunk_meta['start_line']}-{chunk_meta['end_line']}",
+            "snippet": chunk_meta["source_code"], "element_name": chunk_meta["element_name"],
+            "element_type": chunk_meta["element_type"], "docstring": chunk_meta["docstring"],
+            "token_count": _chunk_token_count(chunk_meta, tokenizer)
+        })
+        for key in ("parent", "window"):
+            if chunk_meta.get(key): results[-1][key] = chunk_meta[key]
+        if chunk_meta.get("occurrences"): results[-1]["occurrences"] = format_occurrences(chunk_meta["occurrences"])
+    return results
+
+def _class_outline(source_code, docstring):
+    # Decorators and the class statement up to its colon, then the docstring.
+    lines = source_code.splitlines(True)
+    end = next((i for i, line in enumerate(lines) if line.rstrip().endswith(":") and not line.lstrip().startswith("@")),
+               len(lines) - 1)
+    body = '    """' + docstring.replace("\n", "\n    ") + '"""\n' if docstring else ""
+    return "".join(lines[:end + 1]) + body + "    ...\n"
+
+def _pack_results(results, relevances, k, max_tokens, trim_classes=False, tokenizer=None):
+    # Choose the hits (each whole or, with trim_classes, a class as its outline) with the highest
+    # total relevance whose token counts fit in max_tokens, keeping rank order.
+    variants = []
+    for result, relevance in zip(results, relevances):
+        relevance = max(float(relevance), 1e-9)
+        token_count = result.get("token_count")
+        if token_count is None: token_count = count_tokens(result.get("snippet", result.get("signature", "")), tokenizer)
+        options = [(relevance, token_count, None)]
+        if trim_classes and result.get("element_type") == "ClassDef" and "snippet" in result:
+            outline = _class_outline(result["snippet"], result.get("docstring", ""))
+            options.append((relevance * TRIMMED_CLASS_RELEVANCE, count_tokens(outline, tokenizer), outline))
+        variants.append(options)
+    chosen = select_within_budget([[(value, cost) for value, cost, _ in options] for options in variants],
+                                  max_tokens, k)
+    if not chosen and variants:  # Nothing fits: return the best hit in its smallest form rather than nothing.
+        chosen = [(0, min(range(len(variants[0])), key=lambda j: variants[0][j][1]))]
+    packed = []
+    for i, j in chosen:
+        _, token_count, outline = variants[i][j]
+        result = {**results[i], "token_count": token_count}
+        if outline is not None: result.update(snippet=outline, trimmed=True)
+        packed.append(result)
+    return packed
+
+def _score_code_index(idx_path, embeds, q_embeds, n_candidates, search, nprobe, rescore):
+    # Per query, the rows of the index's top n_candidates chunks and their cosine similarities.
+    from context_store_vectors import exact_search_batch
+    approximate = search != "exact" and (_get_ann_index(idx_path, embeds) is not None
+                                         or _get_quantized(idx_path, embeds) is not None)
+    with span("score", queries=len(q_embeds), search=search if approximate or search == "ivf" else "exact"):
+        if approximate or search == "ivf":
+            top_rows = [_search_index(idx_path, embeds, q_embed, n_candidates, search, nprobe, rescore)
+                        for q_embed in q_embeds]
+            # Quantized scores are not cosines; pack by the full-precision similarity of the few hits.
+            top_scores = [embeds[rows] @ q_embed if len(rows) else rows for rows, q_embed in zip(top_rows, q_embeds)]
+        else:
+            top_rows, top_scores = exact_search_batch(embeds, q_embeds, n_candidates)
+    return top_rows, top_scores
+
+def _top_k_merged(hits, scores, k):
+    # Global top-k of the hits gathered from all shards, best first.
+    import numpy as np
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(scores) > k: top = np.argpartition(-scores, k - 1)[:k]
+    else: top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [hits[i] for i in top], scores[top]
+
+def _get_sharded_code_context_batch(manifest_path, queries, k, max_tokens, query_model_name, search, nprobe, rescore,
+                                    trim_classes, tokenizer, shard_timeout):
+    import numpy as np
+    manifest = load_manifest(manifest_path)
+    if manifest["kind"] != "code": raise ValueError(f"{manifest_path} lists {manifest['kind']} indices, not code indices.")
+    count("queries", len(queries))
+    # Queries are encoded once; each shard then returns its own top candidates for every query.
+    q_embeds = np.atleast_2d(np.asarray(_embed_texts_batch(queries, query_model_name, is_query=True), dtype=np.float32))
+    n_candidates = k if max_tokens == float("inf") else max(4 * k, 20)
+
+    def _search_shard(shard):
+        embeds, meta_list = _get_cached_index(shard["path"])
+        if embeds.size == 0: return [([], []) for _ in queries]
+        if embeds.ndim == 1: embeds = embeds[np.newaxis, :]
+        if embeds.shape[1] != q_embeds.shape[1]:
+            raise ValueError(f"embedding dimension {embeds.shape[1]} does not match the query's {q_embeds.shape[1]}")
+        top_rows, top_scores = _score_code_index(shard["path"], embeds, q_embeds, n_candidates, search, nprobe, rescore)
+        with span("format", shard=shard["name"]):
+            per_query = [(_format_code_hits(meta_list, rows, tokenizer), scores) for rows, scores in zip(top_rows, top_scores)]
+        for hits, _ in per_query:
+            for hit in hits: hit["shard"] = shard["name"]
+        return per_query
+
+    answered = scatter(manifest["shards"], _search_shard, timeout=shard_timeout)
+    with span("merge", shards=len(answered)):
+        merged = []
+        for qi in range(len(queries)):
+            hits = [hit for _, per_query in answered for hit in per_query[qi][0]]
+            scores = [score for _, per_query in answered for score in per_query[qi][1]]
+            merged.append(_pack_results(*_top_k_merged(hits, scores, n_candidates), k, max_tokens, trim_classes,
+                                        tokenizer))
+        return merged
+
+def get_code_context_batch(queries, index_file_path, k=3, max_tokens=2000, query_model_name=DEFAULT_MODEL,
+                           search="auto", nprobe=DEFAULT_NPROBE, rescore=True, trim_classes=False, tokenizer=None,
+                           shard_timeout=DEFAULT_SHARD_TIMEOUT):
+    import numpy as np
+    idx_path = Path(index_file_path).resolve()
+    queries = list(queries)
+    if is_shard_manifest(idx_path):
+        if not queries: return []
+        return _get_sharded_code_context_batch(idx_path, queries, k, max_tokens, query_model_name, search, nprobe,
+                                               rescore, trim_classes, tokenizer, shard_timeout)
+    embeds, meta_list = _get_cached_index(idx_path)
+    if not queries: return []
+    count("queries", len(queries))
+    if embeds.size == 0: return [[] for _ in queries]
+    # One batched model call for every query, then one matrix-matrix product when exact.
+    q_embeds = np.asarray(_embed_texts_batch(queries, query_model_name, is_query=True), dtype=np.float32)
+    if embeds.ndim == 1: embeds = embeds[np.newaxis, :]
+    if q_embeds.ndim == 1: q_embeds = q_embeds[np.newaxis, :]
+    if embeds.shape[0] == 0 or embeds.shape[1] != q_embeds.shape[1]:
+        return [[] for _ in queries]
+    # A token budget is filled from a wider candidate pool than the k results it returns.
+    n_candidates = k if max_tokens == float("inf") else max(4 * k, 20)
+    top_rows, top_scores = _score_code_index(idx_path, embeds, q_embeds, n_candidates, search, nprobe, rescore)
+    with span("format"):
+        return [_pack_results(_format_code_hits(meta_list, rows, tokenizer), scores, k, max_tokens,
+                              trim_classes, tokenizer) for rows, scores in zip(top_rows, top_scores)]
+
+def get_code_context(query, index_file_path, k=3, max_tokens=2000, query_model_name=DEFAULT_MODEL,
+                     search="auto", nprobe=DEFAULT_NPROBE, rescore=True, trim_classes=False, tokenizer=None,
+                     shard_timeout=DEFAULT_SHARD_TIMEOUT):
+    return get_code_context_batch([query], index_file_path, k=k, max_tokens=max_tokens,
+                                  query_model_name=query_model_name, search=search, nprobe=nprobe,
+                                  rescore=rescore, trim_classes=trim_classes, tokenizer=tokenizer,
+                                  shard_timeout=shard_timeout)[0]
+
+def _fuse_ranked_lists(ranked_lists, weights, rrf_k=HYBRID_RRF_K):
+    # Weighted reciprocal-rank fusion over results keyed by chunk_id; the first list's dict wins.
+    fused, merged = {}, {}
+    for (name, results), weight in zip(ranked_lists, weights):
+        for rank, result in enumerate(results, start=1):
+            cid = result["chunk_id"]
+            fused[cid] = fused.get(cid, 0.0) + weight / (rrf_k + rank)
+            entry = merged.setdefault(cid, {**result, "retrievers": []})
+            for key, value in result.items(): entry.setdefault(key, value)
+            entry["retrievers"].append(name)
+    ranked = sorted(fused, key=lambda cid: -fused[cid])
+    return [merged[cid] for cid in ranked], [fused[cid] for cid in ranked]
+
+def get_hybrid_context(query, index_file_path, lexical_index_path, source_file_path=None, k=3, max_tokens=2000,
+                       query_model_name=DEFAULT_MODEL, lexical_weight=0.5, candidates=None, search="auto",
+                       nprobe=DEFAULT_NPROBE, rescore=True, trim_classes=False, tokenizer=None,
+                       shard_timeout=DEFAULT_SHARD_TIMEOUT):
+    # A confident exact identifier hit answers without loading the model or the dense index.
+    exact = exact_identifier_matches(query, lexical_index_path, source_file_path)
+    if exact:
+        lexical = query_json_context(query, lexical_index_path, source_file_path, k=k)
+        results, scores = _fuse_ranked_lists([("exact", exact), ("lexical", lexical)], [1.0, 0.0])
+        return _pack_results(results, scores, k, max_tokens, trim_classes, tokenizer)
+    candidates = candidates or max(4 * k, 20)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        lexical_future = pool.submit(query_json_context, query, lexical_index_path, source_file_path, k=candidates)
+        dense = get_code_context(query, index_file_path, k=candidates, max_tokens=float("inf"),
+                                 query_model_name=query_model_name, search=search, nprobe=nprobe, rescore=rescore,
+                                 tokenizer=tokenizer, shard_timeout=shard_timeout)
+        lexical = lexical_future.result()
+    results, scores = _fuse_ranked_lists([("dense", dense), ("lexical", lexical)],
+                                         [1.0 - lexical_weight, lexical_weight])
+    return _pack_results(results, scores, k, max_tokens, trim_classes, tokenizer)
+
+def _handle_build_cli(args):
+    build_index(repo_root_path=args.repo, index_output_path=args.index, model_name=args.model,
+                incremental=args.incremental, workers=args.workers, index_format=args.format,
+                ann=args.ann, nlist=args.nlist, quantize=args.quantize, tokenizer=args.tokenizer, dedup=args.dedup,
+                shard=args.shard)
+
+def _handle_merge_index_cli(args):
+    try:
+        merge_indices(args.inputs, args.output, index_format=args.format, dedup=args.dedup, model_name=args.model)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _handle_quant_report_cli(args):
+    from context_store_vectors import quantization_report
+    embeds, _ = _load_index_from_file(Path(args.index).resolve())
+    if embeds.size == 0:
+        print(f"Error: {args.index} is empty.", file=sys.stderr)
+        return
+    _print_quantization_report(quantization_report(embeds, _sample_queries(embeds, args.queries), k=args.k), args.k)
+
+def _handle_ann_recall_cli(args):
+    from context_store_vectors import load_ivf, measure_recall
+    embeds, _ = _load_index_from_file(Path(args.index).resolve())
+    ann_file = _ann_path(Path(args.index).resolve())
+    if embeds.size == 0 or not ann_file.exists():
+        print(f"Error: Need a non-empty index with an ANN sidecar ({ann_file}).", file=sys.stderr)
+        return
+    queries = _sample_queries(embeds, args.queries)
+    print(f"nprobe  recall@{args.k}  ivf_ms  exact_ms")
+    for row in measure_recall(embeds, load_ivf(ann_file), queries, k=args.k, nprobes=args.nprobe):
+        print(f"{row['nprobe']:>6}  {row['recall']:>9.3f}  {row['ivf_ms']:>6.2f}  {row['exact_ms']:>8.2f}")
+
+def _print_code_results(results):
+    if results:
+        print("=== Query Results ===")
+        for res_idx, res in enumerate(results):
+            print(f"\n--- Result {res_idx+1} ---")
+            print(f"File: {res['file']}")
+            print(f"Element: {res['element_name']} ({res['element_type']})")
+            print(f"Lines: {res['lines']}")
+            if res.get('docstring'): print(f"Docstring: {res['docstring'][:200]}{'...' if len(res['docstring']) > 200 else ''}")
+            if res.get('retrievers'): print(f"Found by: {', '.join(res['retrievers'])}")
+            print(f"Snippet:\n{res.get('snippet', res.get('signature', ''))}")
+    else:
+        print("No relevant snippets found.")
+
+def _read_queries_file(queries_file):
+    # A .json file holds a list of query strings; anything else has one query per non-empty line.
+    text = Path(queries_file).read_text(encoding="utf-8")
+    if Path(queries_file).suffix == ".json": return [str(q) for q in json.loads(text)]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def _run_query(args, kind, local_fn, **params):
+    # Forward to a running query daemon when there is one; otherwise answer in-process.
+    # With --metrics the query always runs here, so the trace covers the actual work.
+    if not args.no_daemon and not args.metrics:
+        result = daemon_request(kind, params)
+        if result is not NO_DAEMON: return result
+    return local_fn(**params)
+
+def _handle_query_cli(args):
+    try:
+        search_kwargs = dict(index_file_path=str(Path(args.index).resolve()), k=args.k, max_tokens=args.max_tokens,
+                             query_model_name=args.model, search=args.search, nprobe=args.nprobe,
+                             rescore=not args.no_rescore, trim_classes=args.trim_classes, tokenizer=args.tokenizer,
+                             shard_timeout=args.shard_timeout)
+        if args.queries_file:
+            queries = _read_queries_file(args.queries_file)
+            batched = _run_query(args, "code_batch", get_code_context_batch, queries=queries, **search_kwargs)
+            for query, results in zip(queries, batched):
+                print(f"\n##### Query: {query}")
+                _print_code_results(results)
+        else:
+            _print_code_results(_run_query(args, "code", get_code_context, query=args.query, **search_kwargs))
+    except FileNotFoundError as e: print(f"Error: {e}. Ensure index file exists.", file=sys.stderr)
+    except Exception as e: print(f"An error occurred during query: {e}", file=sys.stderr)
+
+def _handle_query_prose_cli(args):
+    results = _run_query(args, "prose", get_prose_context, query=args.query,
+                         index_file_path=str(Path(args.index).resolve()), k=args.k, model_name=args.model,
+                         shard_timeout=args.shard_timeout)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+def _handle_query_json_cli(args):
+    results = _run_query(args, "json", query_json_context, query_str=args.query,
+                         signatures_file_path_str=str(Path(args.signatures_file).resolve()),
+                         source_file_path_str=str(Path(args.source_file).resolve()) if args.source_file else None,
+                         k=args.k)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+def _handle_lookup_cli(args):
+    results = _run_query(args, "lookup", lookup_element, element_name=args.name,
+                         index_file_path_str=str(Path(args.index).resolve()), file_path=args.file,
+                         source_file_path_str=str(Path(args.source_file).resolve()) if args.source_file else None)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+def _handle_query_hybrid_cli(args):
+    try:
+        _print_code_results(_run_query(
+            args, "hybrid", get_hybrid_context, query=args.query, index_file_path=str(Path(args.index).resolve()),
+            lexical_index_path=str(Path(args.lexical_index).resolve()),
+            source_file_path=str(Path(args.source_file).resolve()) if args.source_file else None,
+            k=args.k, max_tokens=args.max_tokens, query_model_name=args.model, lexical_weight=args.lexical_weight,
+            search=args.search, nprobe=args.nprobe, trim_classes=args.trim_classes, tokenizer=args.tokenizer,
+            shard_timeout=args.shard_timeout))
+    except FileNotFoundError as e: print(f"Error: {e}. Ensure index file exists.", file=sys.stderr)
+
+def _handle_build_json_cli(args):
+    if args.format == "sqlite":
+        from context_store_sqlite import build_sqlite_index
+        build_sqlite_index(args.repo, f"{args.output_base_name}.db", workers=args.workers,
+                           incremental=args.incremental)
+    else:
+        build_json_indices(args.repo, Path(args.output_base_name).parent, workers=args.workers, dedup=args.dedup,
+                           base_name=Path(args.output_base_name).name, index_format=args.format)
+
+def process_source(path, text, elem_type, chunks, meta, repo):
+    lines = text.splitlines(True)
+    if not lines:
+        return
+
+    active_headings_stack = []
+    discovered_headings_info = []
+    inside_code_block = False
+
+    for i, line_content in enumerate(lines):
+        stripped_line = line_content.lstrip()
+        # Toggle fenced code block state and skip the fence lines
+        if stripped_line.startswith("```"):
+            inside_code_block = not inside_code_block
+            continue
+        # Skip heading detection inside fenced code blocks
+        if inside_code_block:
+            continue
+        # Detect Markdown headings outside code blocks
+        if stripped_line.startswith("#"):
+            heading_level = len(stripped_line) - len(stripped_line.lstrip("#"))
+            heading_title = stripped_line[heading_level:].strip()
+
+            while active_headings_stack and active_headings_stack[-1][0] >= heading_level:
+                active_headings_stack.pop()
+            active_headings_stack.append((heading_level, heading_title))
+            discovered_headings_info.append((i, heading_level, list(active_headings_stack)))
+
+            log(f"Heading detected: Level {heading_level} - {heading_title} at line {i + 1}", level=2)
+
+    # Sentinel to mark end of last section
+    discovered_headings_info.append((len(lines), 0, []))
+
+    for idx in range(len(discovered_headings_info) - 1):
+        current_start, _, current_path = discovered_headings_info[idx]
+        next_start, _, _ = discovered_headings_info[idx + 1]
+
+        snippet_lines = lines[current_start:next_start]
+        # Ensure we don't skip chunks with valid content, even if small
+        if sum(1 for l in snippet_lines if l.strip()) < 1:
+            continue
+
+        snippet_text = ''.join(snippet_lines)
+        heading_path_str = " > ".join(title for _, title in current_path)
+
+        # Debugging the chunk addition (-vv)
+        log(f"Adding chunk for heading path: {heading_path_str} (Lines {current_start + 1} to {next_start})", level=2)
+        log(f"Chunk content: {snippet_text[:100]}...", level=2)  # First 100 chars of the chunk
+
+        meta.append({
+            "file_path": str(path.relative_to(repo)),
+            "heading_path": heading_path_str,
+            "element_type": elem_type,
+            "start_line": current_start + 1,
+            "end_line": next_start,
+        })
+        chunks.append(snippet_text)
+
+    # Debugging to confirm chunks are being processed
+    if not chunks:
+        log(f"No chunks added for {path}", level=2)
+
+
+def _load_previous_prose_build(index_file, model_name):
+    import numpy as np
+    if not index_file.is_file(): return None
+    try:
+        data = np.load(index_file, allow_pickle=True)
+        if "files" not in data or str(data["model"]) != model_name:
+            print(f"Info: {index_file} has no per-file state or another model; doing a full rebuild.", file=sys.stderr)
+            return None
+        meta, rows_by_file = data["metadata"], {}
+        for row_idx, chunk_meta in enumerate(meta):
+            rows_by_file.setdefault(chunk_meta["file_path"], []).append(row_idx)
+        return {"embeddings": data["embeddings"], "texts": data["texts"], "meta": meta,
+                "files": {rec["file_path"]: dict(rec) for rec in data["files"]}, "rows_by_file": rows_by_file}
+    except Exception as e:
+        print(f"Warning: Could not read previous index {index_file} ({e}); doing a full rebuild.", file=sys.stderr)
+        return None
+
+def build_prose_index(repo_root_path, index_output_path, model_name=DEFAULT_MODEL, batch_size=EMBED_BATCH_CHUNKS,
+                      incremental=False, walked=None):
+    import nbformat
+    import numpy as np
+    repo_root_path = Path(repo_root_path).resolve()
+    index_output_path = Path(index_output_path)
+
+    prose_extensions = {".md", ".txt", ".rst"}
+    notebook_extensions = {".ipynb"}
+
+    log("Starting build_prose_index")
+
+    def _chunk_file(file_path, chunks_text, chunks_meta):
+        if file_path.suffix in prose_extensions or file_path.suffix in notebook_extensions:
+            count("files"); count("bytes", file_path.stat().st_size)
+        if file_path.suffix in prose_extensions:
+            log(f"Processing prose file: {file_path}")
+            try:
+                text_content = file_path.read_text(encoding="utf-8")
+                elem_type = "Markdown" if file_path.suffix == ".md" else "ProseText"
+                process_source(file_path, text_content, elem_type, 
+                               chunks_text, chunks_meta, repo_root_path)
+            except Exception as e:
+                print(f"Error processing prose file {file_path}: {e}", file=sys.stderr)
+
+        elif file_path.suffix in notebook_extensions:
+            log(f"Processing notebook file: {file_path}")
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    notebook = nbformat.read(f, as_version=nbformat.NO_CONVERT)
+
+                markdown_cell_sources = []
+                for cell in notebook.cells:
+                    if "ignore" in cell.metadata.get("tags", []):
+                        continue
+
+                    if cell.cell_type == "markdown":
+                        log(f"Markdown cell detected in {file_path}: {cell.source[:100]}...", level=2)
+                        markdown_cell_sources.append(cell.source)
+                    elif cell.cell_type == "code":
+                        cell_source_stripped = cell.source.strip()
+                        if cell_source_stripped.startswith(("!", "%")):
+                            continue
+
+                if markdown_cell_sources:
+                    concatenated_markdown_content = "\n\n".join(markdown_cell_sources)
+                    process_source(file_path, concatenated_markdown_content, "Notebook",
+                                   chunks_text, chunks_meta, repo_root_path)
+            except Exception as e:
+                print(f"Error processing notebook {file_path}: {e}", file=sys.stderr)
+
+    file_records = []
+
+    def _produce():
+        # Files are chunked one at a time and handed on in bounded batches; with incremental=True,
+        # files whose content hash is unchanged reuse their chunks and embeddings instead.
+        pending_text, pending_meta = [], []
+        # Hidden and excluded directories are pruned before the walk descends into them.
+        if walked is None:
+            files = walk_files(repo_root_path, prose_extensions | notebook_extensions, _PROSE_EXCLUDE_DIRS,
+                               skip_hidden=True)
+        else:
+            files = walked
+        for file_path, rel_path_str, st in files:
+            prev_state = previous["files"].get(rel_path_str) if previous else None
+            state = _file_state(file_path, repo_root_path, prev_state, st)
+            file_records.append(state)
+            if prev_state and prev_state["sha256"] == state["sha256"]:
+                if pending_text: yield (pending_meta, pending_text, None)
+                pending_text, pending_meta = [], []
+                rows = previous["rows_by_file"].get(rel_path_str, [])
+                if rows: yield ([dict(previous["meta"][row]) for row in rows], list(previous["texts"][rows]),
+                                previous["embeddings"][rows])
+                continue
+
+            with span("chunk", file=rel_path_str):
+                _chunk_file(file_path, pending_text, pending_meta)
+            while len(pending_text) >= batch_size:
+                yield (pending_meta[:batch_size], pending_text[:batch_size], None)
+                pending_text, pending_meta = pending_text[batch_size:], pending_meta[batch_size:]
+        if pending_text:
+            yield (pending_meta, pending_text, None)
+
+    # Deriving the repository name for the .npz file
+    repo_name = repo_root_path.name
+    index_output_path = index_output_path / f"{repo_name}_prose_index.npz"
+
+    # Ensure the directory exists
+    log(f"Ensuring directory exists: {index_output_path.parent}")
+    index_output_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = _load_previous_prose_build(index_output_path, model_name) if incremental else None
+
+    writer = _StreamingNpzWriter(index_output_path, store_texts=True)
+    try:
+        # Embeddings are spilled to disk batch by batch while later files are still being chunked.
+        _run_embedding_pipeline(_produce, writer, model_name)
+        if not writer.count:
+            if not index_output_path.exists():
+                writer.abort()
+                log("Info: No text chunks found after exclusions. Prose index will not be built.", level=0)
+                return
+            # Every prose file is gone: replace the old index so it stops serving deleted documents.
+            log("Info: No text chunks found after exclusions. Writing an empty prose index.", level=0)
+
+        log(f"Saving the .npz file to {index_output_path}...")
+        with span("save"):
+            writer.close(meta_key="metadata", files=np.array(file_records, dtype=object), model=np.array(model_name))
+        
+        # Confirmation of saving completion
+        log(f"✓ Prose index built with {writer.count} chunks and saved to {index_output_path}", level=0)
+
+    except Exception as e:
+        writer.abort()
+        print(f"Failed to build or save prose index for {repo_root_path}: {e}", file=sys.stderr)
+
+
+def _load_prose_index(index_file_path):
+    import numpy as np
+    idx_path = Path(index_file_path).resolve()
+
+    def load():
+        with span("load", index=str(idx_path)):
+            data = np.load(str(idx_path), allow_pickle=True)
+            return data["embeddings"], data["texts"], list(data["metadata"])
+    return _load_cached("prose", _CACHED_PROSE_INDICES, idx_path, _file_stamp(idx_path), load)
+
+def _score_prose_index(embeddings, query_embedding, k):
+    # Top-k rows by cosine similarity (prose embeddings are not guaranteed to be normalized), best first.
+    import numpy as np
+    with span("score"):
+        q_norm = np.linalg.norm(query_embedding)
+        e_norm = np.linalg.norm(embeddings, axis=1)
+
+        similarities = np.zeros(embeddings.shape[0])
+        if q_norm != 0:
+            valid_e_norm_mask = e_norm > 0
+            if np.any(valid_e_norm_mask):
+                dot_product = np.dot(embeddings[valid_e_norm_mask], query_embedding)
+                similarities[valid_e_norm_mask] = dot_product / (e_norm[valid_e_norm_mask] * q_norm)
+
+        actual_k = min(k, len(similarities))
+        if actual_k <= 0: return np.empty(0, dtype=int), similarities[:0]
+        ids = np.argpartition(-similarities, actual_k - 1)[:actual_k]
+        ids = ids[np.argsort(-similarities[ids], kind="stable")].astype(int)
+        return ids, similarities[ids]
+
+def _format_prose_hits(meta, texts, ids):
+    results = []
+    with span("format"):
+        for i in ids:
+            m = meta[i]
+            results.append({
+                "file": m["file_path"],
+                "heading_path": m["heading_path"],
+                "element_type": m["element_type"],
+                "lines": f"{m['start_line']}-{m['end_line']}",
+                "snippet": texts[i],
+            })
+    return results
+
+def _get_sharded_prose_context(manifest_path, query, k, model_name, shard_timeout):
+    manifest = load_manifest(manifest_path)
+    if manifest["kind"] != "prose": raise ValueError(f"{manifest_path} lists {manifest['kind']} indices, not prose indices.")
+    count("queries")
+    query_embedding = _embed_texts_batch([query], model_name, is_query=True)
+    if query_embedding.ndim > 1: query_embedding = query_embedding[0]
+
+    def _search_shard(shard):
+        embeddings, texts, meta = _load_prose_index(shard["path"])
+        if embeddings.size == 0 or len(texts) == 0: return [], []
+        ids, scores = _score_prose_index(embeddings, query_embedding, k)
+        return [{**hit, "shard": shard["name"]} for hit in _format_prose_hits(meta, texts, ids)], scores
+
+    answered = scatter(manifest["shards"], _search_shard, timeout=shard_timeout)
+    with span("merge", shards=len(answered)):
+        hits = [hit for _, (shard_hits, _) in answered for hit in shard_hits]
+        scores = [score for _, (_, shard_scores) in answered for score in shard_scores]
+        return _top_k_merged(hits, scores, k)[0]
+
+def get_prose_context(query, index_file_path, k=3, model_name=DEFAULT_MODEL, shard_timeout=DEFAULT_SHARD_TIMEOUT):
+    if is_shard_manifest(index_file_path):
+        return _get_sharded_prose_context(Path(index_file_path).resolve(), query, k, model_name, shard_timeout)
+    try:
+        embeddings, texts, meta = _load_prose_index(index_file_path)
+    except FileNotFoundError:
+        print(f"Error: Index file not found at {index_file_path}", file=sys.stderr)
+        return []
+    except KeyError as e:
+        print(f"Error: Index file {index_file_path} is missing expected field: {e}", file=sys.stderr)
+        return []
+
+    if embeddings.size == 0 or len(texts) == 0:
+        print(f"Warning: Index {index_file_path} contains no data.", file=sys.stderr)
+        return []
+        
+    count("queries")
+    query_embedding = _embed_texts_batch([query], model_name, is_query=True)
+    if query_embedding.ndim > 1:
+        query_embedding = query_embedding[0]
+
+    ids, _ = _score_prose_index(embeddings, query_embedding, k)
+    return _format_prose_hits(meta, texts, ids)
+
+_DAEMON_DISPATCH = {
+    "code": get_code_context,
+    "code_batch": get_code_context_batch,
+    "prose": get_prose_context,
+    "json": query_json_context,
+    "lookup": lookup_element,
+    "hybrid": get_hybrid_context,
+}
+
+def serve(host="127.0.0.1", port=0, preload_indices=(), model_name=DEFAULT_MODEL, state_file=None, verbose=False):
+    daemon = QueryDaemon(_DAEMON_DISPATCH, host=host, port=port, state_file=state_file, verbose=verbose)
+    for index_path in preload_indices:
+        _get_cached_index(Path(index_path).resolve())
+    if preload_indices: _get_sentence_transformer_model(model_name)
+    daemon.serve_until_interrupted()
+
+_PROSE_SUFFIXES = (".md", ".rst", ".txt", ".ipynb")
+
+def update_indices(repo_root_path, changed_paths=None, index=None, lexical_base=None, lexical_format="json",
+                   prose_output=None, model_name=DEFAULT_MODEL, workers=None, dedup=DEFAULT_DEDUP_MODE):
+    # Incremental rebuild of every given index the changed files can affect (all of them when
+    # changed_paths is None). Each builder swaps its output into place atomically.
+    repo_root = Path(repo_root_path).resolve()
+    code_paths = None if changed_paths is None else [p for p in changed_paths if p.endswith(".py")]
+    if code_paths is None or code_paths:
+        if index:
+            build_index(repo_root, index, model_name=model_name, incremental=True, workers=workers, dedup=dedup)
+        if lexical_base and lexical_format == "sqlite":
+            from context_store_sqlite import build_sqlite_index
+            build_sqlite_index(repo_root, f"{lexical_base}.db", workers=workers, incremental=True)
+        elif lexical_base:
+            build_json_indices(repo_root, Path(lexical_base).parent, workers=workers, base_name=Path(lexical_base).name,
+                               dedup=dedup, changed_files=code_paths, index_format=lexical_format)
+    if prose_output and (changed_paths is None or any(p.endswith(_PROSE_SUFFIXES) for p in changed_paths)):
+        build_prose_index(repo_root, prose_output, model_name, incremental=True)
+
+class _SharedParse:
+    # One parse of every .py file for build_all(): each file is read and parsed once (in the
+    # worker pool) into both chunkings. The dense build consumes the stream first, as it goes,
+    # and the lexical elements it passes over are spilled to a temporary JSON-lines file, so
+    # they never sit in memory; the lexical build reads them back, then takes the rest of the
+    # stream. Both take their files in sorted order, so neither stream is ever rewound.
+
+    def __init__(self, repo_root, code, lexical, workers):
+        py_files = sorted({w.rel_path: w.path for w in code + lexical}.items())
+        self._stream = iter_file_chunks([path for _, path in py_files], repo_root, workers=workers,
+                                        extract_fn=_extract_shared_chunks)
+        self._lexical_files, self._spill = {w.path for w in lexical}, None
+
+    def _next(self):
+        path, chunks = next(self._stream)
+        dense, lexical = chunks or ([], [])  # No chunks when the file failed to parse.
+        return path, dense, lexical
+
+    def code_chunks(self, files):
+        for wanted in files:
+            while True:
+                path, dense, lexical = self._next()
+                if path in self._lexical_files:
+                    if self._spill is None: self._spill = tempfile.TemporaryFile("w+", encoding="utf-8")
+                    self._spill.write(json.dumps([str(path), lexical], ensure_ascii=False) + "\n")
+                if path == wanted: break
+            yield path, dense
+
+    def _spilled(self):
+        if self._spill is None: return
+        with self._spill:
+            self._spill.seek(0)
+            for line in self._spill:
+                path, lexical = json.loads(line)
+                yield Path(path), lexical
+
+    def _next_lexical(self):
+        while True:
+            path, _, lexical = self._next()
+            if path in self._lexical_files: return path, lexical
+
+    def lexical_chunks(self, files):
+        spilled = self._spilled()
+        for wanted in files:
+            while True:
+                path, lexical = next(spilled, None) or self._next_lexical()
+                if path == wanted: break
+            yield wanted, lexical
+
+def build_all(repo_root_path, index=None, lexical_base=None, lexical_format="json", prose_output=None,
+              model_name=DEFAULT_MODEL, workers=None, dedup=DEFAULT_DEDUP_MODE, index_format=None, tokenizer=None):
+    # Full builds of the given indices from one snapshot of the repository: one walk, one
+    # parse per .py file shared by the dense and lexical indices, and one model load (models
+    # are cached per process) for code and prose.
+    repo_root = Path(repo_root_path).resolve()
+    if not repo_root.is_dir(): raise FileNotFoundError(f"Repo root not found: {repo_root}")
+    if not (index or lexical_base or prose_output): raise ValueError("Nothing to build: give at least one index.")
+    # Prune only what every index skips; each index then drops its own exclusions from the listing.
+    common = [d for d in _CODE_EXCLUDE_DIRS if d in _EXCLUDE_DIRS and (d.startswith(".") or d in _PROSE_EXCLUDE_DIRS)]
+    with span("discovery"):
+        walked = walk_files(repo_root, (".py",) + _PROSE_SUFFIXES, common, workers=workers)
+    py_files = [w for w in walked if w.rel_path.endswith(".py")]
+    code = [w for w in py_files if not is_excluded(w.rel_path, _CODE_EXCLUDE_DIRS)] if index else []
+    lexical = [w for w in py_files if not is_excluded(w.rel_path, _EXCLUDE_DIRS)] if lexical_base else []
+    prose = [w for w in walked if w.rel_path.endswith(_PROSE_SUFFIXES)
+             and not is_excluded(w.rel_path, _PROSE_EXCLUDE_DIRS, skip_hidden=True)] if prose_output else []
+    print(f"Info: One pass over {len(walked)} files: {len(code)} code, {len(lexical)} lexical, {len(prose)} prose.",
+          file=sys.stderr)
+    shared = _SharedParse(repo_root, code, lexical, workers)
+    if index:
+        build_index(repo_root, index, model_name=model_name, workers=workers, index_format=index_format,
+                    tokenizer=tokenizer, dedup=dedup, walked=code, parse_files=shared.code_chunks)
+    if lexical_base and lexical_format == "sqlite":
+        from context_store_sqlite import build_sqlite_index
+        build_sqlite_index(repo_root, f"{lexical_base}.db", workers=workers, walked=lexical,
+                           parse_files=shared.lexical_chunks)
+    elif lexical_base:
+        build_json_indices(repo_root, Path(lexical_base).parent, workers=workers, base_name=Path(lexical_base).name,
+                           dedup=dedup, walked=lexical, parse_files=shared.lexical_chunks, index_format=lexical_format)
+    if prose_output:
+        build_prose_index(repo_root, prose_output, model_name, walked=prose)
+
+def watch_repo(repo_root_path, index=None, lexical_base=None, lexical_format="json", prose_output=None,
+               model_name=DEFAULT_MODEL, workers=None, dedup=DEFAULT_DEDUP_MODE, interval=DEFAULT_POLL_INTERVAL,
+               debounce=DEFAULT_DEBOUNCE, use_inotify=True, stop_event=None):
+    repo_root = Path(repo_root_path).resolve()
+    if not repo_root.is_dir(): raise FileNotFoundError(f"Repo root not found: {repo_root}")
+    if not (index or lexical_base or prose_output): raise ValueError("Nothing to update: give at least one index.")
+    targets = dict(index=index, lexical_base=lexical_base, lexical_format=lexical_format, prose_output=prose_output,
+                   model_name=model_name, workers=workers, dedup=dedup)
+    stop_event = stop_event or threading.Event()
+    watcher = RepoWatcher(repo_root, interval=interval, debounce=debounce, use_inotify=use_inotify)
+    failed = set()  # Changes of a failed update are retried with the next batch.
+    try:
+        with span("update"): update_indices(repo_root, None, **targets)
+        print(f"Info: Watching {repo_root} ({watcher.backend}); press Ctrl+C to stop.", file=sys.stderr)
+        while not stop_event.is_set():
+            changed = watcher.wait_for_changes(timeout=interval)
+            if not changed: continue
+            changed, failed = changed | failed, set()
+            log(f"Changed: {', '.join(sorted(changed))}")
+            print(f"Info: {len(changed)} files changed; updating indices...", file=sys.stderr)
+            try:
+                with span("update", files=len(changed)): update_indices(repo_root, changed, **targets)
+            except Exception as e:
+                failed = changed
+                print(f"Error: Index update failed ({e}); retrying with the next change.", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+def _handle_shard_add_cli(args):
+    try:
+        action = add_shard(args.manifest, args.name, args.index, kind=args.kind)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not Path(args.index).exists(): print(f"Warning: {args.index} does not exist yet.", file=sys.stderr)
+    print(f"✓ Shard {args.name} {action} in {args.manifest}", file=sys.stderr)
+
+def _handle_shard_remove_cli(args):
+    try:
+        remove_shard(args.manifest, args.name)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"✓ Shard {args.name} removed from {args.manifest}", file=sys.stderr)
+
+def _handle_shard_list_cli(args):
+    manifest = load_manifest(args.manifest)
+    for shard in manifest["shards"]:
+        print(f"{shard['name']}\t{manifest['kind']}\t{shard['path']}" + ("" if shard["path"].exists() else "\t(missing)"))
+
+def _handle_watch_cli(args):
+    try:
+        watch_repo(args.repo, index=args.index, lexical_base=args.output_base_name, lexical_format=args.lexical_format,
+                   prose_output=args.prose_output, model_name=args.model, workers=args.workers, dedup=args.dedup,
+                   interval=args.interval, debounce=args.debounce, use_inotify=not args.poll)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _handle_build_all_cli(args):
+    try:
+        build_all(args.repo, index=args.index, lexical_base=args.output_base_name, lexical_format=args.lexical_format,
+                  prose_output=args.prose_output, model_name=args.model, workers=args.workers, dedup=args.dedup,
+                  index_format=args.format, tokenizer=args.tokenizer)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _cli_main(argv=None):
+    if argv is None: argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Build or query AST-based dense code index.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", help="Sub-command to execute", required=True if argv else False)
+    cache_args = argparse.ArgumentParser(add_help=False)
+    cache_args.add_argument("--cache-dir", type=str, default=None,
+                            help=f"Embedding cache directory (default: {DEFAULT_CACHE_DIR}).")
+    cache_args.add_argument("--cache-max-mb", type=int, default=None,
+                            help=f"Embedding cache size limit in MB (default: {DEFAULT_CACHE_MAX_MB}).")
+    cache_args.add_argument("--no-cache", action="store_true", help="Do not read or write the embedding cache.")
+    
+    _json_build = subparsers.add_parser("build-json",
+                                        help="Export AST chunks to JSON context files")
+    _json_build.add_argument("--repo", required=True,
+                             help="Path to repository root")
+    _json_build.add_argument("--output-base-name", required=True,
+                             help="Base name for output JSON files")
+    _json_build.add_argument("--workers", type=int, default=None,
+                             help="Processes used to parse files (default: CPU count)")
+    _json_build.add_argument("--format", choices=["json", "jsonl", "sqlite"], default="json",
+                             help="'json' writes <base>_signatures.json and <base>_fullsource.json (default); "
+                                  "'jsonl' writes them as JSON Lines with offset sidecars, read lazily; "
+                                  "'sqlite' writes a single <base>.db with FTS5 search")
+    _json_build.add_argument("--incremental", action="store_true",
+                             help="With --format sqlite, only re-parse files changed since the last build")
+    _json_build.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE,
+                             help="Store duplicate elements once with their other locations (JSON format only)")
+    _json_build.set_defaults(func=_handle_build_json_cli)
+    
+    _json_query = subparsers.add_parser("query-json",
+                                        help="Query a JSON context store")
+    _json_query.add_argument("--signatures-file", required=True,
+                             help="Path to signatures JSON, or a SQLite index (.db)")
+    _json_query.add_argument("--source-file", default=None,
+                             help="Path to fullsource JSON (not needed for a SQLite index)")
+    _json_query.add_argument("--query", required=True,
+                             help="Search query string")
+    _json_query.add_argument("--k", type=int, default=3,
+                             help="Number of results to return")
+    _json_query.add_argument("--no-daemon", action="store_true",
+                             help="Answer in-process even if a query daemon is running")
+    _json_query.set_defaults(func=_handle_query_json_cli)
+
+    _lookup = subparsers.add_parser("lookup",
+                                    help="Look up functions/classes by exact name (\"function X in file Y\")")
+    _lookup.add_argument("--index", required=True,
+                         help="Path to signatures or fullsource JSON, or a SQLite index (.db)")
+    _lookup.add_argument("--name", required=True, help="Exact function or class name")
+    _lookup.add_argument("--file", default=None,
+                         help="Restrict to this file (repository-relative path or a trailing part of it)")
+    _lookup.add_argument("--source-file", default=None,
+                         help="Fullsource JSON to attach source from when --index is a signatures file")
+    _lookup.add_argument("--no-daemon", action="store_true",
+                         help="Answer in-process even if a query daemon is running")
+    _lookup.set_defaults(func=_handle_lookup_cli)
+
+    _pb = subparsers.add_parser("build-prose", help="Build prose embedding index", parents=[cache_args])
+    _pb.add_argument("--repo", required=True, help="Path to repo root")
+    _pb.add_argument("--output", required=True, help="Output base path for prose index")
+    _pb.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model name")
+    _pb.add_argument("--incremental", action="store_true",
+                     help="Reuse chunks and embeddings from the existing index for files whose content hash is unchanged")
+    _pb.set_defaults(func=lambda args: build_prose_index(args.repo, args.output, args.model,
+                                                         incremental=args.incremental))
+
+    _pq = subparsers.add_parser("query-prose", help="Query prose embedding index", parents=[cache_args])
+    _pq.add_argument("--index", required=True, help="Path to prose index (.npz) or shard manifest (.json)")
+    _pq.add_argument("--query", required=True, help="Query text")
+    _pq.add_argument("--k", type=int, default=3, help="Number of results")
+    _pq.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model name")
+    _pq.add_argument("--no-daemon", action="store_true", help="Answer in-process even if a query daemon is running")
+    _pq.add_argument("--shard-timeout", type=float, default=DEFAULT_SHARD_TIMEOUT,
+                     help="With a shard manifest, skip shards that have not answered after this many seconds")
+    _pq.set_defaults(func=_handle_query_prose_cli)
+    # Build
+    p_build = subparsers.add_parser("build", help="Build dense code index.", parents=[cache_args])
+    p_build.add_argument("--repo", type=str, required=True, help="Path to code repository root.")
+    p_build.add_argument("--index", type=str, required=True, help="Path to save output .npz index file.")
+    p_build.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model name.")
+    p_build.add_argument("--incremental", action="store_true",
+                         help="Reuse embeddings from an existing index for files whose content hash is unchanged.")
+    p_build.add_argument("--workers", type=int, default=None, help="Processes used to parse files (default: CPU count).")
+    p_build.add_argument("--format", choices=["npz", "mmap"], default=None,
+                         help="Index format (default: npz for *.npz paths, otherwise a memory-mapped index directory).")
+    p_build.add_argument("--ann", choices=["ivf"], default=None, help="Also build an approximate nearest-neighbour index.")
+    p_build.add_argument("--nlist", type=int, default=None, help="IVF lists (default: about 4*sqrt(chunks)).")
+    p_build.add_argument("--quantize", choices=QUANTIZE_CHOICES, default=None,
+                         help="Also store compressed codes that queries search before rescoring.")
+    p_build.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE,
+                         help="Embed duplicate chunks once and list their other locations: 'exact' (default), "
+                              "'near' (MinHash near-duplicates too) or 'off'.")
+    p_build.add_argument("--shard", type=str, default=None, metavar="I/N",
+                         help="Build only shard I of N (files are split by a hash of their path); "
+                              "combine the shards with merge-index.")
+    p_build.add_argument("--tokenizer", type=str, default=None,
+                         help="Tokenizer whose per-chunk token counts are stored for query-time packing: approx "
+                              "(default), whitespace, tiktoken[:encoding] or hf:<model>.")
+    # Quantization
+    p_quant = subparsers.add_parser("quantize", help="Store compressed codes next to an existing dense index.")
+    p_quant.add_argument("--index", type=str, required=True, help="Path to .npz index file or mmap index directory.")
+    p_quant.add_argument("--scheme", choices=QUANTIZE_CHOICES, required=True, help="Quantization scheme.")
+    p_quant.set_defaults(func=lambda args: quantize_index(args.index, args.scheme))
+    p_qreport = subparsers.add_parser("quant-report", help="Report size/recall of every quantization scheme.")
+    p_qreport.add_argument("--index", type=str, required=True, help="Path to .npz index file or mmap index directory.")
+    p_qreport.add_argument("--k", type=int, default=10, help="Recall cut-off.")
+    p_qreport.add_argument("--queries", type=int, default=200, help="Number of sampled queries.")
+    p_qreport.set_defaults(func=_handle_quant_report_cli)
+    # ANN
+    p_ann = subparsers.add_parser("build-ann", help="Build an IVF ANN index next to an existing dense index.")
+    p_ann.add_argument("--index", type=str, required=True, help="Path to .npz index file or mmap index directory.")
+    p_ann.add_argument("--nlist", type=int, default=None, help="IVF lists (default: about 4*sqrt(chunks)).")
+    p_ann.set_defaults(func=lambda args: build_ann_index(args.index, nlist=args.nlist))
+    p_recall = subparsers.add_parser("ann-recall", help="Measure ANN recall/latency against exact search.")
+    p_recall.add_argument("--index", type=str, required=True, help="Path to .npz index file or mmap index directory.")
+    p_recall.add_argument("--k", type=int, default=10, help="Recall cut-off.")
+    p_recall.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="nprobe values to test.")
+    p_recall.add_argument("--queries", type=int, default=200, help="Number of sampled queries.")
+    p_recall.set_defaults(func=_handle_ann_recall_cli)
+    p_build.set_defaults(func=_handle_build_cli)
+    # Convert
+    p_convert = subparsers.add_parser("convert-index", help="Convert a .npz code index to the memory-mapped format.")
+    p_convert.add_argument("--src", type=str, required=True, help="Existing .npz index file.")
+    p_convert.add_argument("--dst", type=str, required=True, help="Output index directory.")
+    p_convert.set_defaults(func=lambda args: convert_npz_index(args.src, args.dst))
+    # Query
+    p_query = subparsers.add_parser("query", help="Query dense code index.", parents=[cache_args])
+    p_query.add_argument("--index", type=str, required=True,
+                         help="Path to .npz index file, mmap index directory or shard manifest (.json).")
+    p_query_input = p_query.add_mutually_exclusive_group(required=True)
+    p_query_input.add_argument("--query", type=str, help="Natural language query string.")
+    p_query_input.add_argument("--queries-file", type=str,
+                               help="File with one query per line (or a JSON list); all are encoded and scored in one batch.")
+    p_query.add_argument("--k", type=int, default=3, help="Number of top results.")
+    p_query.add_argument("--max_tokens", type=int, default=2000,
+                         help="Token budget; results are chosen to maximize total relevance within it.")
+    p_query.add_argument("--tokenizer", type=str, default=None,
+                         help="Tokenizer for the budget (default: approx); counts stored by 'build' are reused.")
+    p_query.add_argument("--trim-classes", action="store_true",
+                         help="Let long classes be cut down to their signature and docstring to fit the budget.")
+    p_query.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model for query.")
+    p_query.add_argument("--search", choices=["auto", "exact", "ivf"], default="auto",
+                         help="auto uses the ANN index when one matches the dense index, else exact search.")
+    p_query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists probed per query (recall vs latency).")
+    p_query.add_argument("--no-rescore", action="store_true",
+                         help="Rank by quantized codes only, without full-precision rescoring.")
+    p_query.add_argument("--no-daemon", action="store_true", help="Answer in-process even if a query daemon is running.")
+    p_query.add_argument("--shard-timeout", type=float, default=DEFAULT_SHARD_TIMEOUT,
+                         help="With a shard manifest, skip shards that have not answered after this many seconds.")
+    # Hybrid query
+    p_hybrid = subparsers.add_parser("query-hybrid", parents=[cache_args],
+                                     help="Query the lexical and dense indices together, fused by reciprocal rank.")
+    p_hybrid.add_argument("--index", type=str, required=True,
+                          help="Dense code index (.npz file, mmap directory or shard manifest).")
+    p_hybrid.add_argument("--lexical-index", type=str, required=True,
+                          help="Signatures JSON or SQLite index built from the same repository.")
+    p_hybrid.add_argument("--source-file", type=str, default=None,
+                          help="Fullsource JSON, to attach source to lexical-only hits (not needed for SQLite).")
+    p_hybrid.add_argument("--query", type=str, required=True, help="Query string (identifiers or natural language).")
+    p_hybrid.add_argument("--k", type=int, default=3, help="Number of top results.")
+    p_hybrid.add_argument("--max_tokens", type=int, default=2000, help="Snippet token budget across results.")
+    p_hybrid.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model for query.")
+    p_hybrid.add_argument("--tokenizer", type=str, default=None, help="Tokenizer for the budget, as for 'query'.")
+    p_hybrid.add_argument("--trim-classes", action="store_true",
+                          help="Let long classes be cut down to their signature and docstring to fit the budget.")
+    p_hybrid.add_argument("--lexical-weight", type=float, default=0.5,
+                          help="Weight of the lexical ranking in the fusion (0..1); the dense ranking gets the rest.")
+    p_hybrid.add_argument("--search", choices=["auto", "exact", "ivf"], default="auto",
+                          help="Dense search mode, as for 'query'.")
+    p_hybrid.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists probed per query.")
+    p_hybrid.add_argument("--no-daemon", action="store_true", help="Answer in-process even if a query daemon is running.")
+    p_hybrid.add_argument("--shard-timeout", type=float, default=DEFAULT_SHARD_TIMEOUT,
+                          help="With a shard manifest, skip shards that have not answered after this many seconds.")
+    p_hybrid.set_defaults(func=_handle_query_hybrid_cli)
+    # Serve
+    p_serve = subparsers.add_parser("serve", help="Run a query daemon that keeps models and indices warm.")
+    p_serve.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on.")
+    p_serve.add_argument("--port", type=int, default=0, help="Port to listen on (0 picks a free one).")
+    p_serve.add_argument("--preload-index", type=str, nargs="*", default=[], help="Indices to load at start-up.")
+    p_serve.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Model to load at start-up with --preload-index.")
+    p_serve.add_argument("--state-file", type=str, default=None, help="Where to publish the daemon address and token.")
+    p_serve.set_defaults(func=lambda args: serve(args.host, args.port, args.preload_index, args.model,
+                                                 args.state_file, args.verbose > 0))
+    p_query.set_defaults(func=_handle_query_cli)
+    # Merge
+    p_merge = subparsers.add_parser("merge-index", help="Merge dense indices (e.g. build --shard pieces) into one.")
+    p_merge.add_argument("--inputs", type=str, nargs="+", required=True, help="Indices to merge.")
+    p_merge.add_argument("--output", type=str, required=True,
+                         help="Merged index (.npz file or mmap directory), or a shard manifest (*.json) listing the inputs.")
+    p_merge.add_argument("--format", choices=["npz", "mmap"], default=None,
+                         help="Index format (default: npz for *.npz paths, otherwise a memory-mapped index directory).")
+    p_merge.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE,
+                         help="Collapse duplicate chunks across the inputs, as for 'build'.")
+    p_merge.add_argument("--model", type=str, default=None, help="Fail unless every input was built with this model.")
+    p_merge.set_defaults(func=_handle_merge_index_cli)
+    # Shard manifests
+    p_shard_add = subparsers.add_parser("shard-add", help="Add a shard to a manifest, or replace the shard of that name.")
+    p_shard_add.add_argument("--manifest", type=str, required=True, help="Shard manifest (*.shards.json); created if missing.")
+    p_shard_add.add_argument("--name", type=str, required=True, help="Shard name, e.g. the service it indexes.")
+    p_shard_add.add_argument("--index", type=str, required=True, help="The shard's index file or directory.")
+    p_shard_add.add_argument("--kind", choices=SHARD_KINDS, default=None, help="Index kind of a new manifest (default: code).")
+    p_shard_add.set_defaults(func=_handle_shard_add_cli)
+    p_shard_rm = subparsers.add_parser("shard-remove", help="Remove a shard from a manifest.")
+    p_shard_rm.add_argument("--manifest", type=str, required=True, help="Shard manifest.")
+    p_shard_rm.add_argument("--name", type=str, required=True, help="Name of the shard to remove.")
+    p_shard_rm.set_defaults(func=_handle_shard_remove_cli)
+    p_shard_ls = subparsers.add_parser("shard-list", help="List the shards of a manifest.")
+    p_shard_ls.add_argument("--manifest", type=str, required=True, help="Shard manifest.")
+    p_shard_ls.set_defaults(func=_handle_shard_list_cli)
+    # Watch
+    p_watch = subparsers.add_parser("watch", help="Keep indices up to date while the repository changes.",
+                                    parents=[cache_args])
+    p_watch.add_argument("--repo", type=str, required=True, help="Path to repository root.")
+    p_watch.add_argument("--index", type=str, default=None, help="Dense code index to update (as for 'build').")
+    p_watch.add_argument("--output-base-name", type=str, default=None,
+                         help="Lexical index base to update (as for 'build-json').")
+    p_watch.add_argument("--lexical-format", choices=["json", "jsonl", "sqlite"], default="json",
+                         help="Format of the lexical index.")
+    p_watch.add_argument("--prose-output", type=str, default=None,
+                         help="Directory of the prose index to update (as 'build-prose --output').")
+    p_watch.add_argument("--model", type=str, default=DEFAULT_MODEL, help="SentenceTransformer model name.")
+    p_watch.add_argument("--workers", type=int, default=None, help="Processes used to parse files (default: CPU count).")
+    p_watch.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE, help="As for 'build'.")
+    p_watch.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                         help="Seconds between snapshots of the repository when polling (unused with inotify).")
+    p_watch.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                         help="Update once no file has changed for this many seconds.")
+    p_watch.add_argument("--poll", action="store_true", help="Poll even where inotify is available.")
+    p_watch.set_defaults(func=_handle_watch_cli)
+    p_build_all = subparsers.add_parser("build-all", help="Build dense, lexical and prose indices in one pass.",
+                                        parents=[cache_args])
+    p_build_all.add_argument("--repo", type=str, required=True, help="Path to repository root.")
+    p_build_all.add_argument("--index", type=str, default=None, help="Dense code index to build (as for 'build').")
+    p_build_all.add_argument("--output-base-name", type=str, default=None,
+                             help="Lexical index base to build (as for 'build-json').")
+    p_build_all.add_argument("--lexical-format", choices=["json", "jsonl", "sqlite"], default="json",
+                             help="Format of the lexical index.")
+    p_build_all.add_argument("--prose-output", type=str, default=None,
+                             help="Directory of the prose index to build (as 'build-prose --output').")
+    p_build_all.add_argument("--model", type=str, default=DEFAULT_MODEL,
+                             help="SentenceTransformer model name, for code and prose.")
+    p_build_all.add_argument("--workers", type=int, default=None,
+                             help="Processes used to parse files (default: CPU count).")
+    p_build_all.add_argument("--format", choices=["npz", "mmap"], default=None, help="Dense index format (as for 'build').")
+    p_build_all.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE, help="As for 'build'.")
+    p_build_all.add_argument("--tokenizer", type=str, default=None, help="As for 'build'.")
+    p_build_all.set_defaults(func=_handle_build_all_cli)
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("-v", "--verbose", action="count", default=0,
+                               help="More output: -v per-file progress (and request logging for serve), "
+                                    "-vv per-chunk debugging.")
+        subparser.add_argument("--metrics", type=str, default=None,
+                               help="Write timing spans and counters for this command to this file.")
+        subparser.add_argument("--metrics-format", choices=METRICS_FORMATS, default=None,
+                               help="jsonl: a trace with one line per span plus the counters; prom: Prometheus "
+                                    "text format (default: prom for .prom/.txt paths, else jsonl).")
+
+    if not argv: parser.print_help(sys.stderr); sys.exit(1)
+    args = parser.parse_args(argv)
+    if hasattr(args, "no_cache") and (args.no_cache or args.cache_dir or args.cache_max_mb is not None):
+        configure_embedding_cache(args.cache_dir, args.cache_max_mb, enabled=not args.no_cache)
+    set_verbosity(args.verbose)
+    if getattr(args, "tokenizer", None):
+        try: configure_tokenizer(args.tokenizer)
+        except (ValueError, ImportError) as e: parser.error(f"--tokenizer {args.tokenizer}: {e}")
+    if getattr(args, "shard", None):
+        try: parse_shard_spec(args.shard)
+        except ValueError as e: parser.error(f"--shard: {e}")
+    if not args.metrics:
+        args.func(args)
+        return
+    metrics_format = args.metrics_format or ("prom" if Path(args.metrics).suffix in (".prom", ".txt") else "jsonl")
+    configure_metrics(trace_path=args.metrics if metrics_format == "jsonl" else None)
+    try:
+        with span(args.command):
+            args.func(args)
+    finally:
+        write_metrics(args.metrics, metrics_format)
+
+if __name__ == "__main__":
+    _cli_main()
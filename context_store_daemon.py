@@ -0,0 +1,173 @@
+"""
+Persistent query daemon for context_store.
+
+Keeps SentenceTransformer models and loaded indices warm in one long-running process,
+so agent queries skip interpreter start-up, torch import and index loading.
+
+Start the daemon:
+  python context_store.py serve [--host 127.0.0.1] [--port 0] [--preload-index <index> ...]
+
+The daemon writes its address and an access token to a state file (by default
+~/.cache/context_store/daemon.json, or $CONTEXT_STORE_DAEMON_FILE). The `query`,
+`query-prose`, `query-json`, `query-hybrid` and `lookup` subcommands read that file and
+forward their request when a daemon answers; otherwise they run in-process as before. Set
+CONTEXT_STORE_NO_DAEMON=1 (or pass --no-daemon) to never use it.
+
+This module only needs the standard library, and the client defers importing urllib until
+a state file exists, so it adds almost nothing to CLI start-up.
+"""
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DEFAULT_STATE_FILE = Path(os.environ.get(
+    "CONTEXT_STORE_DAEMON_FILE",
+    Path(os.environ.get("CONTEXT_STORE_CACHE_DIR", Path.home() / ".cache" / "context_store")) / "daemon.json"))
+CLIENT_TIMEOUT_S = 120.0
+
+NO_DAEMON = object()  # Returned by daemon_request() when no daemon is reachable.
+
+# ---------- Client ----------
+
+def _read_state(state_file):
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def daemon_request(kind, params, state_file=None, timeout=CLIENT_TIMEOUT_S):
+    """
+    Sends one query to a running daemon.
+
+    Args:
+        kind (str): Query kind, one of the keys of the daemon's dispatch table ("code", "code_batch", ...).
+        params (dict[str, any]): Keyword arguments for the query function. Paths must be absolute.
+        state_file (str | pathlib.Path, optional): Daemon state file. Defaults to DEFAULT_STATE_FILE.
+        timeout (float, optional): Seconds to wait for the answer.
+
+    Returns:
+        any: The query result, or NO_DAEMON when no daemon is running or reachable.
+
+    Raises:
+        FileNotFoundError: The daemon reported a missing index file.
+        RuntimeError: The daemon reported any other error.
+    """
+    if os.environ.get("CONTEXT_STORE_NO_DAEMON"):
+        return NO_DAEMON
+    state = _read_state(state_file or DEFAULT_STATE_FILE)
+    if not state:
+        return NO_DAEMON
+    import urllib.error
+    import urllib.request  # Deferred: urllib costs more start-up time than the common no-daemon path.
+    request = urllib.request.Request(
+        f"http://{state['host']}:{state['port']}/query",
+        data=json.dumps({"kind": kind, "params": params}).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Context-Store-Token": state["token"]})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        payload = json.loads(e.read() or b"{}")
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return NO_DAEMON
+    if payload.get("ok"):
+        return payload["result"]
+    if payload.get("type") == "FileNotFoundError":
+        raise FileNotFoundError(payload.get("error"))
+    raise RuntimeError(f"Daemon error: {payload.get('error', 'unknown error')}")
+
+# ---------- Server ----------
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    server_version = "context_store_daemon/1"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        return secrets.compare_digest(self.headers.get("X-Context-Store-Token", ""), self.server.token)
+
+    def do_GET(self):
+        if self.path != "/health" or not self._authorized():
+            self._send_json(404, {"ok": False, "error": "not found"})
+            return
+        self._send_json(200, {"ok": True, "result": {"pid": os.getpid(),
+                                                     "uptime_s": time.time() - self.server.started_at,
+                                                     "requests": self.server.request_count}})
+
+    def do_POST(self):
+        if self.path != "/query" or not self._authorized():
+            self._send_json(404, {"ok": False, "error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            query_fn = self.server.dispatch[request["kind"]]
+            result = query_fn(**request.get("params", {}))
+        except Exception as e:
+            self._send_json(400 if isinstance(e, (KeyError, TypeError, ValueError)) else 500,
+                            {"ok": False, "error": str(e), "type": type(e).__name__})
+            return
+        with self.server.count_lock:
+            self.server.request_count += 1
+        self._send_json(200, {"ok": True, "result": result})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryDaemon(ThreadingHTTPServer):
+    """
+    Threaded localhost HTTP server answering query requests from the dispatch table.
+    Each request runs on its own thread; the query functions are responsible for
+    caching (and re-validating) models and indices.
+    """
+    daemon_threads = True
+
+    def __init__(self, dispatch, host="127.0.0.1", port=0, state_file=None, verbose=False):
+        super().__init__((host, port), _QueryHandler)
+        self.dispatch = dispatch
+        self.token = secrets.token_hex(16)
+        self.state_file = Path(state_file or DEFAULT_STATE_FILE)
+        self.started_at = time.time()
+        self.request_count = 0
+        self.count_lock = threading.Lock()
+        self.verbose = verbose
+
+    def write_state(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_name(f".{self.state_file.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"host": self.server_address[0], "port": self.server_address[1],
+                       "pid": os.getpid(), "token": self.token}, f)
+        os.replace(tmp_file, self.state_file)
+
+    def remove_state(self):
+        state = _read_state(self.state_file)
+        if state and state.get("token") == self.token:
+            self.state_file.unlink(missing_ok=True)
+
+    def serve_until_interrupted(self):
+        self.write_state()
+        print(f"Info: context_store daemon listening on http://{self.server_address[0]}:{self.server_address[1]} "
+              f"(state file: {self.state_file})", file=sys.stderr)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.remove_state()
+            self.server_close()
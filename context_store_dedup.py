@@ -0,0 +1,114 @@
+"""
+Duplicate and near-duplicate detection for code chunks.
+
+Builds pass every chunk through a `ChunkDeduplicator` in file order. The first chunk with a
+given content is kept (the canonical chunk); later copies are recorded as occurrences of it,
+so each piece of code is embedded and stored once, and a query hit lists all its locations.
+
+Modes:
+  exact  Chunks whose source is identical after normalizing whitespace (trailing spaces, blank
+         lines and the indentation removed by chunking) are duplicates. This is the default.
+  near   Additionally, chunks whose estimated Jaccard similarity over token 4-shingles is at
+         least NEAR_DUPLICATE_THRESHOLD, found with MinHash signatures and LSH banding.
+  off    No deduplication.
+
+JSON indices serve each copy as an element of its own (with the canonical element's source), so
+they only merge exact duplicates, whatever the mode; a near copy may have another name or body.
+
+Standard library only.
+"""
+import hashlib
+import re
+
+DEDUP_MODES = ("off", "exact", "near")
+DEFAULT_DEDUP_MODE = "exact"
+
+NEAR_DUPLICATE_THRESHOLD = 0.9
+MINHASH_PERMUTATIONS = 32
+LSH_BANDS = 8  # MINHASH_PERMUTATIONS / LSH_BANDS rows per band; pairs above ~0.6 similarity become candidates.
+SHINGLE_SIZE = 4
+MIN_SHINGLES = 8  # Chunks with fewer distinct shingles are only deduplicated exactly.
+
+OCCURRENCE_FIELDS = ("file_path", "element_name", "start_line", "end_line", "parent", "window")
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [(int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "little") | 1,
+                  int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "little"))
+                 for i in range(MINHASH_PERMUTATIONS)]
+
+
+def content_key(source_code):
+    """Hash of `source_code` with trailing whitespace and blank lines removed."""
+    normalized = "\n".join(line.rstrip() for line in source_code.splitlines() if line.strip())
+    return hashlib.blake2b(normalized.encode("utf-8", errors="surrogatepass"), digest_size=16).hexdigest()
+
+
+def minhash_signature(source_code):
+    """
+    Returns:
+        tuple[int, ...] | None: MinHash values of the chunk's token 4-shingles, or None when the
+            chunk is too short for a meaningful similarity estimate.
+    """
+    tokens = _TOKEN_RE.findall(source_code)
+    shingles = {int.from_bytes(hashlib.blake2b(" ".join(tokens[i:i + SHINGLE_SIZE]).encode("utf-8", "surrogatepass"),
+                                               digest_size=8).digest(), "little")
+                for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    return tuple(min((a * x + b) % _MERSENNE_PRIME for x in shingles) for a, b in _PERMUTATIONS)
+
+
+def occurrence(chunk):
+    """The location fields of `chunk`, as stored in its canonical chunk's "occurrences" list."""
+    return {field: chunk[field] for field in OCCURRENCE_FIELDS if chunk.get(field) is not None}
+
+
+class ChunkDeduplicator:
+    """
+    Maps each chunk to the canonical chunk it duplicates, if any.
+
+    Args:
+        mode (str, optional): "exact" (default), "near" or "off".
+    """
+
+    def __init__(self, mode=DEFAULT_DEDUP_MODE):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode {mode!r}; expected one of {', '.join(DEDUP_MODES)}.")
+        self.mode = mode
+        self._exact = {}
+        self._bands = [{} for _ in range(LSH_BANDS)]
+        self._signatures = {}
+        self.duplicates = 0
+
+    def canonical(self, source_code, value):
+        """
+        Registers a chunk and returns the value registered for the chunk it duplicates, or None
+        when it is the first of its kind (its own `value` is then registered).
+
+        Args:
+            source_code (str): The chunk's source.
+            value (any): What to return for later duplicates of this chunk (e.g. its row or element).
+        """
+        if self.mode == "off":
+            return None
+        key = content_key(source_code)
+        if key in self._exact:
+            self.duplicates += 1
+            return self._exact[key]
+        signature = minhash_signature(source_code) if self.mode == "near" else None
+        if signature is not None:
+            rows = MINHASH_PERMUTATIONS // LSH_BANDS
+            band_keys = [signature[b * rows:(b + 1) * rows] for b in range(LSH_BANDS)]
+            for band, band_key in zip(self._bands, band_keys):
+                for candidate in band.get(band_key, ()):
+                    other = self._signatures[candidate]
+                    if sum(x == y for x, y in zip(signature, other)) >= NEAR_DUPLICATE_THRESHOLD * len(signature):
+                        self.duplicates += 1
+                        self._exact[key] = self._exact[candidate]
+                        return self._exact[candidate]
+            for band, band_key in zip(self._bands, band_keys):
+                band.setdefault(band_key, []).append(key)
+            self._signatures[key] = signature
+        self._exact[key] = value
+        return None
@@ -1,8 +1,26 @@
 import json
 import ast
+import hashlib
+import heapq
+import keyword
+import math
+import mmap
+import os
+import re
+import sqlite3
 import sys
+import threading
+from bisect import bisect_left
+from collections import Counter, deque
+from collections.abc import Sequence
+from functools import partial
+from itertools import groupby
 from pathlib import Path
 
+from context_store_dedup import DEDUP_MODES, DEFAULT_DEDUP_MODE, ChunkDeduplicator, occurrence
+from context_store_metrics import count, span
+from context_store_walk import walk_files
+
 # ---------- AST Helper Functions ----------
 
 def _get_ast_node_source_segment(source_lines, node):
@@ -72,9 +90,21 @@ def _extract_ast_chunks_from_file(py_file_path, repo_root_path):
         tree = ast.parse(file_content, filename=str(py_file_path))
     except Exception:
         return
-    
-    rel_path_str = str(py_file_path.relative_to(repo_root_path))
+    yield from _iter_tree_chunks(tree, source_lines, str(py_file_path.relative_to(repo_root_path)))
+
+
+def _iter_tree_chunks(tree, source_lines, rel_path_str):
+    """
+    Yields the chunk of every function and class in a parsed module (see `_extract_ast_chunks_from_file`).
+
+    Args:
+        tree (ast.Module): The parsed file.
+        source_lines (list[str]): The file's lines, with line endings.
+        rel_path_str (str): The file's repository-relative path.
 
+    Yields:
+        Iterator[dict[str, any]]: An iterator of dictionaries, each representing an AST chunk.
+    """
     for node in ast.walk(tree):
         if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
             source_code_snippet = _get_ast_node_source_segment(source_lines, node)
@@ -108,77 +138,844 @@ def _extract_ast_chunks_from_file(py_file_path, repo_root_path):
                 "source_code": source_code_snippet,
             }
 
+def _extract_files_chunks_safely(extract_fn, py_file_paths, repo_root_path):
+    """
+    Runs an AST chunk extractor on a slice of files, turning any per-file failure into an error message.
+    Module-level so it can be shipped to worker processes.
+
+    Returns:
+        list[tuple[list[dict[str, any]], str | None]]: Each file's chunks and an error message (or None).
+    """
+    results = []
+    for py_file_path in py_file_paths:
+        try:
+            results.append((list(extract_fn(py_file_path, repo_root_path)), None))
+        except Exception as e:
+            results.append(([], f"{type(e).__name__}: {e}"))
+    return results
+
+
+def iter_file_chunks(py_files, repo_root_path, workers=None, extract_fn=_extract_ast_chunks_from_file):
+    """
+    Extracts AST chunks from many files, fanning the parsing out to a process pool.
+    Results are yielded in the order of `py_files`, so indices are deterministic regardless
+    of worker scheduling. Only a bounded window of work is in flight at a time, so a slow
+    consumer does not make parsed chunks pile up in memory. A file that fails to parse is
+    reported and yields no chunks.
+
+    Args:
+        py_files (list[pathlib.Path]): Files to parse.
+        repo_root_path (pathlib.Path): Repository root for relative path calculation.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count;
+            1 parses serially in the current process.
+        extract_fn (callable, optional): Picklable extractor yielding chunk dicts for one file.
+
+    Yields:
+        tuple[pathlib.Path, list[dict[str, any]]]: Each file with its extracted chunks.
+    """
+    py_files = list(py_files)
+    workers = workers or os.cpu_count() or 1
+    job = partial(_extract_files_chunks_safely, extract_fn, repo_root_path=repo_root_path)
+    done = 0
+    if workers > 1 and len(py_files) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        slice_size = max(1, min(64, len(py_files) // (workers * 8)))
+        slices = iter([py_files[i:i + slice_size] for i in range(0, len(py_files), slice_size)])
+        in_flight = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(py_files))) as pool:
+                for _ in range(workers * 2):
+                    files_slice = next(slices, None)
+                    if files_slice: in_flight.append((files_slice, pool.submit(job, files_slice)))
+                while in_flight:
+                    files_slice, future = in_flight.popleft()
+                    slice_results = future.result()
+                    next_slice = next(slices, None)
+                    if next_slice: in_flight.append((next_slice, pool.submit(job, next_slice)))
+                    for py_file, (chunks, error) in zip(files_slice, slice_results):
+                        if error:
+                            print(f"Warning: Skipping file {py_file} due to error: {error}", file=sys.stderr)
+                        done += 1
+                        yield py_file, chunks
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Warning: Worker pool failed ({e}); parsing remaining files serially.", file=sys.stderr)
+    for py_file in py_files[done:]:
+        [(chunks, error)] = job([py_file])
+        if error:
+            print(f"Warning: Skipping file {py_file} due to error: {error}", file=sys.stderr)
+        yield py_file, chunks
+
+# ---------- Inverted Index & BM25 Ranking ----------
+
+POSTINGS_FORMAT = "context_store_json_postings"
+POSTINGS_VERSION = 2
+# JSON Lines indices: a header line, one element per line, then the dedup occurrences; the
+# offsets sidecar (SQLite) maps element ids to byte ranges, and names and locations of
+# elements and copies to element ids.
+JSONL_SUFFIX = ".jsonl"
+JSONL_FORMAT, JSONL_VERSION = "context_store_jsonl", 1
+OFFSETS_FORMAT, OFFSETS_VERSION = "context_store_jsonl_offsets", 2
+JSON_INDEX_FORMATS = ("json", "jsonl")
+
+# BM25F fields, in the order their term frequencies are stored in each posting.
+FIELDS = ("name", "signature", "docstring", "source")
+FIELD_WEIGHTS = {"name": 3.0, "signature": 1.5, "docstring": 1.0, "source": 0.5}
+FIELD_LENGTH_NORM = {"name": 0.3, "signature": 0.5, "docstring": 0.75, "source": 0.75}  # BM25 b per field
+BM25_K1 = 1.2
+PREFIX_MATCH_WEIGHT = 0.5  # Query terms absent from the vocabulary match longer terms at this weight.
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+_SUBTOKEN_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_PY_KEYWORDS = frozenset(keyword.kwlist)
+
+_CACHED_JSON_INDICES = {}  # index path -> (JsonIndex, file stamp)
+_JSON_CACHE_LOCK = threading.Lock()
+
+
+def _split_identifier(word):
+    """Splits an identifier on snake_case and camelCase boundaries into lowercase sub-tokens."""
+    return [part.lower() for part in _SUBTOKEN_RE.findall(word)]
+
+
+def _word_terms(word):
+    parts = _split_identifier(word)
+    full = word.strip("_").lower()
+    return parts + [full] if full and parts != [full] else parts
+
+
+def term_list(text, skip_keywords=False):
+    """
+    Returns the terms indexed for a piece of text, with repetitions: every word (identifier)
+    in full plus its snake_case/camelCase sub-tokens, all lowercased.
+
+    Args:
+        text (str): Element name, signature, docstring or source code.
+        skip_keywords (bool, optional): Drop Python keywords (used for source code).
+
+    Returns:
+        list[str]: The terms, in order of appearance.
+    """
+    return [term for word in _WORD_RE.findall(text or "")
+            if not (skip_keywords and word in _PY_KEYWORDS) for term in _word_terms(word)]
+
+
+def index_terms(text):
+    """
+    Returns the distinct terms of `text`. "getHTTPResponse_code" yields
+    {"gethttpresponse_code", "get", "http", "response", "code"}.
+    """
+    return set(term_list(text))
+
+
+def _element_fields(element):
+    return (term_list(element.get("element_name", "")), term_list(element.get("signature", "")),
+            term_list(element.get("docstring", "")), term_list(element.get("source_code", ""), skip_keywords=True))
+
+
+def _build_postings(elements):
+    """
+    Computes the BM25F statistics of a list of elements.
+
+    Returns:
+        tuple[dict[str, list[list[int]]], list[list[int]]]: Posting lists mapping each term to
+        [element_id, tf per field...] entries (ascending ids), and each element's field lengths.
+    """
+    postings, lengths = {}, []
+    for element_id, element in enumerate(elements):
+        _add_postings(postings, lengths, element_id, element)
+    return postings, lengths
+
+
+def _add_postings(postings, lengths, element_id, element):
+    fields = _element_fields(element)
+    lengths.append([len(field_terms) for field_terms in fields])
+    counts = [Counter(field_terms) for field_terms in fields]
+    for term in set().union(*counts):
+        postings.setdefault(term, []).append([element_id] + [c[term] for c in counts])
+
+
+def _postings_path(index_path):
+    # "x.json" -> "x.postings.json"; a JSON Lines index keeps its suffix ("x.jsonl.postings.json")
+    # so both formats can share a base name.
+    index_path = Path(index_path)
+    if index_path.suffix == JSONL_SUFFIX: return index_path.with_name(index_path.name + ".postings.json")
+    return index_path.with_suffix(".postings.json")
+
+
+def _offsets_path(index_path):
+    return Path(index_path).with_name(Path(index_path).name + ".offsets.db")
+
+
+def _replace_file(path, data):
+    # Readers (queries, the daemon) never see a partially written file.
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _write_postings(index_path, postings, lengths, source_digest):
+    _replace_file(_postings_path(index_path), json.dumps(
+        {"format": POSTINGS_FORMAT, "version": POSTINGS_VERSION, "count": len(lengths),
+         "source_digest": source_digest, "fields": list(FIELDS),
+         "lengths": lengths, "postings": postings}, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _read_postings(index_path, count, source_digest):
+    # The postings sidecar, or None when it is missing or describes another build.
+    try:
+        with open(_postings_path(index_path), encoding="utf-8") as f:
+            sidecar = json.load(f)
+        if (sidecar.get("format") == POSTINGS_FORMAT and sidecar.get("version") == POSTINGS_VERSION
+                and sidecar.get("fields") == list(FIELDS) and sidecar.get("count") == count
+                and sidecar.get("source_digest") == source_digest):
+            return sidecar["postings"], sidecar["lengths"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return None
+
+
+def _query_terms(query_str):
+    return {term for word in _WORD_RE.findall(query_str) for term in _word_terms(word)}
+
+
+class JsonIndex:
+    """
+    A loaded JSON index with its BM25F statistics: a posting list per term carrying the
+    term's frequency in each field, every element's field lengths, and the sorted vocabulary
+    for prefix lookups. Scoring a query only reads the posting lists of its own terms.
+    """
+
+    def __init__(self, elements, postings, lengths):
+        self.elements = elements
+        self._set_statistics(postings, lengths, [el.get("start_line", 0) for el in elements])
+        self._sources = None
+        self._by_name = None
+
+    def _set_statistics(self, postings, lengths, start_lines):
+        self.postings = postings
+        self.terms = sorted(postings)
+        n = len(lengths)
+        self._weights = [FIELD_WEIGHTS[field] for field in FIELDS]
+        self._norms = []  # Per field, per element: 1 - b + b * length / average length.
+        for f, field in enumerate(FIELDS):
+            b = FIELD_LENGTH_NORM[field]
+            avg = (sum(lens[f] for lens in lengths) / n) if n else 0.0
+            self._norms.append([1 - b + b * (lens[f] / avg) if avg else 1.0 for lens in lengths])
+        self._impacts = {}  # term -> (element ids, idf-weighted BM25F score per element), filled on first use
+        # Ranking ties go to the lower start line; kept apart so ranking never decodes a lazy element.
+        self._start_lines = start_lines
+
+    def _expand(self, query_term):
+        if query_term in self.postings:
+            return [(query_term, 1.0)]
+        expanded = []
+        for i in range(bisect_left(self.terms, query_term), len(self.terms)):
+            if not self.terms[i].startswith(query_term): break
+            expanded.append((self.terms[i], PREFIX_MATCH_WEIGHT))
+        return expanded
+
+    def _term_impacts(self, term):
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            term_postings = self.postings[term]
+            idf = math.log(1 + (len(self.elements) - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            ids, scores = [], []
+            for element_id, *tfs in term_postings:
+                tf = sum(w * tf_f / norm[element_id]
+                         for w, tf_f, norm in zip(self._weights, tfs, self._norms) if tf_f)
+                ids.append(element_id)
+                scores.append(idf * tf / (BM25_K1 + tf))
+            impacts = self._impacts[term] = (ids, scores)
+        return impacts
+
+    def search(self, query_str, k=None):
+        """
+        Ranks elements against a query with BM25F: per-field term frequencies are
+        length-normalized, weighted by FIELD_WEIGHTS and summed before BM25 saturation.
+        Query terms are the query's words and their identifier sub-tokens; a term missing
+        from the vocabulary matches the terms it prefixes, at PREFIX_MATCH_WEIGHT.
+
+        Args:
+            query_str (str): Search query string.
+            k (int, optional): Number of results to return. Defaults to all matches.
+
+        Returns:
+            list[tuple[int, float]]: (element id, score) pairs, best first; ties go to the lower start line.
+        """
+        scores = {}
+        for query_term in _query_terms(query_str):
+            for term, term_weight in self._expand(query_term):
+                ids, impacts = self._term_impacts(term)
+                for element_id, impact in zip(ids, impacts):
+                    scores[element_id] = scores.get(element_id, 0.0) + term_weight * impact
+        sort_key = lambda item: (-item[1], self._start_lines[item[0]])
+        if k is None: return sorted(scores.items(), key=sort_key)
+        return heapq.nsmallest(k, scores.items(), key=sort_key)
+
+    def _located_elements(self):
+        # Every element, then every deduplicated copy as the element seen at the copy's location.
+        yield from self.elements
+        for element in self.elements:
+            for occ in element.get("occurrences", ()):
+                yield _located_copy(element, occ)
+
+    def elements_named(self, element_name):
+        """Returns the elements with exactly this name, including deduplicated copies at their own locations."""
+        if self._by_name is None:
+            by_name = {}
+            for element in self._located_elements():
+                by_name.setdefault(element.get("element_name"), []).append(element)
+            self._by_name = by_name
+        return self._by_name.get(element_name, [])
+
+    def sources_by_key(self):
+        """Maps (file_path, element_name, "start-end") of each element and copy to its source code."""
+        if self._sources is None:
+            self._sources = {(el.get("file_path"), el.get("element_name"),
+                              f"{el.get('start_line')}-{el.get('end_line')}"): el.get("source_code")
+                             for el in self._located_elements()}
+        return self._sources
+
+    def source_of(self, file_path, element_name, lines):
+        """The source code of the element or copy at (file_path, element_name, "start-end"), or None."""
+        return self.sources_by_key().get((file_path, element_name, lines))
+
+
+def _located_copy(element, occ):
+    # A deduplicated copy: the element as seen at the copy's location.
+    return {**{key: value for key, value in element.items() if key != "occurrences"}, **occ,
+            "duplicate_of": chunk_id(element.get("file_path"), element.get("element_name"),
+                                     element.get("start_line"), element.get("end_line"))}
+
+
+def load_json_index(index_path):
+    """
+    Loads a JSON index and its ranking statistics. The postings sidecar written by
+    `build_json_indices` is used when it matches the JSON file; otherwise (older builds,
+    hand-edited files) the statistics are recomputed in memory. A .jsonl path is opened
+    lazily with `load_jsonl_index()`.
+
+    Args:
+        index_path (str | pathlib.Path): Path to a _signatures.json(l) or _fullsource.json(l) file.
+
+    Returns:
+        JsonIndex: The loaded index.
+    """
+    if Path(index_path).suffix == JSONL_SUFFIX:
+        return load_jsonl_index(index_path)
+    raw = Path(index_path).read_bytes()
+    elements = json.loads(raw) or []
+    statistics = _read_postings(index_path, len(elements), hashlib.blake2b(raw, digest_size=16).hexdigest())
+    return JsonIndex(elements, *(statistics or _build_postings(elements)))
+
+
+class _JsonlOffsets:
+    """
+    The offsets sidecar of a JSON Lines index, a SQLite database read with indexed queries:
+    each element's byte range and start line, and a location table of every element and
+    deduplicated copy by name and by (file, name, lines). Nothing is read up front.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()  # The query daemon serves requests from several threads.
+        self.meta = dict(self._query("SELECT key, value FROM meta"))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def span(self, element_id):
+        return self._query("SELECT byte_start, byte_end FROM elements WHERE id = ?", (element_id,))[0]
+
+    def spans(self):
+        return self._query("SELECT byte_start, byte_end FROM elements ORDER BY id")
+
+    def start_lines(self):
+        return [line for line, in self._query("SELECT start_line FROM elements ORDER BY id")]
+
+    def occurrences(self, element_id=None):
+        # Copies of one element, or {element id: copies} of all elements.
+        if element_id is not None:
+            return [json.loads(occ) for occ, in self._query(
+                "SELECT occurrence FROM locations WHERE element_id = ? AND occurrence IS NOT NULL ORDER BY rowid",
+                (element_id,))]
+        rows = self._query("SELECT element_id, occurrence FROM locations WHERE occurrence IS NOT NULL "
+                           "ORDER BY element_id, rowid")
+        return {element_id: [json.loads(occ) for _, occ in group] for element_id, group in groupby(rows, lambda r: r[0])}
+
+    def named(self, element_name):
+        # (element id, copy's occurrence or None) of the elements and copies with this name.
+        return [(element_id, occ and json.loads(occ)) for element_id, occ in self._query(
+            "SELECT element_id, occurrence FROM locations WHERE element_name = ? "
+            "ORDER BY occurrence IS NOT NULL, element_id, rowid", (element_name,))]
+
+    def element_at(self, file_path, element_name, lines):
+        rows = self._query("SELECT element_id FROM locations WHERE file_path = ? AND element_name = ? AND lines = ? "
+                           "ORDER BY occurrence IS NOT NULL, element_id, rowid LIMIT 1", (file_path, element_name, lines))
+        return rows[0][0] if rows else None
+
+
+class _JsonlRecords(Sequence):
+    """
+    Read-only sequence of the elements of a JSON Lines index. An element is decoded from its
+    byte range of the memory-mapped file only when it is indexed.
+    """
+
+    def __init__(self, buf, offsets):
+        self._buf, self._offsets = buf, offsets
+        self._count = offsets.meta["count"]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice): return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0: idx += len(self)
+        if not 0 <= idx < len(self): raise IndexError(idx)
+        start, end = self._offsets.span(idx)
+        element = json.loads(self._buf[start:end])
+        occurrences = self._offsets.occurrences(idx)
+        if occurrences: element["occurrences"] = occurrences
+        return element
+
+    def __iter__(self):
+        # A full scan (incremental builds, recomputed postings) reads the sidecar once, not per element.
+        occurrences = self._offsets.occurrences()
+        for idx, (start, end) in enumerate(self._offsets.spans()):
+            element = json.loads(self._buf[start:end])
+            if idx in occurrences: element["occurrences"] = occurrences[idx]
+            yield element
+
+
+class JsonlIndex(JsonIndex):
+    """
+    A JSON Lines index opened without reading its elements or its ranking statistics. Exact
+    lookups and source attachment are an indexed query of the offsets sidecar plus one line
+    read; the postings sidecar is loaded on the first ranked query. A query decodes only the
+    elements it returns.
+    """
+
+    def __init__(self, index_path, buf, offsets):
+        self.elements = _JsonlRecords(buf, offsets)
+        self.postings = None
+        self._index_path, self._offsets = index_path, offsets
+        self._statistics_lock = threading.Lock()
+        self._sources = None
+        self._by_name = None
+
+    def search(self, query_str, k=None):
+        with self._statistics_lock:
+            if self.postings is None:
+                statistics = (_read_postings(self._index_path, len(self.elements), self._offsets.meta["build"])
+                              or _build_postings(self.elements))
+                self._set_statistics(*statistics, self._offsets.start_lines())
+        return super().search(query_str, k)
+
+    def _located(self, element_id, occ):
+        element = self.elements[element_id]
+        return element if occ is None else _located_copy(element, occ)
+
+    def elements_named(self, element_name):
+        return [self._located(element_id, occ) for element_id, occ in self._offsets.named(element_name)]
+
+    def source_of(self, file_path, element_name, lines):
+        element_id = self._offsets.element_at(file_path, element_name, lines)
+        return None if element_id is None else self.elements[element_id].get("source_code")
+
+
+def _mmap_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_jsonl_index(index_path):
+    """
+    Opens a JSON Lines index written by `build_json_indices(index_format="jsonl")`. With a
+    current offsets sidecar, only the header line and the sidecar's build stamp are read:
+    elements are decoded on access and ranking statistics loaded on the first ranked query,
+    so opening an index and fetching one element cost the same whatever the repository size.
+    Otherwise (missing or stale sidecar) every line is read, as for a .json index.
+
+    Args:
+        index_path (str | pathlib.Path): Path to a _signatures.jsonl or _fullsource.jsonl file.
+
+    Returns:
+        JsonIndex: The opened index (a `JsonlIndex` when the sidecar is current).
+
+    Raises:
+        ValueError: The file is not a JSON Lines index.
+    """
+    index_path = Path(index_path)
+    buf = _mmap_file(index_path)
+    header_end = buf.find(b"\n") + 1
+    try:
+        header = json.loads(buf[:header_end]) if header_end else {}
+    except ValueError:
+        header = {}
+    if not isinstance(header, dict) or header.get("format") != JSONL_FORMAT:
+        raise ValueError(f"{index_path} is not a JSON Lines index.")
+    try:
+        offsets = _JsonlOffsets(_offsets_path(index_path))
+        meta = offsets.meta
+        current = (meta.get("format") == OFFSETS_FORMAT and meta.get("version") == OFFSETS_VERSION
+                   and meta.get("build") == header.get("build") and meta.get("size") == len(buf))
+    except sqlite3.Error:
+        current = False
+    if current:
+        return JsonlIndex(index_path, buf, offsets)
+    print(f"Warning: Offsets of {index_path} are missing or stale; reading the whole index.", file=sys.stderr)
+    elements = []
+    for line in buf[header_end:].splitlines():
+        if not line.strip(): continue
+        record = json.loads(line)
+        if "occurrences_of" in record: elements[record["occurrences_of"]]["occurrences"] = record["occurrences"]
+        else: elements.append(record)
+    return JsonIndex(elements, *_build_postings(elements))
+
+
+class _JsonArrayWriter:
+    # The .json format: one array, written with its postings once every element is known.
+
+    def __init__(self, path):
+        self.path, self.elements = path, []
+
+    @property
+    def count(self):
+        return len(self.elements)
+
+    def add(self, element):
+        self.elements.append(element)
+
+    def add_occurrence(self, element_id, occ):
+        self.elements[element_id].setdefault("occurrences", []).append(occ)
+
+    def close(self):
+        raw = json.dumps(self.elements, ensure_ascii=False, indent=2).encode("utf-8")
+        _write_postings(self.path, *_build_postings(self.elements), hashlib.blake2b(raw, digest_size=16).hexdigest())
+        _replace_file(self.path, raw)
+
+    def abort(self):
+        pass
+
+
+class _JsonlWriter:
+    # The .jsonl format: elements are streamed to a temporary file as they are added, and
+    # their byte ranges and locations to the offsets sidecar; only the postings stay in memory.
+    # Dedup occurrences, known only once every element has been seen, follow the elements.
+    # Sidecars are written before the index replaces the previous one, and carry the build id
+    # of the header so readers can tell a sidecar of another build.
+
+    def __init__(self, path):
+        self.path, self.build, self.count = path, os.urandom(8).hex(), 0
+        self._tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        offsets_path = _offsets_path(path)
+        self._offsets_tmp_path = offsets_path.with_name(f".{offsets_path.name}.{os.getpid()}.tmp")
+        self._offsets_tmp_path.unlink(missing_ok=True)
+        self._db = sqlite3.connect(self._offsets_tmp_path)
+        self._db.executescript(
+            "PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;"
+            "CREATE TABLE meta (key TEXT PRIMARY KEY, value);"
+            "CREATE TABLE elements (id INTEGER PRIMARY KEY, byte_start INTEGER NOT NULL, byte_end INTEGER NOT NULL, "
+            "start_line INTEGER);"
+            # One row per element (occurrence NULL) and per deduplicated copy (its occurrence as JSON).
+            "CREATE TABLE locations (element_id INTEGER NOT NULL, file_path TEXT, element_name TEXT, lines TEXT, "
+            "occurrence TEXT);")
+        self._file, self._size = open(self._tmp_path, "wb"), 0
+        self._postings, self._lengths = {}, []
+        self._write({"format": JSONL_FORMAT, "version": JSONL_VERSION, "build": self.build})
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._file.write(line)
+        self._size += len(line)
+
+    def _add_location(self, element_id, located, occ=None):
+        self._db.execute("INSERT INTO locations VALUES (?, ?, ?, ?, ?)", (
+            element_id, located["file_path"], located["element_name"],
+            f"{located['start_line']}-{located['end_line']}",
+            None if occ is None else json.dumps(occ, ensure_ascii=False)))
+
+    def add(self, element):
+        _add_postings(self._postings, self._lengths, self.count, element)
+        start = self._size
+        self._write(element)
+        self._db.execute("INSERT INTO elements VALUES (?, ?, ?, ?)", (self.count, start, self._size,
+                                                                       element.get("start_line", 0)))
+        self._add_location(self.count, element)
+        self.count += 1
+
+    def add_occurrence(self, element_id, occ):
+        self._add_location(element_id, occ, occ)
+
+    def close(self):
+        rows = self._db.execute("SELECT element_id, occurrence FROM locations WHERE occurrence IS NOT NULL "
+                                "ORDER BY element_id, rowid").fetchall()
+        for element_id, group in groupby(rows, lambda row: row[0]):
+            self._write({"occurrences_of": element_id, "occurrences": [json.loads(occ) for _, occ in group]})
+        self._file.close()
+        self._db.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("format", OFFSETS_FORMAT), ("version", OFFSETS_VERSION), ("build", self.build), ("size", self._size),
+            ("count", self.count)])
+        self._db.execute("CREATE INDEX locations_name ON locations (element_name)")
+        self._db.execute("CREATE INDEX locations_at ON locations (file_path, element_name, lines)")
+        self._db.commit()
+        self._db.close()
+        _write_postings(self.path, self._postings, self._lengths, self.build)
+        os.replace(self._offsets_tmp_path, _offsets_path(self.path))
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        self._db.close()
+        self._tmp_path.unlink(missing_ok=True)
+        self._offsets_tmp_path.unlink(missing_ok=True)
+
+
+def _get_json_index(index_path):
+    index_path = Path(index_path).resolve()
+    st = index_path.stat()
+    stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _JSON_CACHE_LOCK:
+        cached = _CACHED_JSON_INDICES.get(index_path)
+        if cached and cached[1] == stamp:
+            return cached[0]
+    with span("load", index=str(index_path)):
+        index = load_json_index(index_path)
+    with _JSON_CACHE_LOCK:
+        _CACHED_JSON_INDICES[index_path] = (index, stamp)
+    return index
+
 # ---------- JSON Index Building & Querying ----------
 
-def build_json_indices(repo_path_str, output_dir_str):
+_EXCLUDE_DIRS = ['.git', '.vscode', '.idea', '__pycache__', 'node_modules', 'build', 'dist',
+                 'venv', 'env', '.env', 'site-packages', '.ipynb_checkpoints']
+
+
+def python_file_entries(repo_path, workers=1):
+    """
+    Walks the repository for .py files outside build/VCS/virtualenv and git-ignored directories.
+
+    Returns:
+        list[context_store_walk.WalkedFile]: (path, rel_path, stat) per file, sorted by relative path.
+    """
+    return walk_files(repo_path, (".py",), _EXCLUDE_DIRS, workers=workers)
+
+
+def find_python_files(repo_path, workers=1):
+    """Returns the repository's .py files outside build/VCS/virtualenv directories, sorted by relative path."""
+    return [entry.path for entry in python_file_entries(repo_path, workers=workers)]
+
+
+def is_public_element(element_name):
+    """An element is public unless its name starts with '_' (dunder methods are usually public)."""
+    return not (element_name.startswith("_") and
+                not (element_name.startswith("__") and element_name.endswith("__")))
+
+
+def is_sqlite_index(index_path):
+    """True when `index_path` is a SQLite database (see context_store_sqlite) rather than a JSON index."""
+    try:
+        with open(index_path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+    except OSError:
+        return False
+
+
+def chunk_id(file_path, element_name, start_line, end_line):
+    """
+    Identifier shared by the lexical and dense indices for one code element, so results from
+    either retriever can be matched up: "<file_path>:<start_line>-<end_line>:<element_name>".
+    """
+    return f"{file_path}:{start_line}-{end_line}:{element_name}"
+
+
+def format_result(element_data):
+    """Turns an indexed element into a query result dict."""
+    result_item = {
+        "chunk_id": chunk_id(element_data.get("file_path"), element_data.get("element_name"),
+                             element_data.get("start_line", "?"), element_data.get("end_line", "?")),
+        "file": element_data.get("file_path"),
+        "element_name": element_data.get("element_name"),
+        "element_type": element_data.get("element_type"),
+        "lines": f"{element_data.get('start_line', '?')}-{element_data.get('end_line', '?')}",
+        "docstring": element_data.get("docstring", ""),
+    }
+    if "signature" in element_data:
+        result_item["signature"] = element_data["signature"]
+    if "source_code" in element_data:
+        result_item["snippet"] = element_data["source_code"]
+    if element_data.get("occurrences"):
+        result_item["occurrences"] = format_occurrences(element_data["occurrences"])
+    if "duplicate_of" in element_data:
+        result_item["duplicate_of"] = element_data["duplicate_of"]
+    return result_item
+
+
+def format_occurrences(occurrences):
+    """Turns the stored locations of an element's deduplicated copies into result entries."""
+    return [{"chunk_id": chunk_id(occ["file_path"], occ["element_name"], occ["start_line"], occ["end_line"]),
+             "file": occ["file_path"], "element_name": occ["element_name"],
+             "lines": f"{occ['start_line']}-{occ['end_line']}"} for occ in occurrences]
+
+
+def _previous_json_chunks(sig_file_path, full_file_path):
+    # The chunks of an existing build by file, rebuilt from its elements, and for each file the
+    # files holding the canonical elements of the copies it contains.
+    if not (sig_file_path.is_file() and full_file_path.is_file()):
+        return None
+    try:
+        signatures = {(el.get("file_path"), el.get("element_name"), el.get("start_line")): el.get("signature", "")
+                      for el in _get_json_index(sig_file_path)._located_elements()}
+        chunks_by_file, depends_on = {}, {}
+        for element in _get_json_index(full_file_path).elements:
+            for occ in [None] + list(element.get("occurrences", ())):
+                chunk = {**{key: value for key, value in element.items() if key != "occurrences"}, **(occ or {})}
+                chunk["signature"] = signatures.get((chunk["file_path"], chunk["element_name"], chunk["start_line"]), "")
+                chunks_by_file.setdefault(chunk["file_path"], []).append(chunk)
+                if occ: depends_on.setdefault(chunk["file_path"], set()).add(element["file_path"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Warning: Could not read previous JSON indices ({e}); doing a full rebuild.", file=sys.stderr)
+        return None
+    return chunks_by_file, depends_on
+
+
+def build_json_indices(repo_path_str, output_dir_str, workers=None, base_name=None, dedup=DEFAULT_DEDUP_MODE,
+                       changed_files=None, walked=None, parse_files=None, index_format="json"):
     """
     Scans a Python repository, extracts AST chunks, and saves two JSON files:
     - <repo_name>_signatures.json: Contains public (non-underscore-prefixed) elements' signatures and metadata.
     - <repo_name>_fullsource.json: Contains all extracted elements' full source code and metadata.
-    Files are saved to the specified output directory.
+    Files are saved to the specified output directory. Duplicate elements are stored once, with
+    the locations of their copies in "occurrences" (see context_store_dedup). Each file is
+    replaced atomically, so concurrent queries see either the old or the new index.
+
+    With index_format="jsonl" the files are <repo_name>_signatures.jsonl and
+    <repo_name>_fullsource.jsonl instead: one element per line, streamed out as files are
+    parsed, each with an offsets sidecar (`load_jsonl_index()`) so queries read only the
+    elements they return.
 
     Args:
         repo_path_str (str | pathlib.Path): Path to the root directory of the Python repository.
         output_dir_str (str | pathlib.Path): Directory to save the generated JSON index files.
+        workers (int, optional): Number of processes used to parse files. Defaults to the CPU count.
+        base_name (str, optional): Prefix for the output files. Defaults to the repository name.
+        dedup (str, optional): "exact" (default), "near" or "off". "near" deduplicates these indices
+            exactly, so a near copy keeps its own name and source.
+        changed_files (Iterable[str], optional): Repository-relative paths added, modified or deleted
+            since the existing indices were built. When given and the indices exist, only these
+            files (and files absent from the indices) are re-parsed; the chunks of the others are
+            taken from the indices. The result is the same as a full build.
+        walked (list[context_store_walk.WalkedFile], optional): Files already discovered by the caller
+            (`python_file_entries()` by default).
+        parse_files (callable, optional): Called with the files to parse; yields (path, chunks) in
+            their order, like `iter_file_chunks()` (the default). Lets `build-all` parse each file
+            once for all indices.
+        index_format (str, optional): "json" (default) or "jsonl".
     """
+    if index_format not in JSON_INDEX_FORMATS:
+        raise ValueError(f"Unknown JSON index format {index_format!r}; expected one of {', '.join(JSON_INDEX_FORMATS)}.")
     repo_path = Path(repo_path_str).resolve()
     output_path = Path(output_dir_str).resolve()
     output_path.mkdir(parents=True, exist_ok=True)
 
-    repo_name = repo_path.name
-    signatures_list = []
-    fullsource_list = []
+    repo_name = base_name or repo_path.name
+    suffix = JSONL_SUFFIX if index_format == "jsonl" else ".json"
+    sig_file_path = output_path / f"{repo_name}_signatures{suffix}"
+    full_file_path = output_path / f"{repo_name}_fullsource{suffix}"
+    previous = _previous_json_chunks(sig_file_path, full_file_path) if changed_files is not None else None
+    changed_files = {str(Path(path)) for path in changed_files or ()}
+    # A copy is served as an element of its own (lookups, snippets) made of the canonical element's
+    # source and terms, so only exact duplicates, which share both, are merged; "near" is for dense indices.
+    lexical_dedup = "exact" if dedup == "near" else dedup
+    full_dedup, sig_dedup = ChunkDeduplicator(lexical_dedup), ChunkDeduplicator(lexical_dedup)
+
+    def _add_unique(writer, deduplicator, element, chunk):
+        # Elements are referred to by id (their position in the index), so nothing written is kept.
+        canonical = deduplicator.canonical(chunk["source_code"], writer.count)
+        if canonical is None:
+            writer.add(element)
+        else:
+            writer.add_occurrence(canonical, occurrence(chunk))
 
-    py_files = [p for p in repo_path.rglob("*.py") if not any(ex in p.parts for ex in
-                ['.git', '.vscode', '.idea', '__pycache__', 'node_modules', 'build', 'dist',
-                 'venv', 'env', '.env', 'site-packages', '.ipynb_checkpoints'])]
+    with span("discovery"):
+        entries = python_file_entries(repo_path, workers=workers) if walked is None else walked
+        py_files = [entry.path for entry in entries]
+        count("files", len(py_files)); count("bytes", sum(entry.stat.st_size for entry in entries))
 
-    for py_file in py_files:
-        try:
-            for chunk in _extract_ast_chunks_from_file(py_file, repo_path):
-                # Add to fullsource_list unconditionally
-                fullsource_list.append({
-                    "file_path": chunk["file_path"],
-                    "element_name": chunk["element_name"],
-                    "element_type": chunk["element_type"],
-                    "start_line": chunk["start_line"],
-                    "end_line": chunk["end_line"],
-                    "docstring": chunk["docstring"],
-                    "source_code": chunk["source_code"],
-                })
-
-                # Add to signatures_list only if not an internal element
-                # (name doesn't start with '_' or is a dunder method which is usually public)
-                if not (chunk["element_name"].startswith("_") and \
-                        not (chunk["element_name"].startswith("__") and chunk["element_name"].endswith("__"))):
-                    signatures_list.append({
+    def _rel(py_file):
+        return str(py_file.relative_to(repo_path))
+
+    reused = {}
+    if previous is not None:
+        previous_chunks, depends_on = previous
+        reused = {_rel(p): previous_chunks[_rel(p)] for p in py_files
+                  if _rel(p) in previous_chunks and _rel(p) not in changed_files}
+        # A copy's own source is not stored, and it may become canonical when its canonical's file changed.
+        for rel_path in [f for f in reused if not depends_on.get(f, set()) <= reused.keys()]:
+            del reused[rel_path]
+        print(f"Info: Incremental JSON build: {len(reused)} files reused, {len(py_files) - len(reused)} "
+              f"re-parsed.", file=sys.stderr)
+
+    writer_class = _JsonlWriter if index_format == "jsonl" else _JsonArrayWriter
+    fullsource_writer, signatures_writer = writer_class(full_file_path), writer_class(sig_file_path)
+    try:
+        with span("parse", files=len(py_files) - len(reused)):
+            parse_files = parse_files or partial(iter_file_chunks, repo_root_path=repo_path, workers=workers)
+            parsed = parse_files([p for p in py_files if _rel(p) not in reused])
+            for py_file in py_files:
+                chunks = reused[_rel(py_file)] if _rel(py_file) in reused else next(parsed)[1]
+                count("chunks", len(chunks))
+                # Source order (outer before inner), so reused and freshly parsed files agree.
+                for chunk in sorted(chunks, key=lambda c: (c["start_line"], -c["end_line"])):
+                    # Add to the fullsource index unconditionally
+                    _add_unique(fullsource_writer, full_dedup, {
                         "file_path": chunk["file_path"],
                         "element_name": chunk["element_name"],
                         "element_type": chunk["element_type"],
                         "start_line": chunk["start_line"],
                         "end_line": chunk["end_line"],
                         "docstring": chunk["docstring"],
-                        "signature": chunk["signature"],
-                    })
-        except (SyntaxError, UnicodeDecodeError) as e:
-            print(f"Warning: Skipping file {py_file} due to error: {e}", file=sys.stderr)
-            continue
-        
-    sig_file_path = output_path / f"{repo_name}_signatures.json"
-    full_file_path = output_path / f"{repo_name}_fullsource.json"
-    
-    with open(sig_file_path, "w", encoding="utf-8") as f:
-        json.dump(signatures_list, f, ensure_ascii=False, indent=2)
-    with open(full_file_path, "w", encoding="utf-8") as f:
-        json.dump(fullsource_list, f, ensure_ascii=False, indent=2)
-        
+                        "source_code": chunk["source_code"],
+                    }, chunk)
+
+                    # Add to the signatures index only if not an internal element
+                    if is_public_element(chunk["element_name"]):
+                        _add_unique(signatures_writer, sig_dedup, {
+                            "file_path": chunk["file_path"],
+                            "element_name": chunk["element_name"],
+                            "element_type": chunk["element_type"],
+                            "start_line": chunk["start_line"],
+                            "end_line": chunk["end_line"],
+                            "docstring": chunk["docstring"],
+                            "signature": chunk["signature"],
+                        }, chunk)
+
+        with span("save"):
+            # Full sources first, so new signatures always find their source; each sidecar before its index.
+            fullsource_writer.close()
+            signatures_writer.close()
+    except BaseException:
+        fullsource_writer.abort()
+        signatures_writer.abort()
+        raise
+
     print(f"JSON indices exported to:\n- {sig_file_path.resolve()}\n- {full_file_path.resolve()}", file=sys.stderr)
+    if full_dedup.duplicates:
+        print(f"Info: {full_dedup.duplicates} duplicate elements stored once, with their other locations "
+              f"as occurrences.", file=sys.stderr)
 
 
 def query_json_file(query_str, index_file_path_str, k=3):
     """
     Queries a JSON index file (either signatures or full source) for relevant code elements.
-    Search is performed on 'element_name' and 'docstring'.
+    Elements are ranked with BM25F over their name, signature, docstring and (for full-source
+    indices) source identifiers; see `JsonIndex.search`. Term statistics come from the
+    postings sidecar written at build time, and the loaded index is cached per process,
+    so a query only touches the posting lists of its own terms. A SQLite index built with
+    `context_store_sqlite.build_sqlite_index` is queried through its FTS5 table instead.
     The structure of returned elements depends on the input index file.
 
     Args:
@@ -194,46 +991,119 @@ def query_json_file(query_str, index_file_path_str, k=3):
         print(f"Error: Index file not found at {index_path}", file=sys.stderr)
         return []
 
-    with open(index_path, encoding="utf-8") as f:
-        indexed_elements = json.load(f)
+    if is_sqlite_index(index_path):
+        from context_store_sqlite import query_sqlite_index
+        return query_sqlite_index(query_str, index_path, k)
 
-    if not indexed_elements:
+    count("queries")
+    index = _get_json_index(index_path)
+    if not index.elements or not query_str.strip():
         return []
 
-    query_tokens = {token.lower() for token in query_str.split() if token}
-    if not query_tokens:
+    with span("score"):
+        hits = index.search(query_str, k)
+    with span("format"):
+        return [format_result(index.elements[i]) for i, _ in hits]
+
+def query_json_context(query_str, signatures_file_path_str, source_file_path_str, k=3):
+    """
+    Queries the signatures index and attaches each hit's full source from the fullsource index.
+
+    Args:
+        query_str (str): Search query string.
+        signatures_file_path_str (str | pathlib.Path): Path to the _signatures.json index.
+        source_file_path_str (str | pathlib.Path | None): Path to the _fullsource.json index. Ignored
+            when the signatures path is a SQLite index, which holds the source itself.
+        k (int, optional): Number of top results to return. Defaults to 3.
+
+    Returns:
+        list[dict[str, any]]: Signature hits, each with a "snippet" when its source was found.
+    """
+    if is_sqlite_index(signatures_file_path_str):
+        from context_store_sqlite import query_sqlite_index
+        return query_sqlite_index(query_str, signatures_file_path_str, k, include_source=True)
+    return _attach_sources(query_json_file(query_str, signatures_file_path_str, k), source_file_path_str)
+
+
+def _attach_sources(results, source_file_path_str):
+    if not results or source_file_path_str is None or not Path(source_file_path_str).is_file():
+        return results
+    source_index = _get_json_index(source_file_path_str)
+    for result in results:
+        snippet = source_index.source_of(result["file"], result["element_name"], result["lines"])
+        if snippet is not None:
+            result["snippet"] = snippet
+    return results
+
+
+def path_matches(rel_path, file_path):
+    """True when `file_path` is `rel_path` or a trailing part of it ("utils.py", "pkg/utils.py")."""
+    rel_path = rel_path.replace(os.sep, "/")
+    file_path = file_path.replace(os.sep, "/").removeprefix("./")
+    return rel_path == file_path or rel_path.endswith("/" + file_path)
+
+
+def lookup_element(element_name, index_file_path_str, file_path=None, source_file_path_str=None):
+    """
+    Looks up code elements by exact name, optionally restricted to one file
+    ("function X in file Y"), without ranking.
+
+    Args:
+        element_name (str): Exact function or class name.
+        index_file_path_str (str | pathlib.Path): A _signatures.json or _fullsource.json index, or a SQLite index.
+        file_path (str, optional): Repository-relative path of the file, or any trailing part of it.
+        source_file_path_str (str | pathlib.Path, optional): _fullsource.json to attach snippets from
+            when looking up in a signatures file. A SQLite index always returns the source.
+
+    Returns:
+        list[dict[str, any]]: Matching elements, ordered by file path and start line.
+    """
+    if is_sqlite_index(index_file_path_str):
+        from context_store_sqlite import lookup_sqlite_element
+        return lookup_sqlite_element(element_name, index_file_path_str, file_path)
+    index_path = Path(index_file_path_str)
+    if not index_path.is_file():
+        print(f"Error: Index file not found at {index_path}", file=sys.stderr)
         return []
+    index = _get_json_index(index_path)
+    matches = [el for el in index.elements_named(element_name)
+               if file_path is None or path_matches(el.get("file_path", ""), file_path)]
+    matches.sort(key=lambda el: (el.get("file_path", ""), el.get("start_line", 0)))
+    return _attach_sources([format_result(el) for el in matches], source_file_path_str)
 
-    scored_matches = []
-    for element in indexed_elements:
-        name_to_search = element.get("element_name", "").lower()
-        docstring_to_search = element.get("docstring", "").lower()
-        search_text = f"{name_to_search} {docstring_to_search}"
-        
-        hits = sum(1 for token in query_tokens if token in search_text)
-        
-        if hits > 0:
-            start_line = element.get("start_line", 0)
-            scored_matches.append((hits, start_line, element))
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*")
 
-    scored_matches.sort(key=lambda x: (-x[0], x[1]))
 
-    results = []
-    for _, _, element_data in scored_matches[:k]:
-        result_item = {
-            "file": element_data.get("file_path"),
-            "element_name": element_data.get("element_name"),
-            "element_type": element_data.get("element_type"),
-            "lines": f"{element_data.get('start_line', '?')}-{element_data.get('end_line', '?')}",
-            "docstring": element_data.get("docstring", ""),
-        }
-        if "signature" in element_data:
-            result_item["signature"] = element_data["signature"]
-        if "source_code" in element_data:
-            result_item["snippet"] = element_data["source_code"]
-        
-        results.append(result_item)
-        
+def exact_identifier_matches(query_str, index_file_path_str, source_file_path_str=None):
+    """
+    Finds elements named exactly by an identifier in the query, e.g. "parse_config",
+    "HTTPClient.send()" or "load_index in store/io.py". Words count as identifiers when they
+    contain an underscore or inner capitals, or when the query is a single word; a word ending
+    in ".py" restricts the lookup to that file.
+
+    Args:
+        query_str (str): Search query string.
+        index_file_path_str (str | pathlib.Path): A JSON or SQLite index, as for `lookup_element`.
+        source_file_path_str (str | pathlib.Path, optional): _fullsource.json to attach snippets from.
+
+    Returns:
+        list[dict[str, any]]: Matching elements for every identifier, in query order.
+    """
+    words = [word.strip("`'\",:;()[]{}") for word in query_str.split()]
+    words = [word.removesuffix("()") for word in words if word]
+    file_hint = next((word for word in words if word.endswith(".py")), None)
+    results, seen = [], set()
+    for word in words:
+        if word.endswith(".py") or not _IDENTIFIER_RE.fullmatch(word):
+            continue
+        name = word.rsplit(".", 1)[-1]
+        if not (len(words) == 1 or "_" in name.strip("_") or any(c.isupper() for c in name[1:])):
+            continue
+        for result in lookup_element(name, index_file_path_str, file_path=file_hint,
+                                     source_file_path_str=source_file_path_str):
+            if result["chunk_id"] not in seen:
+                seen.add(result["chunk_id"])
+                results.append(result)
     return results
 
 # ---------- Command-Line Interface ----------
@@ -244,7 +1114,7 @@ def main_cli():
         description="Build or query lightweight JSON-based context indices for Python codebases."
     )
     subparsers = parser.add_subparsers(dest="command", required=True,
-                                     help="Action to perform: 'build' or 'query'.")
+                                     help="Action to perform: 'build', 'query' or 'lookup'.")
 
     build_cmd_parser = subparsers.add_parser("build",
                                           help="Scan a Python repository and create JSON index files.")
@@ -252,16 +1122,36 @@ def main_cli():
                                   help="Path to the root directory of the Python repository.")
     build_cmd_parser.add_argument("--output-dir", type=str, default=".",
                                   help="Directory to save the generated JSON index files (e.g., my_repo_signatures.json). Defaults to current directory.")
+    build_cmd_parser.add_argument("--workers", type=int, default=None,
+                                  help="Number of processes used to parse files (default: CPU count).")
+    build_cmd_parser.add_argument("--format", choices=["json", "jsonl", "sqlite"], default="json",
+                                  help="'json' writes the _signatures/_fullsource JSON pair (default); "
+                                       "'jsonl' writes the pair as JSON Lines with offset sidecars, read lazily; "
+                                       "'sqlite' writes a single <repo_name>.db SQLite index.")
+    build_cmd_parser.add_argument("--incremental", action="store_true",
+                                  help="With --format sqlite, only re-parse files changed since the last build.")
+    build_cmd_parser.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP_MODE,
+                                  help="Store duplicate elements once with their other locations: 'exact' "
+                                       "(default), 'near' (MinHash near-duplicates too) or 'off'. JSON format only.")
 
     query_cmd_parser = subparsers.add_parser("query",
                                          help="Query a JSON index file for relevant code elements.")
     query_cmd_parser.add_argument("--index", type=str, required=True,
-                                  help="Path to the JSON index file to query (either _signatures.json or _fullsource.json).")
+                                  help="Path to the index file to query (_signatures.json, _fullsource.json or a SQLite .db).")
     query_cmd_parser.add_argument("--query", type=str, required=True,
                                   help="Search query string (searches element names and docstrings).")
     query_cmd_parser.add_argument("--k", type=int, default=3,
                                   help="Number of top results to return (default: 3).")
 
+    lookup_cmd_parser = subparsers.add_parser("lookup",
+                                          help="Look up code elements by exact name, optionally in one file.")
+    lookup_cmd_parser.add_argument("--index", type=str, required=True,
+                                   help="Path to the index file (_signatures.json, _fullsource.json or a SQLite .db).")
+    lookup_cmd_parser.add_argument("--name", type=str, required=True,
+                                   help="Exact function or class name.")
+    lookup_cmd_parser.add_argument("--file", type=str, default=None,
+                                   help="Restrict to this file (repository-relative path or a trailing part of it).")
+
     argv = sys.argv[1:]
     if not argv and sys.stdin.isatty(): 
         parser.print_help(sys.stderr)
@@ -269,10 +1159,18 @@ def main_cli():
         
     args = parser.parse_args(argv if argv else None)
 
-    if args.command == "build":
-        build_json_indices(args.repo, args.output_dir)
-    elif args.command == "query":
-        query_results = query_json_file(args.query, args.index, args.k)
+    if args.command == "build" and args.format == "sqlite":
+        from context_store_sqlite import build_sqlite_index
+        repo_path = Path(args.repo).resolve()
+        build_sqlite_index(repo_path, Path(args.output_dir) / f"{repo_path.name}.db",
+                           workers=args.workers, incremental=args.incremental)
+    elif args.command == "build":
+        build_json_indices(args.repo, args.output_dir, workers=args.workers, dedup=args.dedup, index_format=args.format)
+    elif args.command in ("query", "lookup"):
+        if args.command == "query":
+            query_results = query_json_file(args.query, args.index, args.k)
+        else:
+            query_results = lookup_element(args.name, args.index, file_path=args.file)
         if query_results:
             print(json.dumps(query_results, ensure_ascii=False, indent=2))
         else:
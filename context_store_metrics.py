@@ -0,0 +1,164 @@
+"""
+Timing spans, counters and verbosity-gated logging for context_store.
+
+Code marks phases with `span("embed")` and counts work with `count("chunks", n)`. Both are
+near no-ops until `configure_metrics()` turns collection on (the CLI's --metrics flag).
+Collected data is written as a JSON-lines trace (one record per finished span, streamed
+as spans end, then one record with the counters) or as a Prometheus text-format dump of
+per-span totals and counters.
+
+Span names used across the project: discovery, parse, chunk, embed, save, load,
+encode_query, score, format. Counters: files, bytes, chunks, cache_hits, cache_misses, queries.
+
+Debug output goes through `log(message, level)`, printed to stderr only when the verbosity
+set by `set_verbosity()` (the CLI's -v/-vv) is at least `level`.
+Standard library only.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_FORMATS = ("jsonl", "prom")
+
+_lock = threading.Lock()
+_local = threading.local()
+_state = {"enabled": False, "trace": None, "next_id": 0}
+_span_totals = {}  # span name -> [count, total seconds]
+_counters = {}
+_verbosity = 0
+
+# ---------- Verbosity ----------
+
+def set_verbosity(level):
+    """Sets the verbosity used by `log` (0: quiet, 1: per-file progress, 2: per-chunk debugging)."""
+    global _verbosity
+    _verbosity = level or 0
+
+
+def log(message, level=1):
+    """Prints `message` to stderr when the verbosity is at least `level`."""
+    if _verbosity >= level:
+        print(message, file=sys.stderr)
+
+# ---------- Collection ----------
+
+def metrics_enabled():
+    return _state["enabled"]
+
+
+def configure_metrics(enabled=True, trace_path=None):
+    """
+    Turns metric collection on or off and resets everything collected so far.
+
+    Args:
+        enabled (bool, optional): Collect spans and counters.
+        trace_path (str | pathlib.Path, optional): Stream finished spans to this JSON-lines file.
+    """
+    with _lock:
+        if _state["trace"]:
+            _state["trace"].close()
+        _state.update(enabled=enabled, next_id=0,
+                      trace=open(trace_path, "w", encoding="utf-8") if enabled and trace_path else None)
+        _span_totals.clear()
+        _counters.clear()
+
+
+def count(name, value=1):
+    """Adds `value` to the counter `name`."""
+    if not _state["enabled"]:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def _timed_span(name, attrs):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    with _lock:
+        span_id = _state["next_id"] = _state["next_id"] + 1
+    parent_id = stack[-1] if stack else None
+    stack.append(span_id)
+    started_wall, started = time.time(), time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        duration = time.perf_counter() - started
+        stack.pop()
+        with _lock:
+            totals = _span_totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+            if _state["trace"]:
+                record = {"type": "span", "name": name, "id": span_id, "parent": parent_id,
+                          "thread": threading.current_thread().name, "start": round(started_wall, 6),
+                          "duration_s": round(duration, 9)}
+                if attrs: record["attrs"] = attrs
+                _state["trace"].write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def _null_span():
+    yield {}
+
+
+def span(name, **attrs):
+    """
+    Times the enclosed block as span `name`. Spans nest per thread; the yielded dict can be
+    filled with attributes recorded in the trace (e.g. `s["chunks"] = n`).
+    """
+    return _timed_span(name, attrs) if _state["enabled"] else _null_span()
+
+
+def metrics_snapshot():
+    """
+    Returns:
+        dict[str, dict]: {"spans": {name: {"count", "seconds"}}, "counters": {name: value}}.
+    """
+    with _lock:
+        return {"spans": {name: {"count": c, "seconds": s} for name, (c, s) in sorted(_span_totals.items())},
+                "counters": dict(sorted(_counters.items()))}
+
+# ---------- Output ----------
+
+def _prometheus_text(snapshot):
+    lines = ["# HELP context_store_span_seconds_total Wall time spent in each span.",
+             "# TYPE context_store_span_seconds_total counter"]
+    lines += [f'context_store_span_seconds_total{{span="{name}"}} {s["seconds"]:.9f}'
+              for name, s in snapshot["spans"].items()]
+    lines += ["# HELP context_store_span_count_total Number of times each span ran.",
+              "# TYPE context_store_span_count_total counter"]
+    lines += [f'context_store_span_count_total{{span="{name}"}} {s["count"]}' for name, s in snapshot["spans"].items()]
+    for name, value in snapshot["counters"].items():
+        lines += [f"# TYPE context_store_{name}_total counter", f"context_store_{name}_total {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, fmt=None):
+    """
+    Writes what was collected and stops collecting.
+
+    Args:
+        path (str | pathlib.Path): Output file. For "jsonl" this is the trace file given to
+            `configure_metrics`, completed with a final counters record.
+        fmt (str, optional): "jsonl" or "prom". Defaults to "prom" for .prom/.txt paths, else "jsonl".
+    """
+    fmt = fmt or ("prom" if Path(path).suffix in (".prom", ".txt") else "jsonl")
+    snapshot = metrics_snapshot()
+    with _lock:
+        trace, _state["trace"] = _state["trace"], None
+        _state["enabled"] = False
+    if fmt == "jsonl":
+        if trace is None:
+            trace = open(path, "w", encoding="utf-8")
+        with trace:
+            trace.write(json.dumps({"type": "counters", "pid": os.getpid(), **snapshot}) + "\n")
+    else:
+        if trace is not None:
+            trace.close()
+        Path(path).write_text(_prometheus_text(snapshot), encoding="utf-8")
@@ -0,0 +1,218 @@
+"""
+Shard manifests: one queryable index made of many independently built indices.
+
+A manifest is a small JSON file listing code (or prose) index files, e.g. one per service:
+
+  {"format": "context_store.shards", "version": 1, "kind": "code",
+   "shards": [{"name": "billing", "path": "billing/code.npz"}, ...]}
+
+Relative paths are resolved against the manifest's directory. Anything that takes an
+index path (`query`, `query-prose`, `query-hybrid`, the daemon) also takes a manifest.
+Each query is then scattered across the shards in a thread pool, and each shard's top hits
+are merged into a global top-k. Every shard has its own deadline, counted from when it
+starts, so a slow shard is dropped without cutting short the shards queued behind it; only
+a shard still queued when every wave of workers could have used its full timeout is dropped
+unstarted. Shards are loaded and cached independently, so rebuilding, adding or removing one
+shard never reloads the others:
+
+  python context_store.py shard-add --manifest all.shards.json --name billing --index billing/code.npz
+  python context_store.py shard-remove --manifest all.shards.json --name billing
+  python context_store.py shard-list --manifest all.shards.json
+
+Large repositories can also be built in pieces: `build --shard i/N` indexes only the files
+that `shard_of()` assigns to shard i of N (a hash of the file path, so the split is the same
+on every machine and barely moves when files are added), and `merge-index` combines the
+pieces into one index or into a manifest.
+
+Standard library only.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+SHARD_MANIFEST_FORMAT, SHARD_MANIFEST_VERSION = "context_store.shards", 1
+SHARD_KINDS = ("code", "prose")
+DEFAULT_SHARD_TIMEOUT = 30.0
+SCATTER_MAX_WORKERS = 32
+
+
+def parse_shard_spec(spec):
+    """
+    Parses a build shard spec.
+
+    Args:
+        spec (str): "i/N", with 1 <= i <= N.
+
+    Returns:
+        tuple[int, int]: (i, N).
+
+    Raises:
+        ValueError: The spec is malformed or out of range.
+    """
+    index, _, total = str(spec).partition("/")
+    try:
+        index, total = int(index), int(total)
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}; expected i/N, e.g. 2/8.") from None
+    if not 1 <= index <= total:
+        raise ValueError(f"Invalid shard {spec!r}; i must be between 1 and N.")
+    return index, total
+
+
+def shard_of(rel_path, total):
+    """The shard (1..total) that builds the file at repository-relative path `rel_path`."""
+    digest = hashlib.blake2b(Path(rel_path).as_posix().encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % total + 1
+
+
+def is_shard_manifest(path):
+    """True when `path` is a shard manifest (a .json file in the manifest format)."""
+    path = Path(path)
+    if path.suffix != ".json" or not path.is_file():
+        return False
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("format") == SHARD_MANIFEST_FORMAT
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def load_manifest(path):
+    """
+    Reads a shard manifest.
+
+    Returns:
+        dict[str, any]: {"kind": "code" | "prose", "shards": [{"name": str, "path": pathlib.Path}, ...]},
+            with shard paths resolved.
+
+    Raises:
+        FileNotFoundError: The manifest does not exist.
+        ValueError: The file is not a shard manifest of a supported version.
+    """
+    path = Path(path).resolve()
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or manifest.get("format") != SHARD_MANIFEST_FORMAT:
+        raise ValueError(f"{path} is not a shard manifest.")
+    if manifest.get("version") != SHARD_MANIFEST_VERSION:
+        raise ValueError(f"Unsupported shard manifest version {manifest.get('version')!r} in {path}.")
+    shards = [{"name": shard["name"], "path": (path.parent / shard["path"]).resolve()}
+              for shard in manifest.get("shards", [])]
+    return {"kind": manifest.get("kind", "code"), "shards": shards}
+
+
+def write_manifest(path, kind, shards):
+    """
+    Writes a shard manifest atomically, storing shard paths relative to it where possible.
+
+    Args:
+        path (str | pathlib.Path): Manifest file (conventionally *.shards.json).
+        kind (str): "code" or "prose".
+        shards (list[dict[str, any]]): {"name", "path"} entries, in query order.
+    """
+    if kind not in SHARD_KINDS:
+        raise ValueError(f"Unknown shard kind {kind!r}; expected one of {', '.join(SHARD_KINDS)}.")
+    path = Path(path).resolve()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for shard in shards:
+        shard_path = Path(shard["path"]).resolve()
+        try: shard_path = Path(os.path.relpath(shard_path, path.parent))
+        except ValueError: pass  # Another drive on Windows: keep it absolute.
+        entries.append({"name": shard["name"], "path": shard_path.as_posix()})
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"format": SHARD_MANIFEST_FORMAT, "version": SHARD_MANIFEST_VERSION, "kind": kind,
+                   "shards": entries}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def add_shard(manifest_path, name, index_path, kind=None):
+    """
+    Adds a shard to a manifest (creating it if needed), or points an existing shard of that
+    name at a new index. The other shards are left as they are.
+
+    Args:
+        manifest_path (str | pathlib.Path): Manifest file.
+        name (str): Shard name, unique within the manifest (e.g. the service name).
+        index_path (str | pathlib.Path): The shard's index file or directory.
+        kind (str, optional): "code" or "prose" for a new manifest. Defaults to "code".
+    """
+    manifest = load_manifest(manifest_path) if Path(manifest_path).exists() else {"kind": kind or "code", "shards": []}
+    if kind and kind != manifest["kind"]:
+        raise ValueError(f"{manifest_path} holds {manifest['kind']} shards, not {kind}.")
+    shards = [shard for shard in manifest["shards"] if shard["name"] != name]
+    replaced = len(shards) != len(manifest["shards"])
+    position = next((i for i, shard in enumerate(manifest["shards"]) if shard["name"] == name), len(shards))
+    shards.insert(position, {"name": name, "path": index_path})
+    write_manifest(manifest_path, manifest["kind"], shards)
+    return "replaced" if replaced else "added"
+
+
+def remove_shard(manifest_path, name):
+    """Removes the named shard from a manifest. Raises KeyError when it is not listed."""
+    manifest = load_manifest(manifest_path)
+    shards = [shard for shard in manifest["shards"] if shard["name"] != name]
+    if len(shards) == len(manifest["shards"]):
+        raise KeyError(f"No shard named {name!r} in {manifest_path}.")
+    write_manifest(manifest_path, manifest["kind"], shards)
+
+
+def scatter(shards, search_fn, timeout=DEFAULT_SHARD_TIMEOUT):
+    """
+    Runs `search_fn(shard)` for every shard concurrently.
+
+    Args:
+        shards (list[dict[str, any]]): Shards from `load_manifest()`.
+        search_fn (callable): Searches one shard.
+        timeout (float, optional): Seconds each shard has to answer, counted from when it starts
+            running. The whole scatter is capped at `timeout` per wave of workers (the number
+            of shards over the pool size, rounded up); a shard still queued then, behind
+            workers stuck on timed-out shards, is dropped unstarted. Shards that time out or
+            fail are reported on stderr and left out, so one slow or broken shard degrades the
+            results instead of failing the query.
+
+    Returns:
+        list[tuple[dict[str, any], any]]: (shard, result) for the shards that answered, in manifest order.
+    """
+    if not shards:
+        return []
+    started = {}
+
+    def _run(i, shard):
+        started[i] = time.monotonic()
+        return search_fn(shard)
+
+    workers = min(len(shards), SCATTER_MAX_WORKERS)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+    try:
+        limit = timeout * -(-len(shards) // workers)
+        cap = time.monotonic() + limit
+        futures = [pool.submit(_run, i, shard) for i, shard in enumerate(shards)]
+        pending, timed_out = set(range(len(shards))), set()
+        while pending:
+            pending = {i for i in pending if not futures[i].done()}
+            now = time.monotonic()
+            deadlines = {i: min(started[i] + timeout, cap) if i in started else cap for i in pending}
+            expired = {i for i, deadline in deadlines.items() if deadline <= now}
+            timed_out |= expired
+            pending -= expired
+            if pending:
+                wait([futures[i] for i in pending], timeout=min(deadlines[i] for i in pending) - now,
+                     return_when=FIRST_COMPLETED)
+        answered = []
+        for i, (shard, future) in enumerate(zip(shards, futures)):
+            if i in timed_out:
+                state = f"answer within {timeout}s" if i in started else f"start within {limit}s"
+                print(f"Warning: Shard {shard['name']} did not {state}; skipping it.", file=sys.stderr)
+            elif future.exception() is not None:
+                print(f"Warning: Shard {shard['name']} failed ({future.exception()}); skipping it.", file=sys.stderr)
+            else:
+                answered.append((shard, future.result()))
+        return answered
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
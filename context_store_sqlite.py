@@ -0,0 +1,252 @@
+"""
+SQLite backend for the lightweight context store.
+
+Holds the same elements as the `_signatures.json` / `_fullsource.json` pair in one database:
+an `elements` table indexed on file path and element name, and an FTS5 table over the
+elements' names, signatures and docstrings (split into identifier sub-tokens). Queries
+and exact lookups read only the rows they return, and a rebuild re-parses only the files
+whose stat changed. Standard library only.
+"""
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+from context_store_json import (FIELD_WEIGHTS, _query_terms, format_result, is_public_element,
+                                iter_file_chunks, path_matches, python_file_entries, term_list)
+from context_store_metrics import count, span
+
+SQLITE_FORMAT = "context_store_sqlite"
+SQLITE_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (file_path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS elements (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    element_name TEXT NOT NULL,
+    element_type TEXT NOT NULL,
+    start_line INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    docstring TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    source_code TEXT NOT NULL,
+    public INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS elements_file_path ON elements (file_path, start_line);
+CREATE INDEX IF NOT EXISTS elements_element_name ON elements (element_name);
+CREATE VIRTUAL TABLE IF NOT EXISTS elements_fts USING fts5 (
+    name, signature, docstring, tokenize = "unicode61 tokenchars '_'"
+);
+"""
+_FTS_WEIGHTS = (FIELD_WEIGHTS["name"], FIELD_WEIGHTS["signature"], FIELD_WEIGHTS["docstring"])
+_ELEMENT_COLUMNS = "file_path, element_name, element_type, start_line, end_line, docstring, signature"
+
+# ---------- Building & Upserts ----------
+
+def _open_for_writing(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_SCHEMA)
+    conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                     [("format", SQLITE_FORMAT), ("version", str(SQLITE_VERSION))])
+    conn.commit()
+    return conn
+
+
+def _open_readonly(db_path):
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _is_current_format(db_path):
+    try:
+        conn = _open_readonly(db_path)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return meta.get("format") == SQLITE_FORMAT and meta.get("version") == str(SQLITE_VERSION)
+
+
+def _delete_file(conn, rel_path):
+    conn.execute("DELETE FROM elements_fts WHERE rowid IN (SELECT id FROM elements WHERE file_path = ?)", (rel_path,))
+    conn.execute("DELETE FROM elements WHERE file_path = ?", (rel_path,))
+    conn.execute("DELETE FROM files WHERE file_path = ?", (rel_path,))
+
+
+def _replace_file(conn, rel_path, chunks, st):
+    _delete_file(conn, rel_path)
+    for chunk in chunks:
+        cursor = conn.execute(
+            f"INSERT INTO elements ({_ELEMENT_COLUMNS}, source_code, public) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (chunk["file_path"], chunk["element_name"], chunk["element_type"], chunk["start_line"],
+             chunk["end_line"], chunk["docstring"], chunk["signature"], chunk["source_code"],
+             int(is_public_element(chunk["element_name"]))))
+        conn.execute("INSERT INTO elements_fts (rowid, name, signature, docstring) VALUES (?, ?, ?, ?)",
+                     (cursor.lastrowid, " ".join(term_list(chunk["element_name"])),
+                      " ".join(term_list(chunk["signature"])), " ".join(term_list(chunk["docstring"]))))
+    conn.execute("INSERT INTO files (file_path, mtime_ns, size) VALUES (?, ?, ?)",
+                 (rel_path, st.st_mtime_ns, st.st_size))
+
+
+def _upsert(conn, repo_root_path, py_files, workers):
+    existing = [p for p in py_files if p.is_file()]
+    for py_file in py_files:
+        if py_file not in existing:
+            _delete_file(conn, str(py_file.relative_to(repo_root_path)))
+    for py_file, chunks in iter_file_chunks(existing, repo_root_path, workers=workers):
+        _replace_file(conn, str(py_file.relative_to(repo_root_path)), chunks, py_file.stat())
+
+
+def upsert_files(db_path_str, repo_path_str, py_file_paths, workers=None):
+    """
+    Re-parses the given files into an existing SQLite index, replacing their elements in one
+    transaction. Files that no longer exist are removed from the index.
+
+    Args:
+        db_path_str (str | pathlib.Path): Path to the SQLite index.
+        repo_path_str (str | pathlib.Path): Repository root the index was built from.
+        py_file_paths (list[str | pathlib.Path]): Changed or deleted .py files inside the repository.
+        workers (int, optional): Number of processes used to parse files. Defaults to the CPU count.
+    """
+    repo_path = Path(repo_path_str).resolve()
+    py_files = [Path(p).resolve() for p in py_file_paths]
+    conn = _open_for_writing(db_path_str)
+    try:
+        with conn:
+            _upsert(conn, repo_path, py_files, workers)
+    finally:
+        conn.close()
+
+
+def build_sqlite_index(repo_path_str, db_path_str, workers=None, incremental=False, walked=None, parse_files=None):
+    """
+    Scans a Python repository into a SQLite index holding every element's metadata, signature,
+    docstring and source, with FTS5 over names, signatures and docstrings.
+
+    A full build writes to a temporary file that replaces `db_path_str` atomically. With
+    `incremental=True` and an existing index of the current format, only files whose mtime or
+    size changed are re-parsed, and deleted files are dropped, in a single transaction.
+
+    Args:
+        repo_path_str (str | pathlib.Path): Path to the root directory of the Python repository.
+        db_path_str (str | pathlib.Path): Output database path (e.g. project.db).
+        workers (int, optional): Number of processes used to parse files. Defaults to the CPU count.
+        incremental (bool, optional): Update an existing index in place.
+        walked (list[context_store_walk.WalkedFile], optional): Files already discovered by the caller.
+        parse_files (callable, optional): Replaces `iter_file_chunks()` for a full build (see
+            `build_json_indices()`).
+    """
+    repo_path = Path(repo_path_str).resolve()
+    db_path = Path(db_path_str).resolve()
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    with span("discovery"):
+        entries = python_file_entries(repo_path, workers=workers) if walked is None else walked
+        py_files = [entry.path for entry in entries]
+    count("files", len(py_files))
+
+    if incremental and db_path.exists() and _is_current_format(db_path):
+        conn = _open_for_writing(db_path)
+        try:
+            indexed = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT file_path, mtime_ns, size FROM files")}
+            current = {entry.rel_path: entry for entry in entries}
+            changed = [entry.path for entry in entries if indexed.get(entry.rel_path) !=
+                       (entry.stat.st_mtime_ns, entry.stat.st_size)]
+            changed += [repo_path / rel_path for rel_path in indexed if rel_path not in current]
+            with conn:
+                _upsert(conn, repo_path, changed, workers)
+            n_elements = conn.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"SQLite index updated at {db_path} ({len(changed)} of {len(py_files)} files re-parsed, "
+              f"{n_elements} elements)", file=sys.stderr)
+        return
+
+    tmp_path = db_path.with_name(f".{db_path.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    conn = _open_for_writing(tmp_path)
+    try:
+        with conn:
+            parsed = parse_files(py_files) if parse_files else iter_file_chunks(py_files, repo_path, workers=workers)
+            for entry, (_, chunks) in zip(entries, parsed):
+                _replace_file(conn, entry.rel_path, chunks, entry.stat)
+        n_elements = conn.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+        conn.execute("PRAGMA optimize")
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+    os.replace(tmp_path, db_path)
+    print(f"SQLite index exported to {db_path} ({n_elements} elements from {len(py_files)} files)", file=sys.stderr)
+
+# ---------- Querying ----------
+
+def _row_result(row, include_source):
+    element = dict(row)
+    if not include_source:
+        element.pop("source_code", None)
+    return format_result(element)
+
+
+def query_sqlite_index(query_str, db_path_str, k=3, include_source=False, public_only=True):
+    """
+    Ranks indexed elements against a query with FTS5's BM25, weighting the name, signature and
+    docstring columns like the JSON index (FIELD_WEIGHTS). Each query word and identifier
+    sub-token matches terms equal to it (counted twice) or starting with it.
+
+    Args:
+        query_str (str): Search query string.
+        db_path_str (str | pathlib.Path): Path to the SQLite index.
+        k (int, optional): Number of top results to return. Defaults to 3.
+        include_source (bool, optional): Attach each element's source as "snippet".
+        public_only (bool, optional): Only return public elements, like the _signatures.json index.
+
+    Returns:
+        list[dict[str, any]]: Results in the same shape as `query_json_file`.
+    """
+    terms = sorted(_query_terms(query_str))
+    if not terms:
+        return []
+    count("queries")
+    match_expr = " OR ".join(f'"{term}" OR "{term}"*' for term in terms)
+    conn = _open_readonly(db_path_str)
+    try:
+        with span("score"):
+            rows = conn.execute(
+                f"SELECT {', '.join('e.' + c for c in _ELEMENT_COLUMNS.split(', '))}, e.source_code "
+                f"FROM elements_fts JOIN elements e ON e.id = elements_fts.rowid "
+                f"WHERE elements_fts MATCH ? {'AND e.public = 1' if public_only else ''} "
+                f"ORDER BY bm25(elements_fts, ?, ?, ?), e.start_line LIMIT ?",
+                (match_expr, *_FTS_WEIGHTS, k)).fetchall()
+    finally:
+        conn.close()
+    with span("format"):
+        return [_row_result(row, include_source) for row in rows]
+
+
+def lookup_sqlite_element(element_name, db_path_str, file_path=None):
+    """
+    Looks up elements by exact name through the element-name index, optionally restricted to
+    one file ("function X in file Y"). Private elements are included.
+
+    Args:
+        element_name (str): Exact function or class name.
+        db_path_str (str | pathlib.Path): Path to the SQLite index.
+        file_path (str, optional): Repository-relative path of the file, or any trailing part of it.
+
+    Returns:
+        list[dict[str, any]]: Matching elements with their source, ordered by file path and start line.
+    """
+    conn = _open_readonly(db_path_str)
+    try:
+        rows = conn.execute(f"SELECT {_ELEMENT_COLUMNS}, source_code FROM elements WHERE element_name = ? "
+                            f"ORDER BY file_path, start_line", (element_name,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_result(row, include_source=True) for row in rows
+            if file_path is None or path_matches(row["file_path"], file_path)]
@@ -0,0 +1,173 @@
+"""
+Token counting and budget-constrained result packing for context_store.
+
+Counters are chosen by name with `configure_tokenizer()` (the CLI's --tokenizer):
+
+  approx           Offline approximation of a BPE tokenizer on code (default, standard library only):
+                   identifiers and words cost about one token per 6 letters, numbers one per 3 digits,
+                   runs of punctuation one per 2 characters and each line break with its indentation one.
+  whitespace       Whitespace-separated words (the old estimate; undercounts code heavily).
+  tiktoken[:enc]   Exact counts from tiktoken (default encoding cl100k_base); needs `tiktoken`.
+  hf:<model>       Exact counts from a Hugging Face tokenizer; needs `transformers`.
+
+A callable mapping text to a token count can be registered under a new name with
+`register_tokenizer()`. Indices store each chunk's count under the tokenizer's name, so
+queries with the same tokenizer never re-tokenize.
+
+`select_within_budget()` solves the packing problem: pick at most k candidates, each in one
+of its variants (e.g. a class in full or trimmed to its signature), maximizing total
+relevance while the total token cost stays within the budget. Its dynamic program is bounded
+to PACKING_MAX_STEPS cell updates: larger problems are solved at a coarser cost resolution and,
+past PACKING_MIN_RESOLUTION, greedily by relevance per token.
+"""
+import re
+import threading
+
+DEFAULT_TOKENIZER = "approx"
+PACKING_RESOLUTION = 512  # The token budget is discretized into at most this many cost units.
+PACKING_MAX_STEPS = 2 ** 17  # Bound on variants × cost units × k, so packing stays cheap next to the search.
+PACKING_MIN_RESOLUTION = 32  # Below this many cost units, greedy packing is as good as the DP.
+
+_APPROX_RE = re.compile(r"[A-Za-z]+|\d+|\n[ \t]*|[ \t]+|[^\sA-Za-z\d]+")
+_TOKENIZERS = {}
+_LOCK = threading.Lock()
+_active = [DEFAULT_TOKENIZER]
+
+
+def _approx_tokens(text):
+    n = 0
+    for piece in _APPROX_RE.findall(text):
+        first = piece[0]
+        if first.isalpha(): n += (len(piece) + 5) // 6
+        elif first.isdigit(): n += (len(piece) + 2) // 3
+        elif first == "\n": n += 1
+        elif first in " \t": n += 0 if len(piece) == 1 else 1
+        else: n += (len(piece) + 1) // 2
+    return n
+
+
+def _whitespace_tokens(text):
+    return len(text.split())
+
+
+def _load_tokenizer(name):
+    if name == "approx": return _approx_tokens
+    if name == "whitespace": return _whitespace_tokens
+    if name == "tiktoken" or name.startswith("tiktoken:"):
+        import tiktoken
+        encoding = tiktoken.get_encoding(name.partition(":")[2] or "cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    if name.startswith("hf:"):
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name[3:])
+        return lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"])
+    raise ValueError(f"Unknown tokenizer {name!r}; use approx, whitespace, tiktoken[:encoding] or hf:<model>.")
+
+
+def register_tokenizer(name, count_fn):
+    """Registers `count_fn(text) -> int` under `name`, for use with `configure_tokenizer(name)`."""
+    with _LOCK:
+        _TOKENIZERS[name] = count_fn
+
+
+def get_tokenizer(name=None):
+    """Returns the token-counting function for `name` (default: the configured tokenizer)."""
+    name = name or _active[0]
+    with _LOCK:
+        if name not in _TOKENIZERS:
+            _TOKENIZERS[name] = _load_tokenizer(name)
+        return _TOKENIZERS[name]
+
+
+def configure_tokenizer(name=None):
+    """
+    Selects the tokenizer used for token budgets from now on.
+
+    Args:
+        name (str, optional): A tokenizer name (see the module docstring). Defaults to "approx".
+
+    Returns:
+        str: The active tokenizer name.
+    """
+    name = name or DEFAULT_TOKENIZER
+    get_tokenizer(name)  # Fail early on unknown names or missing packages.
+    _active[0] = name
+    return name
+
+
+def active_tokenizer():
+    return _active[0]
+
+
+def count_tokens(text, name=None):
+    """Number of tokens in `text` under tokenizer `name` (default: the configured one)."""
+    return get_tokenizer(name)(text)
+
+
+def select_within_budget(candidates, budget, k):
+    """
+    Multiple-choice 0/1 knapsack with a cardinality limit, solved by dynamic programming
+    (greedily when the program would exceed PACKING_MAX_STEPS even at PACKING_MIN_RESOLUTION).
+
+    Args:
+        candidates (list[list[tuple[float, int]]]): For each candidate, its variants as
+            (relevance, token cost) pairs; at most one variant per candidate is chosen.
+        budget (int | float): Total token budget. An infinite budget takes the top k by relevance.
+        k (int): Maximum number of candidates to choose.
+
+    Returns:
+        list[tuple[int, int]]: (candidate index, variant index) pairs, in candidate order. The DP
+            rounds costs up to the budget's resolution, so a selection never exceeds the budget.
+    """
+    if k <= 0 or not candidates:
+        return []
+    if budget == float("inf"):
+        picks = [(i, max(range(len(v)), key=lambda j: v[j][0])) for i, v in enumerate(candidates) if v]
+        return sorted(sorted(picks, key=lambda p: -candidates[p[0]][p[1]][0])[:k])
+    variant_count = sum(len(variants) for variants in candidates)
+    resolution = min(PACKING_RESOLUTION, PACKING_MAX_STEPS // (variant_count * k))
+    if resolution < min(PACKING_MIN_RESOLUTION, int(budget)):
+        return _select_greedily(candidates, budget, k)
+    unit = max(1, -(-int(budget) // max(1, resolution)))
+    capacity = int(budget) // unit
+    # best[c][n]: the highest value using at most c cost units and exactly n items; took[i][c][n]:
+    # the variant of candidate i that entry took (None if it skipped i), to trace the choices back.
+    best = [[0.0] + [None] * k for _ in range(capacity + 1)]
+    took = {}
+    for i, variants in enumerate(candidates):
+        options = [(value, -(-cost // unit), j) for j, (value, cost) in enumerate(variants)
+                   if value > 0 and -(-cost // unit) <= capacity]
+        if not options:
+            continue
+        took[i] = choices = [[None] * (k + 1) for _ in range(capacity + 1)]
+        for c in range(capacity, -1, -1):
+            row, chosen = best[c], choices[c]
+            for n in range(min(k, i + 1), 0, -1):
+                current = row[n]
+                for value, weight, j in options:
+                    if weight > c: continue
+                    prev = best[c - weight][n - 1]
+                    if prev is not None and (current is None or prev + value > current):
+                        current, chosen[n] = prev + value, j
+                row[n] = current
+    n = max((n for n in range(k + 1) if best[capacity][n] is not None), key=lambda n: best[capacity][n])
+    picks, c = [], capacity
+    for i in reversed(list(took)):
+        j = took[i][c][n]
+        if j is None: continue
+        picks.append((i, j))
+        c, n = c - -(-candidates[i][j][1] // unit), n - 1
+    return picks[::-1]
+
+
+def _select_greedily(candidates, budget, k):
+    # Variants in order of relevance per token, each taken if its candidate is still unpicked and it fits.
+    order = sorted(((value / max(cost, 1e-9), i, j) for i, variants in enumerate(candidates)
+                    for j, (value, cost) in enumerate(variants) if value > 0 and cost <= budget), reverse=True)
+    picks, spent = {}, 0
+    for _, i, j in order:
+        if len(picks) == k: break
+        cost = candidates[i][j][1]
+        if i not in picks and spent + cost <= budget:
+            picks[i], spent = j, spent + cost
+    return sorted(picks.items())
@@ -0,0 +1,417 @@
+import hashlib
+import time
+from pathlib import Path
+
+import numpy as np
+
+# ---------- Exact Search ----------
+
+_SCORE_BLOCK_ROWS = 65536
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k largest scores, best first, using argpartition.
+
+    Args:
+        scores (np.ndarray): 1-D array of scores.
+        k (int): Number of indices to return.
+
+    Returns:
+        np.ndarray: Indices into `scores`, sorted by descending score.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def exact_search(embeddings, query, k):
+    """
+    Brute-force inner-product search, scored in row blocks so memory-mapped matrices are
+    streamed through rather than copied.
+
+    Args:
+        embeddings (np.ndarray): (N, D) matrix of normalized embeddings.
+        query (np.ndarray): (D,) normalized query embedding.
+        k (int): Number of results.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Row ids and their scores, best first.
+    """
+    n_rows = embeddings.shape[0]
+    if n_rows <= _SCORE_BLOCK_ROWS:
+        scores = np.asarray(embeddings @ query, dtype=np.float32)
+        ids = top_k_indices(scores, k)
+        return ids, scores[ids]
+    best_ids, best_scores = [], []
+    for start in range(0, n_rows, _SCORE_BLOCK_ROWS):
+        block_scores = np.asarray(embeddings[start:start + _SCORE_BLOCK_ROWS] @ query, dtype=np.float32)
+        block_top = top_k_indices(block_scores, k)
+        best_ids.append(block_top + start)
+        best_scores.append(block_scores[block_top])
+    ids, scores = np.concatenate(best_ids), np.concatenate(best_scores)
+    order = top_k_indices(scores, k)
+    return ids[order], scores[order]
+
+def exact_search_batch(embeddings, queries, k):
+    """
+    Brute-force search for many queries at once: one matrix-matrix product per row block,
+    then a row-wise argpartition.
+
+    Args:
+        embeddings (np.ndarray): (N, D) matrix of normalized embeddings.
+        queries (np.ndarray): (Q, D) normalized query embeddings.
+        k (int): Number of results per query.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (Q, k') row ids and scores, best first per row,
+        where k' = min(k, N).
+    """
+    n_rows, n_queries = embeddings.shape[0], queries.shape[0]
+    k = min(k, n_rows)
+    if k <= 0:
+        return np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=np.float32)
+    best_ids = np.empty((n_queries, 0), dtype=np.int64)
+    best_scores = np.empty((n_queries, 0), dtype=np.float32)
+    for start in range(0, n_rows, _SCORE_BLOCK_ROWS):
+        block_scores = np.asarray(queries @ embeddings[start:start + _SCORE_BLOCK_ROWS].T, dtype=np.float32)
+        block_k = min(k, block_scores.shape[1])
+        if block_k < block_scores.shape[1]:
+            block_top = np.argpartition(-block_scores, block_k - 1, axis=1)[:, :block_k]
+        else:
+            block_top = np.broadcast_to(np.arange(block_scores.shape[1]), block_scores.shape)
+        best_ids = np.concatenate([best_ids, block_top + start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(block_scores, block_top, axis=1)], axis=1)
+        if best_ids.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+# ---------- IVF (Inverted File) Approximate Search ----------
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def embeddings_fingerprint(embeddings):
+    """
+    Hashes the row count and a strided sample of rows, so a sidecar built for one index
+    can tell when the index next to it has been rebuilt.
+    """
+    n_rows = embeddings.shape[0]
+    sample = np.ascontiguousarray(embeddings[::max(1, n_rows // 64)], dtype=np.float32)
+    return hashlib.sha256(str(embeddings.shape).encode() + sample.tobytes()).hexdigest()
+
+
+def _assign_to_centroids(embeddings, centroids):
+    assignments = np.empty(embeddings.shape[0], dtype=np.int32)
+    for start in range(0, embeddings.shape[0], _SCORE_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(data, n_clusters, n_iter=20, seed=0):
+    """
+    Lloyd's k-means on the unit sphere (cosine similarity), seeded from random rows.
+
+    Args:
+        data (np.ndarray): (N, D) training vectors.
+        n_clusters (int): Number of centroids.
+        n_iter (int, optional): Lloyd iterations. Defaults to 20.
+        seed (int, optional): Random seed, so builds are reproducible. Defaults to 0.
+
+    Returns:
+        np.ndarray: (n_clusters, D) normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    data = _normalize_rows(np.asarray(data, dtype=np.float32))
+    centroids = data[rng.choice(len(data), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign_to_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        empty = np.bincount(assignments, minlength=n_clusters) == 0
+        # Re-seed empty clusters from random points instead of letting them die.
+        sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+        new_centroids = _normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            break
+        centroids = new_centroids
+    return centroids
+
+
+def build_ivf(embeddings, nlist=None, n_iter=20, max_train_points=None, seed=0):
+    """
+    Builds an IVF index: k-means centroids plus, for every centroid, the ids of the rows
+    assigned to it (stored CSR-style as `list_offsets` into `list_ids`).
+
+    Args:
+        embeddings (np.ndarray): (N, D) normalized embeddings (may be memory-mapped).
+        nlist (int, optional): Number of inverted lists. Defaults to about 4 * sqrt(N).
+        n_iter (int, optional): k-means iterations. Defaults to 20.
+        max_train_points (int, optional): Rows sampled to train k-means. Defaults to 256 per list.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict[str, np.ndarray]: The IVF arrays, ready for `save_ivf` / `ivf_search`.
+    """
+    n_rows = embeddings.shape[0]
+    if n_rows == 0:
+        raise ValueError("Cannot build an IVF index over an empty embedding matrix.")
+    nlist = max(1, min(nlist or int(4 * np.sqrt(n_rows)), n_rows))
+    max_train_points = max_train_points or 256 * nlist
+    rng = np.random.default_rng(seed)
+    train_rows = np.sort(rng.choice(n_rows, size=min(n_rows, max_train_points), replace=False))
+    centroids = spherical_kmeans(np.asarray(embeddings[train_rows]), nlist, n_iter=n_iter, seed=seed)
+    assignments = _assign_to_centroids(embeddings, centroids)
+    list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+    return {"centroids": centroids.astype(np.float32), "list_ids": list_ids, "list_offsets": list_offsets,
+            "count": np.int64(n_rows), "fingerprint": np.array(embeddings_fingerprint(embeddings))}
+
+
+def save_ivf(path, ivf):
+    """Writes IVF arrays to an uncompressed, pickle-free .npz file."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp.npz")
+    np.savez(tmp_path, **ivf)
+    tmp_path.replace(path)
+
+
+def load_ivf(path):
+    """Loads IVF arrays written by `save_ivf`."""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def sidecar_matches(sidecar, embeddings):
+    """Returns True if an IVF or quantization sidecar was built for exactly this embedding matrix."""
+    return (int(sidecar["count"]) == embeddings.shape[0]
+            and str(sidecar["fingerprint"]) == embeddings_fingerprint(embeddings))
+
+
+def ivf_candidates(ivf, query, nprobe=8):
+    """
+    Returns the sorted row ids stored in the `nprobe` lists closest to the query, or None
+    when every list would be probed (i.e. the search is exhaustive anyway).
+    """
+    centroids, offsets, list_ids = ivf["centroids"], ivf["list_offsets"], ivf["list_ids"]
+    nprobe = max(1, min(nprobe, len(centroids)))
+    if nprobe == len(centroids):
+        return None
+    probed = top_k_indices(centroids @ query, nprobe)
+    return np.sort(np.concatenate([list_ids[offsets[c]:offsets[c + 1]] for c in probed]))
+
+
+def ivf_search(embeddings, ivf, query, k, nprobe=8):
+    """
+    Approximate search: scores only the rows in the `nprobe` lists whose centroids are
+    closest to the query. Falls back to exact search when the probed lists hold fewer
+    than k rows or when every list is probed anyway.
+
+    Args:
+        embeddings (np.ndarray): (N, D) normalized embeddings.
+        ivf (dict[str, np.ndarray]): Arrays from `build_ivf` / `load_ivf`.
+        query (np.ndarray): (D,) normalized query embedding.
+        k (int): Number of results.
+        nprobe (int, optional): Lists to visit; higher is slower with better recall. Defaults to 8.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Row ids and their scores, best first.
+    """
+    candidates = ivf_candidates(ivf, query, nprobe)
+    if candidates is None or len(candidates) < k:
+        return exact_search(embeddings, query, k)
+    scores = np.asarray(embeddings[candidates] @ query, dtype=np.float32)
+    top = top_k_indices(scores, k)
+    return candidates[top], scores[top]
+
+
+def measure_recall(embeddings, ivf, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """
+    Measures IVF recall@k against exact search, and the mean latency of both.
+
+    Args:
+        embeddings (np.ndarray): (N, D) normalized embeddings.
+        ivf (dict[str, np.ndarray]): Arrays from `build_ivf` / `load_ivf`.
+        queries (np.ndarray): (Q, D) normalized query embeddings.
+        k (int, optional): Cut-off for recall. Defaults to 10.
+        nprobes (Iterable[int], optional): nprobe settings to evaluate.
+
+    Returns:
+        list[dict[str, float]]: One row per nprobe with recall, latency and the exact baseline latency.
+    """
+    start = time.perf_counter()
+    truth = [set(exact_search(embeddings, q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(1, len(queries))
+    report = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [set(ivf_search(embeddings, ivf, q, k, nprobe)[0].tolist()) for q in queries]
+        ivf_ms = (time.perf_counter() - start) * 1000 / max(1, len(queries))
+        recall = np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, truth)]) if truth else 1.0
+        report.append({"nprobe": int(min(nprobe, len(ivf["centroids"]))), "recall": float(recall),
+                       "ivf_ms": ivf_ms, "exact_ms": exact_ms})
+    return report
+
+# ---------- Quantized Storage ----------
+
+QUANTIZATION_SCHEMES = ("float16", "int8", "binary")
+# Coarser codes need a longer shortlist before full-precision rescoring.
+DEFAULT_RESCORE_FACTORS = {"float16": 2, "int8": 4, "binary": 10}
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(codes):
+        return _POPCOUNT_TABLE[codes]
+
+
+def quantize_embeddings(embeddings, scheme):
+    """
+    Compresses an embedding matrix, processing it in row blocks so memory-mapped inputs
+    are never fully loaded.
+
+    - float16: half-precision copy (2 bytes/dim).
+    - int8: per-dimension affine scalar quantization, x ~= (code + 128) * scale + offset (1 byte/dim).
+    - binary: packed sign bits compared by Hamming distance (1 bit/dim).
+
+    Args:
+        embeddings (np.ndarray): (N, D) float embeddings.
+        scheme (str): One of QUANTIZATION_SCHEMES.
+
+    Returns:
+        dict[str, np.ndarray]: The codes and any per-dimension parameters.
+    """
+    if scheme not in QUANTIZATION_SCHEMES:
+        raise ValueError(f"Unknown quantization scheme {scheme!r}; expected one of {QUANTIZATION_SCHEMES}.")
+    n_rows, dim = embeddings.shape
+    params = {}
+    if scheme == "int8":
+        lo, hi = np.full(dim, np.inf, dtype=np.float32), np.full(dim, -np.inf, dtype=np.float32)
+        for start in range(0, n_rows, _SCORE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+            lo, hi = np.minimum(lo, block.min(axis=0)), np.maximum(hi, block.max(axis=0))
+        scale = np.where(hi > lo, (hi - lo) / 255.0, 1.0).astype(np.float32)
+        params = {"scale": scale, "offset": lo}
+    code_shape = (n_rows, (dim + 7) // 8) if scheme == "binary" else (n_rows, dim)
+    codes = np.empty(code_shape, dtype={"float16": np.float16, "int8": np.int8, "binary": np.uint8}[scheme])
+    for start in range(0, n_rows, _SCORE_BLOCK_ROWS):
+        block = np.asarray(embeddings[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+        if scheme == "float16":
+            codes[start:start + len(block)] = block
+        elif scheme == "int8":
+            levels = np.rint((block - params["offset"]) / params["scale"])
+            codes[start:start + len(block)] = (np.clip(levels, 0, 255) - 128).astype(np.int8)
+        else:
+            codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+    return {"scheme": np.array(scheme), "codes": codes, "dim": np.int64(dim), "count": np.int64(n_rows),
+            "fingerprint": np.array(embeddings_fingerprint(embeddings)), **params}
+
+
+def save_quantized(path, quantized):
+    """Writes quantized codes to an uncompressed, pickle-free .npz file."""
+    save_ivf(path, quantized)
+
+
+def load_quantized(path):
+    """Loads quantized codes written by `save_quantized`."""
+    return load_ivf(path)
+
+
+def quantized_scores(quantized, query, rows=None):
+    """
+    Approximate query scores computed directly on the codes (higher is better). For binary
+    codes this is the negated Hamming distance between sign patterns.
+
+    Args:
+        quantized (dict[str, np.ndarray]): Output of `quantize_embeddings` / `load_quantized`.
+        query (np.ndarray): (D,) float query embedding.
+        rows (np.ndarray, optional): Restrict scoring to these row ids.
+
+    Returns:
+        np.ndarray: One float32 score per scored row.
+    """
+    scheme, codes = str(quantized["scheme"]), quantized["codes"]
+    n_rows = codes.shape[0] if rows is None else len(rows)
+    query = np.asarray(query, dtype=np.float32)
+    if scheme == "binary":
+        q_bits = np.packbits(query > 0)
+    elif scheme == "int8":
+        # q . x = (q * scale) . code + sum(q * scale) * 128 + q . offset
+        q_scaled = query * quantized["scale"]
+        bias = np.float32(q_scaled.sum() * 128.0 + query @ quantized["offset"])
+    scores = np.empty(n_rows, dtype=np.float32)
+    for start in range(0, n_rows, _SCORE_BLOCK_ROWS):
+        block = codes[start:start + _SCORE_BLOCK_ROWS] if rows is None else codes[rows[start:start + _SCORE_BLOCK_ROWS]]
+        if scheme == "binary":
+            scores[start:start + len(block)] = -_popcount(block ^ q_bits).sum(axis=1, dtype=np.int32)
+        elif scheme == "int8":
+            scores[start:start + len(block)] = block.astype(np.float32) @ q_scaled + bias
+        else:
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+    return scores
+
+
+def quantized_search(quantized, query, k, full_embeddings=None, rescore_factor=None, candidates=None):
+    """
+    Searches the compressed codes, then optionally rescores the best `k * rescore_factor`
+    candidates against full-precision embeddings (only those rows are read, which keeps
+    memory-mapped full-precision matrices mostly on disk).
+
+    Args:
+        quantized (dict[str, np.ndarray]): Output of `quantize_embeddings` / `load_quantized`.
+        query (np.ndarray): (D,) normalized query embedding.
+        k (int): Number of results.
+        full_embeddings (np.ndarray, optional): Full-precision matrix for rescoring; None skips it.
+        rescore_factor (int, optional): Shortlist size as a multiple of k. Defaults per scheme
+            (see DEFAULT_RESCORE_FACTORS).
+        candidates (np.ndarray, optional): Restrict the search to these row ids (e.g. from IVF).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Row ids and scores, best first.
+    """
+    scores = quantized_scores(quantized, query, candidates)
+    row_ids = np.arange(len(scores)) if candidates is None else np.asarray(candidates)
+    if full_embeddings is None:
+        top = top_k_indices(scores, k)
+        return row_ids[top], scores[top]
+    rescore_factor = rescore_factor or DEFAULT_RESCORE_FACTORS[str(quantized["scheme"])]
+    shortlist = np.sort(row_ids[top_k_indices(scores, max(k, k * rescore_factor))])
+    exact = np.asarray(full_embeddings[shortlist] @ query, dtype=np.float32)
+    top = top_k_indices(exact, k)
+    return shortlist[top], exact[top]
+
+
+def quantization_report(embeddings, queries, k=10, schemes=QUANTIZATION_SCHEMES, rescore_factor=None):
+    """
+    Compares every quantization scheme against exact float32 search.
+
+    Returns:
+        list[dict[str, any]]: Per scheme: bytes per vector, code bytes, total index bytes (the
+        codes plus the float32 matrix kept for rescoring), and recall@k without and with
+        full-precision rescoring.
+    """
+    truth = [set(exact_search(embeddings, q, k)[0].tolist()) for q in queries]
+    float_bytes = embeddings.shape[0] * embeddings.shape[1] * 4
+    report = [{"scheme": "float32", "bytes_per_vector": embeddings.shape[1] * 4, "code_bytes": 0,
+               "total_bytes": float_bytes, "recall": 1.0, "recall_rescored": 1.0}]
+    for scheme in schemes:
+        quantized = quantize_embeddings(embeddings, scheme)
+        recalls = {}
+        for label, full in (("recall", None), ("recall_rescored", embeddings)):
+            found = [set(quantized_search(quantized, q, k, full, rescore_factor)[0].tolist()) for q in queries]
+            recalls[label] = float(np.mean([len(f & t) / max(1, len(t)) for f, t in zip(found, truth)])) if truth else 1.0
+        report.append({"scheme": scheme, "bytes_per_vector": quantized["codes"].shape[1] * quantized["codes"].itemsize,
+                       "code_bytes": int(quantized["codes"].nbytes),
+                       "total_bytes": float_bytes + int(quantized["codes"].nbytes), **recalls})
+    return report
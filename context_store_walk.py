@@ -0,0 +1,202 @@
+"""
+Repository file discovery shared by the index builders and the watcher.
+
+`walk_files()` walks the tree with `os.scandir`, pruning excluded, hidden and git-ignored
+directories before descending into them (instead of listing everything with `rglob` and
+filtering afterwards), and returns each matching file with the stat result taken while
+walking, so incremental builds can compare mtime and size without another `stat` call.
+Top-level directories can be walked in parallel threads, which mostly helps on network
+filesystems and cold caches where each `scandir` waits on I/O.
+
+`.gitignore` support covers the common subset of gitignore(5): comments, blank lines,
+`!` negation, trailing-`/` directory patterns, patterns anchored by a `/`, `*`, `?`,
+`[...]` and `**`. Files in `.git/info/exclude` and nested `.gitignore` files are honoured;
+global excludes and `.gitignore` files above the walked root are not.
+
+Standard library only.
+"""
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+WalkedFile = namedtuple("WalkedFile", ["path", "rel_path", "stat"])
+WalkedFile.__doc__ = "A discovered file: absolute `pathlib.Path`, repository-relative path string, and `os.stat_result`."
+
+_IgnoreRule = namedtuple("_IgnoreRule", ["base", "regex", "negate", "dir_only"])
+
+
+def _glob_to_regex(pattern):
+    # gitignore glob -> regex: "*" and "?" stop at "/", "**" spans directories.
+    out, i, n = [], 0, len(pattern)
+    while i < n:
+        at_segment_start = i == 0 or pattern[i - 1] == "/"
+        if at_segment_start and pattern.startswith("**/", i):
+            out.append("(?:.*/)?"); i += 3; continue
+        if at_segment_start and pattern.startswith("**", i) and i + 2 == n:
+            out.append(".*"); i += 2; continue
+        c = pattern[i]
+        if c == "*": out.append("[^/]*")
+        elif c == "?": out.append("[^/]")
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1])); i += 1
+        elif c == "[" and (end := pattern.find("]", i + 2)) > 0:
+            body = pattern[i + 1:end]
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body).replace("\\", "\\\\") + "]")
+            i = end
+        else: out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def parse_gitignore(lines, base=""):
+    """
+    Parses gitignore lines into rules.
+
+    Args:
+        lines (iterable[str]): The file's lines.
+        base (str, optional): Posix path of the file's directory relative to the walked root ("" for the root).
+
+    Returns:
+        list[_IgnoreRule]: Rules in file order (the last matching rule wins).
+    """
+    rules = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.endswith("\\ "): line = line.rstrip(" ")
+        if not line or line.startswith("#"): continue
+        negate = line.startswith("!")
+        if negate: line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line: continue
+        # A slash anywhere but the end anchors the pattern to the .gitignore's directory;
+        # otherwise it matches a name at any depth below it.
+        anchored = "/" in line
+        regex = ("" if anchored else "(?:.*/)?") + _glob_to_regex(line.lstrip("/"))
+        rules.append(_IgnoreRule(base, re.compile(regex, re.DOTALL), negate, dir_only))
+    return rules
+
+
+def is_ignored(rules, rel_posix, is_dir):
+    """True when the rules (outermost .gitignore first) ignore the root-relative posix path."""
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir: continue
+        if rule.base:
+            if not rel_posix.startswith(rule.base + "/"): continue
+            sub_path = rel_posix[len(rule.base) + 1:]
+        else:
+            sub_path = rel_posix
+        if rule.regex.fullmatch(sub_path): ignored = not rule.negate
+    return ignored
+
+
+def _read_rules(path, base):
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return parse_gitignore(f, base)
+    except OSError:
+        return []
+
+
+class _DirFilter:
+    # Plain names prune any directory of that name; entries with a "/" (e.g. "docs/_build")
+    # prune the directory at that relative path suffix.
+
+    def __init__(self, exclude_dirs, skip_hidden):
+        self.skip_hidden = skip_hidden
+        self.names = {d for d in exclude_dirs if "/" not in d}
+        self.paths = tuple("/" + d.strip("/") for d in exclude_dirs if "/" in d)
+
+    def skips(self, name, rel_posix):
+        if name in self.names or (self.skip_hidden and name.startswith(".")): return True
+        return bool(self.paths) and ("/" + rel_posix).endswith(self.paths)
+
+
+def is_excluded(rel_path, exclude_dirs=(), skip_hidden=False):
+    """True when `walk_files()` with these options would have pruned a directory on the file's relative path."""
+    dir_filter, parts = _DirFilter(exclude_dirs, skip_hidden), Path(rel_path).parts[:-1]
+    return any(dir_filter.skips(name, "/".join(parts[:i + 1])) for i, name in enumerate(parts))
+
+
+class _Walk:
+    # One walk; the per-directory recursion is independent, so subtrees can run in threads.
+
+    def __init__(self, root, suffixes, exclude_dirs, skip_hidden, gitignore, directories):
+        self.root, self.suffixes, self.gitignore, self.directories = root, suffixes, gitignore, directories
+        self.dir_filter = _DirFilter(exclude_dirs, skip_hidden)
+
+    def _skip_dir(self, name, rel_posix, rules):
+        return self.dir_filter.skips(name, rel_posix) or (self.gitignore and is_ignored(rules, rel_posix, True))
+
+    def scan(self, directory, rel_posix, rules):
+        """Returns (files, subdirectories) of one directory; subdirectories are (path, rel_posix, rules)."""
+        if self.gitignore and os.path.isfile(os.path.join(directory, ".gitignore")):
+            rules = rules + _read_rules(os.path.join(directory, ".gitignore"), rel_posix)
+        if self.directories is not None: self.directories.append(directory)
+        files, subdirectories = [], []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return files, subdirectories  # Unreadable, or deleted while walking.
+        for entry in entries:
+            entry_rel = f"{rel_posix}/{entry.name}" if rel_posix else entry.name
+            try:
+                # Symlinked directories are not followed (like rglob), symlinked files are.
+                if entry.is_dir(follow_symlinks=False):
+                    if not self._skip_dir(entry.name, entry_rel, rules):
+                        subdirectories.append((entry.path, entry_rel, rules))
+                    continue
+                if not entry.name.endswith(self.suffixes) or not entry.is_file(): continue
+                if self.gitignore and is_ignored(rules, entry_rel, False): continue
+                files.append(WalkedFile(Path(entry.path), entry_rel.replace("/", os.sep), entry.stat()))
+            except OSError:
+                continue  # Deleted while walking.
+        return files, subdirectories
+
+    def walk(self, directory, rel_posix, rules):
+        files, pending = [], [(directory, rel_posix, rules)]
+        while pending:
+            found, subdirectories = self.scan(*pending.pop())
+            files.extend(found)
+            pending.extend(subdirectories)
+        return files
+
+
+def walk_files(repo_root, suffixes=None, exclude_dirs=(), skip_hidden=False, gitignore=True, workers=1,
+               directories=None):
+    """
+    Lists the files under a repository, pruning excluded directories before descending.
+
+    Args:
+        repo_root (str | pathlib.Path): Directory to walk.
+        suffixes (iterable[str], optional): File suffixes to keep (e.g. (".py",)). Defaults to all files.
+        exclude_dirs (iterable[str], optional): Directory names never descended into; entries containing
+            a "/" (e.g. "docs/_build") match a relative path instead.
+        skip_hidden (bool, optional): Also skip directories whose name starts with ".".
+        gitignore (bool, optional): Honour `.gitignore` files and `.git/info/exclude`. Defaults to True.
+        workers (int, optional): Threads walking top-level directories in parallel. Defaults to 1;
+            None uses the CPU count.
+        directories (list, optional): If given, the absolute paths of the walked directories are
+            appended to it (the watcher uses them as inotify watches).
+
+    Returns:
+        list[WalkedFile]: The files, sorted by relative path.
+    """
+    root = os.path.abspath(repo_root)
+    suffixes = tuple(suffixes) if suffixes is not None else ""
+    walk = _Walk(root, suffixes, exclude_dirs, skip_hidden, gitignore, directories)
+    rules = _read_rules(os.path.join(root, ".git", "info", "exclude"), "") if gitignore else []
+    files, top_level = walk.scan(root, "", rules)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if workers > 1 and len(top_level) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(top_level)), thread_name_prefix="walk") as pool:
+            for found in pool.map(lambda args: walk.walk(*args), top_level):
+                files.extend(found)
+    else:
+        for args in top_level:
+            files.extend(walk.walk(*args))
+    files.sort(key=lambda walked: walked.rel_path)
+    return files
@@ -0,0 +1,173 @@
+"""
+Repository change detection for `python context_store.py watch`.
+
+`RepoWatcher` compares stat snapshots (mtime and size of every watched file) of the
+repository and reports the relative paths that were added, modified or deleted, once the
+tree has been quiet for a debounce interval. Snapshot diffs are always the source of truth.
+On Linux, inotify (through ctypes) wakes the watcher as soon as something changes, and the
+tree is only walked after an event (plus a resync every `resync` seconds, in case an event
+was missed); elsewhere, or when inotify is unavailable or out of watches, it falls back to
+walking the tree every `interval` seconds.
+
+Standard library only.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+from context_store_walk import walk_files
+
+WATCH_EXTENSIONS = (".py", ".md", ".rst", ".txt", ".ipynb")
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_RESYNC_INTERVAL = 60.0
+# Directories never worth watching: VCS metadata, caches, virtualenvs and build output.
+IGNORED_DIRS = {"__pycache__", "node_modules", "venv", "env", "site-packages", "build", "dist"}
+
+# inotify(7) event mask: content, metadata and directory-entry changes.
+_IN_MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+
+
+def snapshot(repo_root, extensions=WATCH_EXTENSIONS):
+    """
+    Stats every watched file under `repo_root`, skipping hidden, IGNORED_DIRS and git-ignored directories.
+
+    Returns:
+        tuple[dict[str, tuple[int, int]], list[str]]: (mtime_ns, size) per repository-relative
+            file path, and the absolute paths of the directories walked.
+    """
+    directories = []
+    files = {rel_path: (st.st_mtime_ns, st.st_size) for _, rel_path, st in
+             walk_files(repo_root, extensions, IGNORED_DIRS, skip_hidden=True, directories=directories)}
+    return files, directories
+
+
+def diff_snapshots(old, new):
+    """Returns the set of paths added, deleted or changed between two `snapshot()` file maps."""
+    return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+class _Inotify:
+    # Only used as a wake-up signal; the events themselves are drained and discarded.
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watched = set()
+
+    def watch(self, directories):
+        directories = set(directories)
+        added = directories - self._watched
+        for directory in added:
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_MASK) < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        # Watches of deleted directories are dropped by the kernel; forget them so a directory
+        # recreated under the same name is watched again.
+        self._watched = directories
+        return added
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready: return False
+        try:
+            while os.read(self._fd, 65536): pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+class RepoWatcher:
+    """
+    Reports batches of changed files under a repository.
+
+    Args:
+        repo_root (str | pathlib.Path): Repository root.
+        extensions (tuple[str, ...], optional): File suffixes to watch. Defaults to WATCH_EXTENSIONS.
+        interval (float, optional): Seconds between snapshots when polling. Unused with inotify.
+        debounce (float, optional): A batch is reported once no file has changed for this many seconds.
+        use_inotify (bool, optional): Snapshot only on inotify events when available. Defaults to True.
+        resync (float, optional): With inotify, the longest time between snapshots, so an event
+            the kernel dropped (e.g. on queue overflow) is still picked up. Defaults to
+            DEFAULT_RESYNC_INTERVAL.
+    """
+
+    def __init__(self, repo_root, extensions=WATCH_EXTENSIONS, interval=DEFAULT_POLL_INTERVAL,
+                 debounce=DEFAULT_DEBOUNCE, use_inotify=True, resync=DEFAULT_RESYNC_INTERVAL):
+        self.repo_root, self.extensions = str(repo_root), tuple(extensions)
+        self.interval, self.debounce, self.resync = interval, debounce, resync
+        self._inotify = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"Info: inotify unavailable ({e}); polling every {interval}s.", file=sys.stderr)
+        self.files = self._rescan()
+
+    @property
+    def backend(self):
+        return "inotify" if self._inotify else "polling"
+
+    def _next_wait(self):
+        if not self._inotify: return self.interval
+        return max(0.0, self._last_scan + self.resync - time.monotonic())
+
+    def _sleep(self, timeout):
+        # True when a snapshot is due: the poll interval passed, inotify reported events, or the resync is due.
+        if not self._inotify:
+            time.sleep(timeout)
+            return True
+        return self._inotify.wait(timeout) or time.monotonic() - self._last_scan >= self.resync
+
+    def _rescan(self):
+        files, directories = snapshot(self.repo_root, self.extensions)
+        while self._inotify:
+            try: added = self._inotify.watch(directories)
+            except OSError as e:  # e.g. fs.inotify.max_user_watches reached: keep going by polling.
+                print(f"Info: inotify stopped ({e}); polling every {self.interval}s.", file=sys.stderr)
+                self.close()
+                break
+            if not added: break
+            # Files created in a new directory before its watch was added raised no event: walk again.
+            files, directories = snapshot(self.repo_root, self.extensions)
+        self._last_scan = time.monotonic()
+        return files
+
+    def wait_for_changes(self, timeout=None):
+        """
+        Blocks until files have changed and then stayed unchanged for the debounce interval.
+
+        Args:
+            timeout (float, optional): Give up after this many seconds without any change.
+
+        Returns:
+            set[str]: Repository-relative paths added, modified or deleted since the previous
+                batch (empty on timeout).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0: return set()
+            wait = self._next_wait()
+            if not self._sleep(wait if remaining is None else min(wait, remaining)): continue
+            current = self._rescan()
+            if diff_snapshots(self.files, current): break
+        # Debounce: editors and agents often write a file several times (or several files) in a burst.
+        last_change = time.monotonic()
+        while (quiet := time.monotonic() - last_change) < self.debounce:
+            if not self._sleep(self.debounce - quiet): continue
+            settled = self._rescan()
+            if diff_snapshots(current, settled): current, last_change = settled, time.monotonic()
+        changed, self.files = diff_snapshots(self.files, current), current
+        return changed
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,46 @@
+import hashlib
+import re
+
+import numpy as np
+import pytest
+
+FAKE_MODEL_NAME = "fake/hashing-embedder"
+
+
+class FakeSentenceTransformer:
+    """Deterministic bag-of-words stand-in for SentenceTransformer (no downloads)."""
+
+    def __init__(self, dim=64):
+        self.dim = dim
+        self.encoded_texts = []
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, normalize_embeddings=True):
+        self.encoded_texts.extend(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                bucket = int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim
+                out[row, bucket] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms if normalize_embeddings else out
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    import context_store
+    model = FakeSentenceTransformer()
+    monkeypatch.setitem(context_store._CACHED_MODELS, FAKE_MODEL_NAME, model)
+    monkeypatch.setattr(context_store, "_CACHED_INDICES", {})
+    monkeypatch.setattr(context_store, "_CACHED_ANN", {})
+    monkeypatch.setattr(context_store, "_CACHED_QUANT", {})
+    return model
+
+
+@pytest.fixture(autouse=True)
+def no_embedding_cache(monkeypatch):
+    # Keep tests hermetic: never touch the user's on-disk embedding cache or query daemon.
+    monkeypatch.setenv("CONTEXT_STORE_NO_CACHE", "1")
+    monkeypatch.setenv("CONTEXT_STORE_NO_DAEMON", "1")
+    import context_store
+    monkeypatch.setattr(context_store, "_EMBEDDING_CACHE", None)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from context_store import _ann_path, build_ann_index, build_index, get_code_context
+from context_store_vectors import build_ivf, exact_search, sidecar_matches, ivf_search, measure_recall, top_k_indices
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def clustered_embeddings():
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(20, 32))
+    data = np.repeat(centers, 100, axis=0) + rng.normal(scale=0.3, size=(2000, 32))
+    return (data / np.linalg.norm(data, axis=1, keepdims=True)).astype(np.float32)
+
+
+class TestVectorSearch:
+    def test_top_k_indices_orders_best_first(self):
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+        assert top_k_indices(scores, 3).tolist() == [1, 3, 2]
+        assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 0]
+
+    def test_ivf_recall_and_exact_fallback(self, clustered_embeddings):
+        ivf = build_ivf(clustered_embeddings, nlist=16)
+        assert ivf["list_offsets"][-1] == len(clustered_embeddings)
+        assert sorted(ivf["list_ids"].tolist()) == list(range(len(clustered_embeddings)))
+        queries = clustered_embeddings[::97]
+        report = {row["nprobe"]: row["recall"] for row in measure_recall(
+            clustered_embeddings, ivf, queries, k=5, nprobes=(1, 4, 16))}
+        assert report[16] == 1.0
+        assert report[4] >= 0.9
+        # Asking for more hits than the probed lists hold falls back to exact search.
+        ids, _ = ivf_search(clustered_embeddings, ivf, queries[0], k=1500, nprobe=1)
+        np.testing.assert_array_equal(ids, exact_search(clustered_embeddings, queries[0], 1500)[0])
+
+    def test_fingerprint_detects_rebuilt_index(self, clustered_embeddings):
+        ivf = build_ivf(clustered_embeddings, nlist=8)
+        assert sidecar_matches(ivf, clustered_embeddings)
+        assert not sidecar_matches(ivf, clustered_embeddings[::-1].copy())
+
+
+class TestAnnQuery:
+    def test_query_uses_ivf_sidecar(self, tmp_path, fake_model):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        for i in range(30):
+            (repo / f"mod{i}.py").write_text(f"def function_{i}(value):\n    return value + {i}\n", encoding="utf-8")
+        (repo / "geo.py").write_text("def haversine_distance(lat, lon):\n    return lat - lon\n", encoding="utf-8")
+        for index in (tmp_path / "code.npz", tmp_path / "code.idx"):
+            build_index(repo, index, model_name=FAKE_MODEL_NAME, ann="ivf", nlist=4)
+            assert _ann_path(index).exists()
+            exact = get_code_context("haversine distance lat lon", index, k=3,
+                                     query_model_name=FAKE_MODEL_NAME, search="exact")
+            approx = get_code_context("haversine distance lat lon", index, k=3,
+                                      query_model_name=FAKE_MODEL_NAME, search="ivf", nprobe=4)
+            assert approx == exact
+            assert approx[0]["element_name"] == "haversine_distance"
+
+    def test_stale_sidecar_is_ignored(self, tmp_path, fake_model, capsys):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        (repo / "a.py").write_text("def alpha():\n    pass\n\ndef beta():\n    pass\n", encoding="utf-8")
+        index = tmp_path / "code.npz"
+        build_index(repo, index, model_name=FAKE_MODEL_NAME)
+        build_ann_index(index, nlist=2)
+        (repo / "b.py").write_text("def gamma():\n    pass\n", encoding="utf-8")
+        build_index(repo, index, model_name=FAKE_MODEL_NAME)
+        hits = get_code_context("gamma", index, k=1, query_model_name=FAKE_MODEL_NAME)
+        assert hits[0]["element_name"] == "gamma"
+        assert "stale" in capsys.readouterr().err
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from context_store import build_index, get_code_context, get_code_context_batch
+from context_store_vectors import exact_search, exact_search_batch
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def code_index(tmp_path, fake_model):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "net.py").write_text(
+        "def download_file(url):\n    return fetch(url)\n\ndef parse_json_response(body):\n    return loads(body)\n",
+        encoding="utf-8")
+    (repo / "db.py").write_text(
+        "def open_database_connection(dsn):\n    return connect(dsn)\n\nclass QueryBuilder:\n    pass\n",
+        encoding="utf-8")
+    index = tmp_path / "code.idx"
+    build_index(repo, index, model_name=FAKE_MODEL_NAME)
+    return index
+
+
+class TestBatchQuery:
+    def test_exact_search_batch_matches_single_queries(self):
+        rng = np.random.default_rng(3)
+        embeddings = rng.normal(size=(500, 16)).astype(np.float32)
+        queries = rng.normal(size=(7, 16)).astype(np.float32)
+        ids, scores = exact_search_batch(embeddings, queries, 5)
+        assert ids.shape == scores.shape == (7, 5)
+        for row, query in enumerate(queries):
+            single_ids, single_scores = exact_search(embeddings, query, 5)
+            np.testing.assert_array_equal(ids[row], single_ids)
+            np.testing.assert_allclose(scores[row], single_scores, rtol=1e-5)
+
+    def test_one_model_call_for_all_queries(self, code_index, fake_model, monkeypatch):
+        calls = []
+        original = fake_model.encode
+        monkeypatch.setattr(fake_model, "encode", lambda texts, **kw: calls.append(len(texts)) or original(texts, **kw))
+        queries = ["download file url", "open database connection dsn", "parse json response body"]
+        batched = get_code_context_batch(queries, code_index, k=1, query_model_name=FAKE_MODEL_NAME)
+        assert calls == [3]
+        assert [hits[0]["element_name"] for hits in batched] == [
+            "download_file", "open_database_connection", "parse_json_response"]
+        for query, hits in zip(queries, batched):
+            assert hits == get_code_context(query, code_index, k=1, query_model_name=FAKE_MODEL_NAME)
+
+    def test_empty_batch(self, code_index):
+        assert get_code_context_batch([], code_index, query_model_name=FAKE_MODEL_NAME) == []
@@ -0,0 +1,44 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from bench import compare_results, run_case  # noqa: E402
+from synthetic import HashingEmbedder, generate_prose_repo, generate_python_repo  # noqa: E402
+from context_store_json import build_json_indices  # noqa: E402
+
+
+class TestBenchmarkSuite:
+    def test_python_corpus_has_requested_chunk_count(self, tmp_path):
+        generate_python_repo(tmp_path / "code_repo", 100, seed=1)
+        build_json_indices(tmp_path / "code_repo", tmp_path / "out", workers=1)
+        assert len(json.loads((tmp_path / "out" / "code_repo_fullsource.json").read_text())) == 100
+
+    def test_corpus_and_embedder_are_deterministic(self, tmp_path):
+        for name in ("a", "b"):
+            generate_prose_repo(tmp_path / name, 60, seed=3)
+        files_a = sorted(p.relative_to(tmp_path / "a") for p in (tmp_path / "a").rglob("*") if p.is_file())
+        assert [p.suffix for p in files_a] == [".md", ".ipynb", ".md"]
+        assert all((tmp_path / "a" / p).read_bytes() == (tmp_path / "b" / p).read_bytes() for p in files_a)
+        vectors = HashingEmbedder(dim=32).encode(["load the config", "load the config"])
+        assert (vectors[0] == vectors[1]).all() and vectors[0].any()
+
+    @pytest.mark.parametrize("case", ["build_index", "get_code_context", "query_json_file"])
+    def test_run_case_reports_metrics(self, tmp_path, case):
+        generate_python_repo(tmp_path / "size_50" / "code_repo", 50)
+        generate_prose_repo(tmp_path / "size_50" / "prose_repo", 50)
+        result = run_case(case, tmp_path, 50, n_queries=5, seed=0, workers=1)
+        assert result["chunks"] == 50 and result["index_bytes"] > 0 and result["seconds"] >= 0
+        if case != "build_index":
+            assert set(result["latency_ms"]) == {"mean", "p50", "p95", "p99"}
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": [{"case": "get_code_context", "size": 1000, "seconds": 1.0, "throughput_per_s": 100.0,
+                                 "latency_ms": {"p50": 1.0, "p95": 2.0}}]}
+        current = {"results": [{"case": "get_code_context", "size": 1000, "seconds": 1.05, "throughput_per_s": 50.0,
+                                "latency_ms": {"p50": 1.0, "p95": 3.0}}]}
+        flagged = {row["metric"] for row in compare_results(baseline, current, threshold=0.1) if row["regression"]}
+        assert flagged == {"throughput_per_s", "latency_ms.p95"}
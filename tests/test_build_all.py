@@ -0,0 +1,81 @@
+import ast
+import json
+import sqlite3
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from context_store import (_SharedParse, _cli_main, _extract_shared_chunks, build_all, build_index, build_json_indices,
+                           build_prose_index)
+from context_store_walk import walk_files
+from conftest import FAKE_MODEL_NAME
+
+FILES = {
+    "app/models.py": "class User:\n    \"\"\"A user.\"\"\"\n    def greet(self):\n        return 'hi'\n",
+    "app/util.py": "def slugify(text):\n    return text.lower().replace(' ', '-')\n",
+    "tests/test_util.py": "def test_slugify():\n    assert True\n",
+    "broken.py": "def broken(:\n",
+    "README.md": "# App\nA small app.\n## Usage\nRun it.\n",
+    "docs/guide.rst": "Guide\n=====\nInstall the app.\n",
+    ".github/notes.md": "# Hidden\nNot prose.\n",
+}
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    for rel_path, text in FILES.items():
+        (repo / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (repo / rel_path).write_text(text, encoding="utf-8")
+    return repo
+
+
+class TestBuildAll:
+    def test_matches_separate_builds_with_one_parse_per_file(self, repo, tmp_path, fake_model, monkeypatch):
+        parsed, parse = Counter(), ast.parse
+
+        def _counting_parse(source, filename="<unknown>", *args, **kwargs):
+            if str(filename).endswith(".py"): parsed[str(filename)] += 1
+            return parse(source, filename, *args, **kwargs)
+
+        with monkeypatch.context() as patch:
+            patch.setattr(ast, "parse", _counting_parse)
+            build_all(repo, index=tmp_path / "all" / "code.npz", lexical_base=tmp_path / "all" / "lex",
+                      prose_output=tmp_path / "all", model_name=FAKE_MODEL_NAME, workers=1)
+        assert sorted(name.split("repo/")[-1] for name in parsed) == [
+            "app/models.py", "app/util.py", "broken.py", "tests/test_util.py"]
+        assert set(parsed.values()) == {1}
+
+        build_index(repo, tmp_path / "one" / "code.npz", model_name=FAKE_MODEL_NAME, workers=1)
+        build_json_indices(repo, tmp_path / "one", workers=1, base_name="lex")
+        build_prose_index(repo, tmp_path / "one", FAKE_MODEL_NAME)
+        for name, keys in (("code.npz", ("embeddings", "meta", "files")),
+                           ("repo_prose_index.npz", ("embeddings", "texts", "metadata", "files"))):
+            together, separate = (np.load(tmp_path / d / name, allow_pickle=True) for d in ("all", "one"))
+            for key in keys:
+                assert together[key].tolist() == separate[key].tolist(), (name, key)
+        for suffix in ("signatures", "fullsource"):
+            assert (json.loads((tmp_path / "all" / f"lex_{suffix}.json").read_text()) ==
+                    json.loads((tmp_path / "one" / f"lex_{suffix}.json").read_text()))
+        assert "tests/test_util.py" in (tmp_path / "all" / "lex_fullsource.json").read_text()
+
+    def test_lexical_elements_are_spilled_to_disk_during_the_dense_pass(self, repo):
+        walked = walk_files(repo.resolve(), (".py",))
+        code, paths = walked[:2], [w.path for w in walked]
+        shared = _SharedParse(repo.resolve(), code, walked, workers=1)
+        assert [path for path, _ in shared.code_chunks([w.path for w in code])] == paths[:2]
+        shared._spill.seek(0)
+        assert len(shared._spill.readlines()) == 2  # Only what the dense pass went over.
+        lexical = list(shared.lexical_chunks(paths))
+        assert lexical == [(path, _extract_shared_chunks(path, repo.resolve())[1]) for path in paths]
+
+    def test_cli_with_sqlite_and_parallel_parse(self, repo, tmp_path, fake_model):
+        _cli_main(["build-all", "--repo", str(repo), "--output-base-name", str(tmp_path / "lex"),
+                   "--lexical-format", "sqlite", "--workers", "2"])
+        with sqlite3.connect(tmp_path / "lex.db") as conn:
+            names = sorted(row[0] for row in conn.execute("SELECT element_name FROM elements"))
+        assert names == ["User", "greet", "slugify", "test_slugify"]
+        assert fake_model.encoded_texts == []
+        with pytest.raises(SystemExit):
+            _cli_main(["build-all", "--repo", str(repo)])
@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+import pytest
+
+from context_store import _load_index_from_file, build_index, get_code_context
+from context_store_dedup import ChunkDeduplicator
+from context_store_json import build_json_indices, lookup_element, query_json_file
+from conftest import FAKE_MODEL_NAME
+
+VENDORED = '''\
+def retry_request(session, url, attempts=3):
+    """Fetch a URL, retrying on connection errors."""
+    for attempt in range(attempts):
+        try:
+            return session.get(url, timeout=10)
+        except ConnectionError:
+            continue
+    raise RuntimeError(f"giving up on {url}")
+'''
+
+
+@pytest.fixture
+def vendored_repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "vendor").mkdir(parents=True)
+    (repo / "client.py").write_text(VENDORED + "\ndef connect():\n    return None\n", encoding="utf-8")
+    (repo / "vendor" / "http.py").write_text("\n\n" + VENDORED, encoding="utf-8")
+    return repo
+
+
+class TestDedup:
+    def test_exact_duplicates_embedded_once_with_occurrences(self, vendored_repo, tmp_path, fake_model):
+        index = tmp_path / "code.npz"
+        build_index(vendored_repo, index, model_name=FAKE_MODEL_NAME, workers=1)
+        assert sum("retry_request" in text for text in fake_model.encoded_texts) == 1
+        _, meta = _load_index_from_file(index)
+        assert [m["element_name"] for m in meta] == ["retry_request", "connect"]
+        assert meta[0]["occurrences"] == [{"file_path": "vendor/http.py", "element_name": "retry_request",
+                                           "start_line": 3, "end_line": 10}]
+
+        [hit] = get_code_context("retry connection errors", index, k=1, query_model_name=FAKE_MODEL_NAME)
+        assert hit["file"] == "client.py"
+        assert [occ["chunk_id"] for occ in hit["occurrences"]] == ["vendor/http.py:3-10:retry_request"]
+
+        fake_model.encoded_texts.clear()
+        build_index(vendored_repo, index, model_name=FAKE_MODEL_NAME, workers=1, incremental=True)
+        assert fake_model.encoded_texts == []
+        _, rebuilt = _load_index_from_file(index)
+        assert list(rebuilt) == list(meta)
+
+    def test_deleting_the_canonical_copy_promotes_an_occurrence(self, vendored_repo, tmp_path, fake_model):
+        index = tmp_path / "code_mmap"
+        build_index(vendored_repo, index, model_name=FAKE_MODEL_NAME, workers=1)
+        (vendored_repo / "client.py").write_text("def connect():\n    return None\n", encoding="utf-8")
+        build_index(vendored_repo, index, model_name=FAKE_MODEL_NAME, workers=1, incremental=True)
+        _, meta = _load_index_from_file(index)
+        assert [(m["file_path"], m["element_name"]) for m in meta] == [("client.py", "connect"),
+                                                                     ("vendor/http.py", "retry_request")]
+        assert not any(m.get("occurrences") for m in meta)
+
+    def test_off_and_near_modes(self, vendored_repo, tmp_path, fake_model):
+        build_index(vendored_repo, tmp_path / "off.npz", model_name=FAKE_MODEL_NAME, workers=1, dedup="off")
+        assert len(np.load(tmp_path / "off.npz", allow_pickle=True)["meta"]) == 3
+
+        tweaked = VENDORED.replace("timeout=10", "timeout=30")
+        exact, near = ChunkDeduplicator("exact"), ChunkDeduplicator("near")
+        for dedup in (exact, near):
+            assert dedup.canonical(VENDORED, 0) is None
+        assert exact.canonical(tweaked, 1) is None
+        assert near.canonical(tweaked, 1) == 0
+        assert near.canonical("def connect():\n    return None\n", 2) is None
+        with pytest.raises(ValueError):
+            ChunkDeduplicator("fuzzy")
+
+    def test_json_index_stores_copies_once(self, vendored_repo, tmp_path):
+        build_json_indices(vendored_repo, tmp_path, workers=1)
+        signatures = json.loads((tmp_path / "repo_signatures.json").read_text())
+        assert [el["element_name"] for el in signatures].count("retry_request") == 1
+        [copy] = lookup_element("retry_request", tmp_path / "repo_signatures.json", file_path="vendor/http.py",
+                                source_file_path_str=tmp_path / "repo_fullsource.json")
+        assert copy["file"] == "vendor/http.py" and copy["duplicate_of"] == "client.py:1-8:retry_request"
+        assert "session.get(url" in copy["snippet"]
+
+    def test_renamed_near_copy_keeps_its_own_name_and_source(self, vendored_repo, tmp_path, fake_model):
+        original = VENDORED.replace("    raise", '    log.warning("retries exhausted for %s after %d attempts", url, attempts)\n'
+                                              '    metrics.increment("http.retry.exhausted", tags={"url": url})\n    raise')
+        renamed = original.replace("retry_request", "fetch_with_retries").replace("timeout=10", "timeout=30")
+        (vendored_repo / "client.py").write_text(original, encoding="utf-8")
+        (vendored_repo / "vendor" / "http.py").write_text(renamed, encoding="utf-8")
+        build_index(vendored_repo, tmp_path / "code.npz", model_name=FAKE_MODEL_NAME, workers=1, dedup="near")
+        _, meta = _load_index_from_file(tmp_path / "code.npz")
+        assert [occ["element_name"] for occ in meta[0]["occurrences"]] == ["fetch_with_retries"]
+
+        build_json_indices(vendored_repo, tmp_path, workers=1, dedup="near")
+        [copy] = lookup_element("fetch_with_retries", tmp_path / "repo_fullsource.json")
+        assert "duplicate_of" not in copy and copy["file"] == "vendor/http.py"
+        assert "def fetch_with_retries" in copy["snippet"] and "timeout=30" in copy["snippet"]
+        [hit] = query_json_file("fetch with retries", tmp_path / "repo_fullsource.json", k=1)
+        assert hit["element_name"] == "fetch_with_retries"
@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pytest
+
+from context_store import _cli_main, _load_index_from_file, build_index, merge_indices
+from context_store_shards import load_manifest, parse_shard_spec, shard_of
+from conftest import FAKE_MODEL_NAME
+
+HELPER = "def normalize_path(path):\n    return path.replace('\\\\', '/').rstrip('/')\n"
+
+
+@pytest.fixture
+def monorepo(tmp_path):
+    repo = tmp_path / "mono"
+    for service in range(6):
+        pkg = repo / f"svc{service}"
+        pkg.mkdir(parents=True)
+        (pkg / "handlers.py").write_text(
+            f"class Handler{service}:\n    def handle(self, event):\n        return event + {service}\n\n"
+            f"def route_{service}(request):\n    return Handler{service}().handle(request)\n", encoding="utf-8")
+        (pkg / "util.py").write_text(HELPER, encoding="utf-8")  # The same helper everywhere.
+    return repo
+
+
+def _shards(repo, tmp_path, total, suffix=".npz"):
+    paths = []
+    for index in range(1, total + 1):
+        paths.append(tmp_path / f"shard_{index}{suffix}")
+        build_index(repo, paths[-1], model_name=FAKE_MODEL_NAME, workers=1, shard=f"{index}/{total}")
+    return paths
+
+
+class TestDistributedBuild:
+    def test_partition_is_deterministic_and_complete(self, monorepo):
+        files = sorted(str(p.relative_to(monorepo)) for p in monorepo.rglob("*.py"))
+        assignment = {f: shard_of(f, 3) for f in files}
+        assert assignment == {f: shard_of(f, 3) for f in reversed(files)}
+        assert set(assignment.values()) <= {1, 2, 3} and len(set(assignment.values())) > 1
+        assert parse_shard_spec("2/3") == (2, 3)
+        for bad in ("0/3", "4/3", "2", "a/b"):
+            with pytest.raises(ValueError):
+                parse_shard_spec(bad)
+
+    @pytest.mark.parametrize("suffix", [".npz", ""])
+    def test_merged_shards_equal_single_build(self, monorepo, tmp_path, fake_model, suffix):
+        single = tmp_path / f"single{suffix}"
+        build_index(monorepo, single, model_name=FAKE_MODEL_NAME, workers=1)
+        fake_model.encoded_texts.clear()
+        shards = _shards(monorepo, tmp_path, 3, suffix)
+        assert sum("normalize_path" in text for text in fake_model.encoded_texts) <= 3
+        merged = tmp_path / f"merged{suffix}"
+        merge_indices(shards, merged)
+        single_embeds, single_meta = _load_index_from_file(single)
+        merged_embeds, merged_meta = _load_index_from_file(merged)
+        assert list(merged_meta) == list(single_meta)
+        np.testing.assert_allclose(merged_embeds, single_embeds)
+        assert len(single_meta[[m["element_name"] for m in single_meta].index("normalize_path")]["occurrences"]) == 5
+
+    def test_merge_checks_inputs(self, monorepo, tmp_path, fake_model, capsys):
+        shards = _shards(monorepo, tmp_path, 3)
+        with pytest.raises(ValueError, match="given twice"):
+            merge_indices([shards[0], shards[0]], tmp_path / "dup.npz")
+        build_index(monorepo, tmp_path / "full.npz", model_name=FAKE_MODEL_NAME, workers=1)
+        with pytest.raises(ValueError, match="indexed by both"):
+            merge_indices([tmp_path / "full.npz", shards[0]], tmp_path / "overlap.npz")
+        with pytest.raises(ValueError, match="different models"):
+            merge_indices(shards, tmp_path / "other.npz", model_name="other/model")
+        other_split = tmp_path / "other_split.npz"
+        build_index(monorepo, other_split, model_name=FAKE_MODEL_NAME, workers=1, shard="1/2")
+        with pytest.raises(ValueError, match="different splits"):
+            merge_indices([shards[1], other_split], tmp_path / "mixed.npz")
+        merge_indices(shards[:2], tmp_path / "partial.npz")
+        assert "Shards 3 of 3 are missing" in capsys.readouterr().err
+
+    def test_cli_shard_build_and_merge_to_manifest(self, monorepo, tmp_path, fake_model, capsys):
+        for index in (1, 2):
+            _cli_main(["build", "--repo", str(monorepo), "--index", str(tmp_path / f"part{index}.npz"),
+                       "--model", FAKE_MODEL_NAME, "--workers", "1", "--shard", f"{index}/2"])
+        manifest = tmp_path / "mono.shards.json"
+        _cli_main(["merge-index", "--inputs", str(tmp_path / "part1.npz"), str(tmp_path / "part2.npz"),
+                   "--output", str(manifest)])
+        assert [s["name"] for s in load_manifest(manifest)["shards"]] == ["shard-1", "shard-2"]
+        capsys.readouterr()
+        _cli_main(["query", "--index", str(manifest), "--query", "route request to handler", "--k", "2",
+                   "--model", FAKE_MODEL_NAME, "--no-daemon"])
+        assert "route_" in capsys.readouterr().out
+        with pytest.raises(SystemExit):
+            _cli_main(["build", "--repo", str(monorepo), "--index", str(tmp_path / "x.npz"), "--shard", "3/2"])
@@ -0,0 +1,47 @@
+import numpy as np
+
+import context_store
+from context_store import EmbeddingCache, _embed_texts_batch, build_index, configure_embedding_cache
+from conftest import FAKE_MODEL_NAME
+
+
+class TestEmbeddingCache:
+    def test_second_encode_skips_model(self, tmp_path, fake_model):
+        configure_embedding_cache(tmp_path / "cache")
+        first = _embed_texts_batch(["def a(): pass", "def b(): pass"], FAKE_MODEL_NAME)
+        fake_model.encoded_texts.clear()
+        second = _embed_texts_batch(["def b(): pass", "def c(): pass", "def a(): pass"], FAKE_MODEL_NAME)
+        assert fake_model.encoded_texts == ["def c(): pass"]
+        np.testing.assert_allclose(second[0], first[1])
+        np.testing.assert_allclose(second[2], first[0])
+
+    def test_query_prefix_is_part_of_key(self, tmp_path, fake_model):
+        configure_embedding_cache(tmp_path / "cache")
+        _embed_texts_batch(["parse config"], FAKE_MODEL_NAME)
+        fake_model.encoded_texts.clear()
+        _embed_texts_batch(["parse config"], FAKE_MODEL_NAME, is_query=True)
+        assert fake_model.encoded_texts == ["query: parse config"]
+        fake_model.encoded_texts.clear()
+        _embed_texts_batch(["parse config"], FAKE_MODEL_NAME, is_query=True)
+        assert fake_model.encoded_texts == []
+
+    def test_lru_eviction_respects_size_limit(self, tmp_path):
+        cache = EmbeddingCache(tmp_path / "cache", max_bytes=3 * 64 * 4)
+        keys = [EmbeddingCache.make_key("m", "", str(i)) for i in range(4)]
+        cache.put_many(keys[:3], np.ones((3, 64), dtype=np.float32))
+        cache.get_many([keys[0]])  # keys[1] is now the least recently used entry
+        cache.put_many(keys[3:], np.ones((1, 64), dtype=np.float32))
+        remaining = cache.get_many(keys)
+        assert keys[0] in remaining and keys[3] in remaining
+        assert keys[1] not in remaining
+
+    def test_rebuild_hits_cache(self, tmp_path, fake_model):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        (repo / "mod.py").write_text("def f():\n    return 1\n", encoding="utf-8")
+        configure_embedding_cache(tmp_path / "cache")
+        build_index(repo, tmp_path / "a.npz", model_name=FAKE_MODEL_NAME)
+        fake_model.encoded_texts.clear()
+        build_index(repo, tmp_path / "b.npz", model_name=FAKE_MODEL_NAME)
+        assert fake_model.encoded_texts == []
+        assert context_store._get_embedding_cache().hits >= 1
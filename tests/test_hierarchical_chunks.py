@@ -0,0 +1,100 @@
+import numpy as np
+
+import context_store
+from context_store import (CHUNK_WINDOW_LINES, CHUNK_WINDOW_OVERLAP, _extract_ast_chunks_from_file, _line_windows,
+                           build_index)
+from conftest import FAKE_MODEL_NAME
+
+SOURCE = '''\
+import sys
+
+
+@dataclass
+class Shape:
+    """A drawable shape."""
+    sides: int = 0
+    name = "shape"
+
+    def area(self):
+        """Surface of the shape."""
+        total = 0
+        return total
+
+    @property
+    def label(self): return self.name
+
+    class Style:
+        color = "red"
+
+        def paint(self):
+            return self.color
+
+
+if sys.platform == "win32":
+    def open_console():
+        def helper():
+            return 1
+        return helper()
+'''
+
+
+def _chunks(tmp_path, source):
+    path = tmp_path / "mod.py"
+    path.write_text(source, encoding="utf-8")
+    return list(_extract_ast_chunks_from_file(path, tmp_path))
+
+
+class TestHierarchicalChunks:
+    def test_class_outline_and_parent_links(self, tmp_path):
+        chunks = _chunks(tmp_path, SOURCE)
+        assert [(c["element_name"], c["parent"]) for c in chunks] == [
+            ("Shape", None), ("area", "Shape"), ("label", "Shape"), ("Style", "Shape"),
+            ("paint", "Shape.Style"), ("open_console", None)]
+        assert chunks[0]["source_code"] == (
+            '@dataclass\nclass Shape:\n    """A drawable shape."""\n    sides: int = 0\n    name = "shape"\n'
+            '    def area(self):\n        ...\n    @property\n    def label(self): return self.name\n'
+            '    class Style:\n        ...\n')
+        assert (chunks[0]["start_line"], chunks[0]["end_line"]) == (5, 22)
+        assert chunks[1]["source_code"].startswith("def area(self):") and "total = 0" in chunks[1]["source_code"]
+        assert "def helper" in chunks[-1]["source_code"]  # nested functions stay with their parent
+
+    def test_long_functions_become_overlapping_windows(self, tmp_path):
+        body = "".join(f"    step_{i} = {i}\n" for i in range(150))
+        chunks = _chunks(tmp_path, f"def long_job():\n{body}    return step_0\n")
+        assert len(chunks) > 1 and all(c["element_name"] == "long_job" for c in chunks)
+        assert chunks[0]["start_line"] == 1 and chunks[-1]["end_line"] == 152
+        assert [c["window"] for c in chunks] == [f"{i}/{len(chunks)}" for i in range(1, len(chunks) + 1)]
+        for prev, nxt in zip(chunks, chunks[1:]):
+            assert prev["end_line"] - nxt["start_line"] + 1 >= CHUNK_WINDOW_OVERLAP
+        assert all(c["end_line"] - c["start_line"] + 1 == CHUNK_WINDOW_LINES for c in chunks[:-1])
+        assert chunks[-1]["end_line"] - chunks[-1]["start_line"] + 1 <= CHUNK_WINDOW_LINES
+        assert chunks[1]["source_code"].startswith("    step_")  # indented as inside the function
+
+    def test_windows_step_evenly_and_clamp_the_tail(self):
+        assert _line_windows(1, 60, 60, 10) == [(1, 60)]
+        assert _line_windows(1, 61, 60, 10) == [(1, 60), (51, 61)]
+        assert _line_windows(1, 110, 60, 10) == [(1, 60), (51, 110)]
+        assert _line_windows(1, 111, 60, 10) == [(1, 60), (51, 110), (101, 111)]
+        assert _line_windows(5, 115, 60, 10) == [(5, 64), (55, 114), (105, 115)]
+
+    def test_class_outline_of_decorated_first_member_and_one_liners(self, tmp_path):
+        chunks = _chunks(tmp_path, "class A:\n    @property\n    def x(self):\n        return 1\n\n"
+                                   "class B: y = 1\n\nclass C: \"Doc.\"\n")
+        assert chunks[0]["source_code"] == "class A:\n    @property\n    def x(self):\n        ...\n"
+        assert [c["source_code"] for c in chunks[2:]] == ["class B: y = 1\n", 'class C: "Doc."\n']
+
+    def test_incremental_build_rechunks_older_chunker_output(self, tmp_path, fake_model, monkeypatch):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        (repo / "mod.py").write_text(SOURCE, encoding="utf-8")
+        index = tmp_path / "code.npz"
+        build_index(repo, index, model_name=FAKE_MODEL_NAME, workers=1)
+        fake_model.encoded_texts.clear()
+        build_index(repo, index, model_name=FAKE_MODEL_NAME, workers=1, incremental=True)
+        assert fake_model.encoded_texts == []
+
+        monkeypatch.setattr(context_store, "CHUNKER_VERSION", context_store.CHUNKER_VERSION + 1)
+        build_index(repo, index, model_name=FAKE_MODEL_NAME, workers=1, incremental=True)
+        assert len(fake_model.encoded_texts) == 6
+        files = np.load(index, allow_pickle=True)["files"]
+        assert [rec["chunker"] for rec in files] == [context_store.CHUNKER_VERSION]
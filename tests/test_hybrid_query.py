@@ -0,0 +1,57 @@
+import pytest
+
+from context_store import build_index, get_code_context, get_hybrid_context
+from context_store_json import build_json_indices, query_json_file
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def hybrid_indices(tmp_path, fake_model):
+    repo = tmp_path / "hyb_repo"
+    repo.mkdir()
+    (repo / "net.py").write_text(
+        "def download_file(url):\n    \"\"\"Fetch a remote file over HTTP.\"\"\"\n    return fetch(url)\n\n"
+        "def parse_json_response(body):\n    \"\"\"Decode the server reply.\"\"\"\n    return loads(body)\n", encoding="utf-8")
+    (repo / "db.py").write_text(
+        "def open_database_connection(dsn):\n    \"\"\"Connect to the database.\"\"\"\n    return connect(dsn)\n\n"
+        "class QueryBuilder:\n    \"\"\"Builds SQL select statements.\"\"\"\n    pass\n", encoding="utf-8")
+    build_index(repo, tmp_path / "code.idx", model_name=FAKE_MODEL_NAME)
+    build_json_indices(repo, tmp_path, workers=1)
+    return tmp_path / "code.idx", tmp_path / "hyb_repo_signatures.json", tmp_path / "hyb_repo_fullsource.json"
+
+
+class TestHybridQuery:
+    def test_chunk_ids_shared_between_retrievers(self, hybrid_indices):
+        dense_index, sig, _ = hybrid_indices
+        [dense] = get_code_context("open database connection dsn", dense_index, k=1, query_model_name=FAKE_MODEL_NAME)
+        [lexical] = query_json_file("open database connection", sig, k=1)
+        assert dense["chunk_id"] == lexical["chunk_id"] == "db.py:1-3:open_database_connection"
+
+    def test_exact_identifier_skips_dense_model(self, hybrid_indices, fake_model):
+        dense_index, sig, full = hybrid_indices
+        fake_model.encoded_texts.clear()
+        results = get_hybrid_context("QueryBuilder", dense_index, sig, full, k=2, query_model_name=FAKE_MODEL_NAME)
+        assert results[0]["element_name"] == "QueryBuilder" and results[0]["retrievers"] == ["exact", "lexical"]
+        assert results[0]["snippet"].startswith("class QueryBuilder")
+        assert fake_model.encoded_texts == []
+
+    def test_fuses_lexical_and_dense_rankings(self, hybrid_indices, fake_model):
+        dense_index, sig, full = hybrid_indices
+        fake_model.encoded_texts.clear()
+        results = get_hybrid_context("download remote file url", dense_index, sig, full, k=3,
+                                     query_model_name=FAKE_MODEL_NAME)
+        assert fake_model.encoded_texts  # natural-language query goes through the dense side
+        assert results[0]["element_name"] == "download_file"
+        assert set(results[0]["retrievers"]) == {"dense", "lexical"}
+        assert len({r["chunk_id"] for r in results}) == len(results) == 3
+
+    def test_lexical_weight_extremes_follow_one_retriever(self, hybrid_indices):
+        dense_index, sig, full = hybrid_indices
+        query = "server reply statements"
+        lexical_only = get_hybrid_context(query, dense_index, sig, full, k=2, lexical_weight=1.0,
+                                          query_model_name=FAKE_MODEL_NAME)
+        assert [r["chunk_id"] for r in lexical_only] == [r["chunk_id"] for r in query_json_file(query, sig, k=2)]
+        dense_only = get_hybrid_context(query, dense_index, sig, full, k=2, lexical_weight=0.0,
+                                        query_model_name=FAKE_MODEL_NAME)
+        assert [r["chunk_id"] for r in dense_only] == \
+            [r["chunk_id"] for r in get_code_context(query, dense_index, k=2, query_model_name=FAKE_MODEL_NAME)]
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = {"numpy", "torch", "sentence_transformers", "transformers", "nbformat", "pdb", "scipy", "sklearn"}
+
+
+def _imported_modules(args, cwd):
+    # -X importtime logs every module the interpreter imports to stderr, one per line.
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    return {line.split("|")[-1].strip() for line in proc.stderr.splitlines() if line.startswith("import time:")}
+
+
+def _heavy(modules):
+    return sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+
+
+@pytest.fixture
+def tiny_repo(tmp_path):
+    repo = tmp_path / "tiny_repo"
+    repo.mkdir()
+    (repo / "mod.py").write_text("def greet(name):\n    \"\"\"Say hello.\"\"\"\n    return name\n", encoding="utf-8")
+    return repo
+
+
+class TestLexicalStartup:
+    def test_importing_modules_skips_ml_stack(self):
+        modules = _imported_modules(["-c", "import context_store, context_store_json, context_store_sqlite"], REPO_DIR)
+        assert _heavy(modules) == []
+
+    @pytest.mark.parametrize("fmt", ["json", "sqlite"])
+    def test_lexical_subcommands_skip_ml_stack(self, tiny_repo, tmp_path, fmt):
+        cli = str(REPO_DIR / "context_store.py")
+        base = str(tmp_path / "idx" / "tiny")
+        index = f"{base}.db" if fmt == "sqlite" else f"{base}_signatures.json"
+        for args in (["build-json", "--repo", str(tiny_repo), "--output-base-name", base, "--format", fmt,
+                      "--workers", "1"],
+                     ["query-json", "--signatures-file", index, "--query", "greet"],
+                     ["lookup", "--index", index, "--name", "greet"]):
+            assert _heavy(_imported_modules([cli, *args], tmp_path)) == [], args
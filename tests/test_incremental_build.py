@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from context_store import build_index
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def code_repo(tmp_path):
+    repo = tmp_path / "code_repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "alpha.py").write_text(
+        "def add(a, b):\n    \"\"\"Add two numbers.\"\"\"\n    return a + b\n", encoding="utf-8")
+    (repo / "pkg" / "beta.py").write_text(
+        "class Greeter:\n    def greet(self, name):\n        return 'hi ' + name\n", encoding="utf-8")
+    (repo / "gamma.py").write_text("def unused():\n    pass\n", encoding="utf-8")
+    return repo
+
+
+def _load(index_file):
+    data = np.load(index_file, allow_pickle=True)
+    return data["embeddings"], [dict(m) for m in data["meta"]], [dict(f) for f in data["files"]]
+
+
+class TestIncrementalBuild:
+    def test_records_file_state(self, code_repo, tmp_path, fake_model):
+        index_file = tmp_path / "idx.npz"
+        build_index(code_repo, index_file, model_name=FAKE_MODEL_NAME)
+        _, meta, files = _load(index_file)
+        assert [f["file_path"] for f in files] == ["gamma.py", "pkg/alpha.py", "pkg/beta.py"]
+        assert all(len(f["sha256"]) == 64 and f["mtime_ns"] > 0 for f in files)
+        assert {m["element_name"] for m in meta} == {"add", "Greeter", "greet", "unused"}
+
+    def test_only_changed_files_are_reembedded(self, code_repo, tmp_path, fake_model):
+        index_file = tmp_path / "idx.npz"
+        build_index(code_repo, index_file, model_name=FAKE_MODEL_NAME)
+
+        (code_repo / "pkg" / "alpha.py").write_text(
+            "def add(a, b):\n    return a + b + 0\n\ndef sub(a, b):\n    return a - b\n", encoding="utf-8")
+        (code_repo / "gamma.py").unlink()
+        (code_repo / "delta.py").write_text("def fresh():\n    return 1\n", encoding="utf-8")
+        # Touch beta.py without changing content: must be reused via its hash.
+        beta = code_repo / "pkg" / "beta.py"
+        os.utime(beta, ns=(beta.stat().st_atime_ns, beta.stat().st_mtime_ns + 10**9))
+
+        fake_model.encoded_texts.clear()
+        build_index(code_repo, index_file, model_name=FAKE_MODEL_NAME, incremental=True)
+        encoded_names = {t.split("(")[0].split()[-1] for t in fake_model.encoded_texts}
+        assert encoded_names == {"add", "sub", "fresh"}
+
+        inc_embeds, inc_meta, inc_files = _load(index_file)
+        clean_file = tmp_path / "clean.npz"
+        build_index(code_repo, clean_file, model_name=FAKE_MODEL_NAME)
+        clean_embeds, clean_meta, clean_files = _load(clean_file)
+        assert inc_meta == clean_meta
+        np.testing.assert_allclose(inc_embeds, clean_embeds)
+        assert [f["sha256"] for f in inc_files] == [f["sha256"] for f in clean_files]
+
+    def test_model_change_forces_full_rebuild(self, code_repo, tmp_path, fake_model):
+        index_file = tmp_path / "idx.npz"
+        build_index(code_repo, index_file, model_name=FAKE_MODEL_NAME)
+        np.savez_compressed(index_file, **{**dict(np.load(index_file, allow_pickle=True)),
+                                           "model": np.array("other/model")})
+        fake_model.encoded_texts.clear()
+        build_index(code_repo, index_file, model_name=FAKE_MODEL_NAME, incremental=True)
+        assert len(fake_model.encoded_texts) == 4
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import context_store_json
+from context_store_json import build_json_indices, index_terms, query_json_context, query_json_file
+
+
+@pytest.fixture
+def json_index(tmp_path):
+    repo = tmp_path / "lex_repo"
+    repo.mkdir()
+    (repo / "net.py").write_text(
+        "def load_settings():\n    \"\"\"Config loader: merges config defaults into the config dict.\"\"\"\n    return {}\n\n"
+        "class HTTPServerError(Exception):\n    \"\"\"Raised when the server answers badly.\"\"\"\n\n"
+        "def getUserProfile(user_id):\n    \"\"\"Fetch a profile over the network.\"\"\"\n    return user_id\n\n"
+        "def parse_config_file(path):\n    \"\"\"Read the TOML configuration.\"\"\"\n    return path\n\n"
+        "def _private_helper():\n    return 1\n", encoding="utf-8")
+    out = tmp_path / "out"
+    build_json_indices(repo, out, workers=1)
+    context_store_json._CACHED_JSON_INDICES.clear()
+    return out / "lex_repo_signatures.json", out / "lex_repo_fullsource.json"
+
+
+def _names(results):
+    return [r["element_name"] for r in results]
+
+
+class TestJsonInvertedIndex:
+    def test_index_terms_split_snake_and_camel_case(self):
+        assert index_terms("getHTTPResponse_code") == {"gethttpresponse_code", "get", "http", "response", "code"}
+
+    def test_postings_sidecar_written_next_to_json(self, json_index):
+        sig_path, _ = json_index
+        sidecar = json.loads(sig_path.with_suffix(".postings.json").read_text())
+        assert sidecar["count"] == 4 and sidecar["fields"] == ["name", "signature", "docstring", "source"]
+        assert "profile" in sidecar["postings"] and "server" in sidecar["postings"]
+
+    def test_matches_sub_tokens_prefixes_and_docstrings(self, json_index):
+        sig_path, _ = json_index
+        assert _names(query_json_file("user profile", sig_path, k=1)) == ["getUserProfile"]
+        assert _names(query_json_file("get_user", sig_path)) == ["getUserProfile"]
+        assert _names(query_json_file("toml", sig_path)) == ["parse_config_file"]
+        assert _names(query_json_file("http", sig_path)) == ["HTTPServerError"]
+        assert _names(query_json_file("prof", sig_path)) == ["getUserProfile"]
+        assert query_json_file("nonexistent", sig_path) == []
+
+    def test_name_field_outweighs_repeated_docstring_mentions(self, json_index):
+        sig_path, _ = json_index
+        assert _names(query_json_file("config", sig_path, k=5)) == ["parse_config_file", "load_settings"]
+
+    def test_rare_terms_outrank_common_ones(self, json_index):
+        sig_path, _ = json_index
+        assert _names(query_json_file("config network", sig_path, k=1)) == ["getUserProfile"]
+
+    def test_fullsource_ranks_source_identifiers(self, json_index):
+        _, full_path = json_index
+        assert _names(query_json_file("user_id", full_path, k=1)) == ["getUserProfile"]
+        assert _names(query_json_file("_private_helper", full_path, k=1)) == ["_private_helper"]
+
+    def test_stale_sidecar_is_ignored_and_context_attaches_source(self, json_index):
+        sig_path, full_path = json_index
+        sig_path.with_suffix(".postings.json").write_text(json.dumps(
+            {"format": context_store_json.POSTINGS_FORMAT, "version": context_store_json.POSTINGS_VERSION,
+             "count": 4, "source_digest": "stale", "postings": {}}))
+        context_store_json._CACHED_JSON_INDICES.clear()
+        [hit] = query_json_context("parse config", sig_path, full_path, k=1)
+        assert hit["element_name"] == "parse_config_file"
+        assert hit["snippet"].startswith("def parse_config_file(path):")
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import context_store_json
+from context_store_json import (JsonlIndex, build_json_indices, load_jsonl_index, lookup_element, query_json_context,
+                                query_json_file)
+
+VENDORED = "def retry_request(session, url):\n    \"\"\"Fetch a URL, retrying.\"\"\"\n    return session.get(url)\n"
+QUERIES = ("retry request url", "parse config file", "render template", "client")
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "vendor").mkdir()
+    (repo / "pkg" / "config.py").write_text(
+        "def parse_config(path):\n    \"\"\"Parse a config file.\"\"\"\n    return {}\n\n"
+        "class Client:\n    def send(self, request):\n        return request\n\n    def _retry(self):\n        pass\n",
+        encoding="utf-8")
+    (repo / "pkg" / "views.py").write_text("def render_template(name, context):\n    return name\n\n" + VENDORED,
+                                           encoding="utf-8")
+    (repo / "vendor" / "http.py").write_text("\n" + VENDORED, encoding="utf-8")
+    return repo
+
+
+def _both(repo, tmp_path):
+    for index_format in ("json", "jsonl"):
+        build_json_indices(repo, tmp_path / index_format, workers=1, base_name="idx", index_format=index_format)
+    return ({kind: tmp_path / fmt / f"idx_{kind}.{fmt}" for kind in ("signatures", "fullsource")}
+            for fmt in ("json", "jsonl"))
+
+
+class TestJsonlIndex:
+    def test_same_results_as_json(self, repo, tmp_path):
+        json_paths, jsonl_paths = _both(repo, tmp_path)
+        lines = jsonl_paths["fullsource"].read_text(encoding="utf-8").splitlines()
+        assert json.loads(lines[0])["format"] == "context_store_jsonl"
+        assert "occurrences_of" in json.loads(lines[-1])
+        for kind in ("signatures", "fullsource"):
+            assert list(load_jsonl_index(jsonl_paths[kind]).elements) == json.loads(json_paths[kind].read_text())
+            for query in QUERIES:
+                assert query_json_file(query, jsonl_paths[kind], k=3) == query_json_file(query, json_paths[kind], k=3)
+        for query in QUERIES:
+            assert (query_json_context(query, jsonl_paths["signatures"], jsonl_paths["fullsource"]) ==
+                    query_json_context(query, json_paths["signatures"], json_paths["fullsource"]))
+        for name, file_path in (("retry_request", None), ("retry_request", "vendor/http.py"), ("_retry", None)):
+            assert (lookup_element(name, jsonl_paths["fullsource"], file_path=file_path) ==
+                    lookup_element(name, json_paths["fullsource"], file_path=file_path))
+
+        (repo / "pkg" / "views.py").write_text("def render_page(name):\n    return name\n", encoding="utf-8")
+        build_json_indices(repo, tmp_path / "jsonl", workers=1, base_name="idx", index_format="jsonl",
+                           changed_files=["pkg/views.py"])
+        build_json_indices(repo, tmp_path / "clean", workers=1, base_name="idx", index_format="jsonl")
+        assert (list(load_jsonl_index(jsonl_paths["fullsource"]).elements) ==
+                list(load_jsonl_index(tmp_path / "clean" / "idx_fullsource.jsonl").elements))
+
+    def test_queries_decode_only_their_hits(self, repo, tmp_path, monkeypatch):
+        _, paths = _both(repo, tmp_path)
+        decoded, get = [], context_store_json._JsonlRecords.__getitem__
+        monkeypatch.setattr(context_store_json._JsonlRecords, "__getitem__",
+                            lambda self, idx: decoded.append(idx) or get(self, idx))
+        assert isinstance(context_store_json._get_json_index(paths["fullsource"]), JsonlIndex)
+        assert len(query_json_context("retry request", paths["signatures"], paths["fullsource"], k=1)) == 1
+        assert len(decoded) == 2  # The signature hit, and its source.
+        decoded.clear()
+        [copy] = lookup_element("retry_request", paths["fullsource"], file_path="http.py")
+        assert copy["duplicate_of"] == "pkg/views.py:4-6:retry_request" and len(set(decoded)) == 1
+
+    def test_lookups_and_sources_never_load_the_ranking_statistics(self, repo, tmp_path, monkeypatch):
+        _, paths = _both(repo, tmp_path)
+        for loader in ("_read_postings", "_build_postings"):
+            monkeypatch.setattr(context_store_json, loader, lambda *args: pytest.fail("statistics loaded"))
+        [copy] = lookup_element("retry_request", paths["signatures"], file_path="vendor/http.py",
+                                source_file_path_str=paths["fullsource"])
+        assert copy["snippet"] == VENDORED and copy["lines"] == "2-4"
+        assert [el["element_name"] for el in lookup_element("send", paths["fullsource"])] == ["send"]
+        assert context_store_json._get_json_index(paths["fullsource"]).postings is None
+
+    def test_missing_offsets_fall_back_to_reading_every_line(self, repo, tmp_path, capsys):
+        json_paths, jsonl_paths = _both(repo, tmp_path)
+        (tmp_path / "jsonl" / "idx_fullsource.jsonl.offsets.db").unlink()
+        index = load_jsonl_index(jsonl_paths["fullsource"])
+        assert not isinstance(index, JsonlIndex) and "stale" in capsys.readouterr().err
+        assert index.elements == json.loads(json_paths["fullsource"].read_text())
+        with pytest.raises(ValueError):
+            load_jsonl_index(json_paths["fullsource"])
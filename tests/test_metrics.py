@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import context_store_metrics
+from context_store import _cli_main, build_index, build_prose_index, process_source
+from context_store_metrics import configure_metrics, count, metrics_snapshot, span
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture(autouse=True)
+def metrics_off():
+    yield
+    configure_metrics(enabled=False)
+    context_store_metrics.set_verbosity(0)
+
+
+@pytest.fixture
+def small_repo(tmp_path):
+    repo = tmp_path / "metrics_repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "io.py").write_text(
+        "def read_config(path):\n    \"\"\"Read the configuration file.\"\"\"\n    return open(path).read()\n\n"
+        "class Writer:\n    def write(self, data):\n        return data\n", encoding="utf-8")
+    return repo
+
+
+class TestMetrics:
+    def test_disabled_collection_records_nothing(self):
+        configure_metrics(enabled=False)
+        with span("embed") as attrs:
+            attrs["texts"] = 3
+        count("chunks", 5)
+        assert metrics_snapshot() == {"spans": {}, "counters": {}}
+
+    def test_build_and_query_trace(self, small_repo, tmp_path, fake_model, capsys):
+        index, trace = tmp_path / "idx.npz", tmp_path / "build.jsonl"
+        _cli_main(["build", "--repo", str(small_repo), "--index", str(index), "--model", FAKE_MODEL_NAME,
+                   "--workers", "1", "--metrics", str(trace)])
+        records = [json.loads(line) for line in trace.read_text().splitlines()]
+        spans = {r["name"]: r for r in records if r["type"] == "span"}
+        assert {"build", "discovery", "parse", "embed", "save"} <= set(spans)
+        assert spans["discovery"]["parent"] == spans["build"]["id"]
+        assert records[-1]["type"] == "counters"
+        assert records[-1]["counters"]["files"] == 1 and records[-1]["counters"]["chunks"] == 3
+
+        _cli_main(["build-json", "--repo", str(small_repo), "--output-base-name", str(tmp_path / "lex"),
+                   "--workers", "1"])
+        prom = tmp_path / "query.prom"
+        _cli_main(["query-hybrid", "--index", str(index), "--lexical-index", str(tmp_path / "lex_signatures.json"),
+                   "--query", "configuration file", "--model", FAKE_MODEL_NAME, "--metrics", str(prom)])
+        text = prom.read_text()
+        assert 'context_store_span_count_total{span="query-hybrid"} 1' in text
+        for name in ("load", "encode_query", "score", "format"):
+            assert f'context_store_span_seconds_total{{span="{name}"}}' in text
+        assert "context_store_queries_total 2" in text  # one dense, one lexical
+        assert "read_config" in capsys.readouterr().out
+
+    def test_prose_debug_output_needs_verbosity(self, tmp_path, capsys):
+        doc = tmp_path / "guide.md"
+        text = "# Intro\nHello.\n## Usage\nRun it.\n"
+        process_source(doc, text, "Markdown", [], [], tmp_path)
+        assert capsys.readouterr() == ("", "")
+        context_store_metrics.set_verbosity(2)
+        process_source(doc, text, "Markdown", [], [], tmp_path)
+        assert "Adding chunk for heading path: Intro > Usage" in capsys.readouterr().err
+
+    def test_build_progress_needs_verbosity(self, small_repo, tmp_path, fake_model, capsys):
+        (small_repo / "guide.md").write_text("# Guide\nInstall it.\n", encoding="utf-8")
+        build_index(small_repo, tmp_path / "idx.npz", model_name=FAKE_MODEL_NAME, workers=1)
+        build_prose_index(small_repo, tmp_path / "prose", FAKE_MODEL_NAME)
+        out, err = capsys.readouterr()
+        assert out == "" and "Embedded" not in err and "Prose index built with 1 chunks" in err
+        context_store_metrics.set_verbosity(1)
+        build_index(small_repo, tmp_path / "idx.npz", model_name=FAKE_MODEL_NAME, workers=1)
+        assert "Info: Embedded 3 chunks..." in capsys.readouterr().err
@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import pytest
+
+from context_store import (
+    _LazyMetaList, _load_index_from_file, build_index, convert_npz_index, get_code_context,
+)
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def code_repo(tmp_path):
+    repo = tmp_path / "code_repo"
+    repo.mkdir()
+    (repo / "shapes.py").write_text(
+        "class Circle:\n    \"\"\"A round shape.\"\"\"\n    def area(self):\n        return 3.14 * self.r ** 2\n\n"
+        "def perimeter_of_square(side):\n    return 4 * side\n", encoding="utf-8")
+    (repo / "text.py").write_text("def shout(msg):\n    return msg.upper() + ' ✓'\n", encoding="utf-8")
+    return repo
+
+
+class TestMmapIndex:
+    def test_layout_and_lazy_loading(self, code_repo, tmp_path, fake_model):
+        index_dir = tmp_path / "code.idx"
+        build_index(code_repo, index_dir, model_name=FAKE_MODEL_NAME)
+        manifest = json.loads((index_dir / "manifest.json").read_text())
+        assert manifest["count"] == 4 and manifest["dim"] == 64 and manifest["model"] == FAKE_MODEL_NAME
+        assert b"source_code" not in (index_dir / "meta.jsonl").read_bytes()
+
+        embeds, meta = _load_index_from_file(index_dir)
+        assert isinstance(embeds, np.memmap) and isinstance(meta, _LazyMetaList)
+        assert meta[-1]["element_name"] == "shout"
+        assert meta[-1]["source_code"] == "def shout(msg):\n    return msg.upper() + ' ✓'\n"
+
+    def test_matches_npz_results_and_conversion(self, code_repo, tmp_path, fake_model):
+        npz_file, mmap_dir, converted_dir = tmp_path / "code.npz", tmp_path / "code.idx", tmp_path / "conv.idx"
+        build_index(code_repo, npz_file, model_name=FAKE_MODEL_NAME)
+        build_index(code_repo, mmap_dir, model_name=FAKE_MODEL_NAME)
+        convert_npz_index(npz_file, converted_dir)
+        npz_embeds, npz_meta = _load_index_from_file(npz_file)
+        for index in (mmap_dir, converted_dir):
+            embeds, meta = _load_index_from_file(index)
+            np.testing.assert_array_equal(np.asarray(embeds), npz_embeds)
+            assert list(meta) == npz_meta
+            hits = get_code_context("square perimeter side", index, k=2, query_model_name=FAKE_MODEL_NAME)
+            assert hits == get_code_context("square perimeter side", npz_file, k=2, query_model_name=FAKE_MODEL_NAME)
+            assert hits[0]["element_name"] == "perimeter_of_square"
+
+    def test_incremental_rebuild_in_place(self, code_repo, tmp_path, fake_model):
+        index_dir = tmp_path / "code.idx"
+        build_index(code_repo, index_dir, model_name=FAKE_MODEL_NAME)
+        (code_repo / "text.py").write_text("def whisper(msg):\n    return msg.lower()\n", encoding="utf-8")
+        fake_model.encoded_texts.clear()
+        build_index(code_repo, index_dir, model_name=FAKE_MODEL_NAME, incremental=True)
+        assert len(fake_model.encoded_texts) == 1
+        _, meta = _load_index_from_file(index_dir)
+        assert [m["element_name"] for m in meta] == ["Circle", "area", "perimeter_of_square", "whisper"]
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["code.idx", "code_repo"]
+
+    def test_empty_index(self, tmp_path, fake_model):
+        (tmp_path / "empty_repo").mkdir()
+        build_index(tmp_path / "empty_repo", tmp_path / "empty.idx", model_name=FAKE_MODEL_NAME)
+        embeds, meta = _load_index_from_file(tmp_path / "empty.idx")
+        assert embeds.shape == (0, 0) and len(meta) == 0
+        assert get_code_context("anything", tmp_path / "empty.idx", query_model_name=FAKE_MODEL_NAME) == []
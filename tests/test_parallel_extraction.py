@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+import pytest
+
+from context_store import build_index
+from context_store_json import build_json_indices, iter_file_chunks, _extract_ast_chunks_from_file
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def many_file_repo(tmp_path):
+    repo = tmp_path / "many_repo"
+    for pkg in range(3):
+        pkg_dir = repo / f"pkg{pkg}"
+        pkg_dir.mkdir(parents=True)
+        for mod in range(6):
+            (pkg_dir / f"mod{mod}.py").write_text(
+                f"class Thing{pkg}{mod}:\n    def run(self):\n        return {mod}\n\n"
+                f"def helper_{pkg}_{mod}(x):\n    return x * {pkg}\n", encoding="utf-8")
+    (repo / "pkg1" / "broken.py").write_text("def oops(:\n", encoding="utf-8")
+    return repo
+
+
+class TestParallelExtraction:
+    def test_order_matches_input_and_broken_file_is_skipped(self, many_file_repo):
+        files = sorted(many_file_repo.rglob("*.py"))
+        results = list(iter_file_chunks(files, many_file_repo, workers=3))
+        assert [path for path, _ in results] == files
+        by_name = {path.name: chunks for path, chunks in results}
+        assert by_name["broken.py"] == []
+        serial = list(iter_file_chunks(files, many_file_repo, workers=1,
+                                       extract_fn=_extract_ast_chunks_from_file))
+        assert serial == results
+
+    def test_json_indices_identical_across_worker_counts(self, many_file_repo, tmp_path):
+        build_json_indices(many_file_repo, tmp_path / "serial", workers=1)
+        build_json_indices(many_file_repo, tmp_path / "parallel", workers=4)
+        for suffix in ("signatures", "fullsource"):
+            serial = json.loads((tmp_path / "serial" / f"many_repo_{suffix}.json").read_text())
+            parallel = json.loads((tmp_path / "parallel" / f"many_repo_{suffix}.json").read_text())
+            assert serial == parallel
+            # The `run` methods repeat across packages and are stored once with their other locations.
+            assert sum(1 + len(el.get("occurrences", ())) for el in serial) == 3 * 6 * 3
+
+    def test_dense_index_identical_across_worker_counts(self, many_file_repo, tmp_path, fake_model):
+        build_index(many_file_repo, tmp_path / "serial.npz", model_name=FAKE_MODEL_NAME, workers=1)
+        build_index(many_file_repo, tmp_path / "parallel.npz", model_name=FAKE_MODEL_NAME, workers=4)
+        serial = np.load(tmp_path / "serial.npz", allow_pickle=True)
+        parallel = np.load(tmp_path / "parallel.npz", allow_pickle=True)
+        assert list(serial["meta"]) == list(parallel["meta"])
+        np.testing.assert_allclose(serial["embeddings"], parallel["embeddings"])
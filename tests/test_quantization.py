@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import context_store
+from context_store import QUANTIZE_CHOICES, _load_index_from_file, _quant_path, build_index, get_code_context
+from context_store_vectors import (
+    QUANTIZATION_SCHEMES, exact_search, quantization_report, quantize_embeddings, quantized_scores, quantized_search,
+)
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(7)
+    data = rng.normal(size=(3000, 96))
+    return (data / np.linalg.norm(data, axis=1, keepdims=True)).astype(np.float32)
+
+
+class TestQuantization:
+    def test_code_sizes(self, embeddings):
+        assert quantize_embeddings(embeddings, "float16")["codes"].nbytes == 3000 * 96 * 2
+        assert quantize_embeddings(embeddings, "int8")["codes"].nbytes == 3000 * 96
+        assert quantize_embeddings(embeddings, "binary")["codes"].nbytes == 3000 * 12
+        with pytest.raises(ValueError):
+            quantize_embeddings(embeddings, "int4")
+
+    def test_int8_scores_approximate_inner_products(self, embeddings):
+        quantized = quantize_embeddings(embeddings, "int8")
+        query = embeddings[0]
+        np.testing.assert_allclose(quantized_scores(quantized, query), embeddings @ query, atol=0.02)
+
+    def test_binary_scores_are_negated_hamming_distance(self, embeddings):
+        quantized = quantize_embeddings(embeddings, "binary")
+        query = embeddings[5]
+        expected = -((embeddings[:10] > 0) != (query > 0)).sum(axis=1)
+        np.testing.assert_array_equal(quantized_scores(quantized, query, rows=np.arange(10)), expected)
+
+    def test_rescoring_restores_exact_ranking(self, embeddings):
+        query = embeddings[11] + 0.1 * embeddings[12]
+        query /= np.linalg.norm(query)
+        truth = exact_search(embeddings, query, 5)[0]
+        for scheme in ("float16", "int8", "binary"):
+            ids, scores = quantized_search(quantize_embeddings(embeddings, scheme), query, 5, full_embeddings=embeddings)
+            assert ids[0] == truth[0] == 11
+            np.testing.assert_allclose(scores, embeddings[ids] @ query, rtol=1e-5)
+
+    def test_report_rows(self, embeddings):
+        rows = {row["scheme"]: row for row in quantization_report(embeddings, embeddings[:20], k=10)}
+        assert rows["float32"]["bytes_per_vector"] == 384 and rows["binary"]["bytes_per_vector"] == 12
+        assert rows["float16"]["recall"] == 1.0
+        assert rows["int8"]["recall_rescored"] >= rows["int8"]["recall"] >= 0.8
+        assert rows["float32"]["code_bytes"] == 0 and rows["float32"]["total_bytes"] == 3000 * 384
+        assert rows["int8"]["code_bytes"] == 3000 * 96 and rows["int8"]["total_bytes"] == 3000 * (384 + 96)
+
+
+class TestQuantizedQuery:
+    def test_cli_choices_match_schemes(self):
+        assert tuple(QUANTIZE_CHOICES) == tuple(QUANTIZATION_SCHEMES)
+
+    def test_query_searches_codes(self, tmp_path, fake_model):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        for i in range(20):
+            (repo / f"mod{i}.py").write_text(f"def step_{i}(data):\n    return data[{i}]\n", encoding="utf-8")
+        (repo / "io.py").write_text("def load_yaml_config(path):\n    return open(path)\n", encoding="utf-8")
+        index = tmp_path / "code.idx"
+        build_index(repo, index, model_name=FAKE_MODEL_NAME, quantize="int8")
+        assert _quant_path(index).exists()
+        exact = get_code_context("load yaml config path", index, k=3, query_model_name=FAKE_MODEL_NAME, search="exact")
+        rescored = get_code_context("load yaml config path", index, k=3, query_model_name=FAKE_MODEL_NAME)
+        codes_only = get_code_context("load yaml config path", index, k=3, query_model_name=FAKE_MODEL_NAME,
+                                      rescore=False)
+        assert rescored == exact
+        assert codes_only[0]["element_name"] == "load_yaml_config"
+
+    def test_npz_embeddings_are_memory_mapped(self, tmp_path, fake_model):
+        repo = tmp_path / "repo"
+        repo.mkdir()
+        for i in range(20):
+            (repo / f"mod{i}.py").write_text(f"def step_{i}(data):\n    return data[{i}]\n", encoding="utf-8")
+        index = tmp_path / "code.npz"
+        build_index(repo, index, model_name=FAKE_MODEL_NAME, quantize="binary")
+        embeds, meta = _load_index_from_file(index)
+        assert isinstance(embeds, np.memmap) and embeds.shape[0] == len(meta) == 20
+        context_store._CACHED_INDICES.clear()
+        exact = get_code_context("step 3 data", index, k=3, query_model_name=FAKE_MODEL_NAME, search="exact")
+        assert get_code_context("step 3 data", index, k=3, query_model_name=FAKE_MODEL_NAME) == exact
+
+        np.savez_compressed(tmp_path / "legacy.npz", embeddings=np.asarray(embeds), meta=np.array(meta, dtype=object))
+        legacy, legacy_meta = _load_index_from_file(tmp_path / "legacy.npz")
+        assert not isinstance(legacy, np.memmap) and legacy_meta == meta
+        np.testing.assert_array_equal(legacy, embeds)
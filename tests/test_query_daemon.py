@@ -0,0 +1,96 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import context_store
+from context_store import _DAEMON_DISPATCH, build_index, get_code_context
+from context_store_daemon import NO_DAEMON, QueryDaemon, daemon_request
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def running_daemon(tmp_path, fake_model, monkeypatch):
+    monkeypatch.delenv("CONTEXT_STORE_NO_DAEMON")
+    state_file = tmp_path / "daemon.json"
+    daemon = QueryDaemon(_DAEMON_DISPATCH, port=0, state_file=state_file)
+    daemon.write_state()
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield state_file
+    daemon.shutdown()
+    daemon.remove_state()
+    daemon.server_close()
+
+
+@pytest.fixture
+def code_repo(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "calc.py").write_text("def multiply_numbers(a, b):\n    return a * b\n\n"
+                                  "def divide_numbers(a, b):\n    return a / b\n", encoding="utf-8")
+    return repo
+
+
+class TestQueryDaemon:
+    def test_no_state_file_means_no_daemon(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("CONTEXT_STORE_NO_DAEMON")
+        assert daemon_request("code", {}, state_file=tmp_path / "missing.json") is NO_DAEMON
+
+    def test_state_file_is_private(self, running_daemon):
+        assert (running_daemon.stat().st_mode & 0o777) == 0o600
+        assert set(json.loads(running_daemon.read_text())) == {"host", "port", "pid", "token"}
+
+    def test_daemon_answers_like_local_and_reloads_rebuilt_index(self, running_daemon, code_repo, tmp_path):
+        index = str(tmp_path / "code.idx")
+        build_index(code_repo, index, model_name=FAKE_MODEL_NAME)
+        params = {"query": "divide numbers", "index_file_path": index, "k": 1, "query_model_name": FAKE_MODEL_NAME}
+        remote = daemon_request("code", params, state_file=running_daemon)
+        assert remote == get_code_context(**params)
+        assert remote[0]["element_name"] == "divide_numbers"
+
+        (code_repo / "calc.py").write_text("def divide_safely(a, b):\n    return a / b if b else 0\n",
+                                           encoding="utf-8")
+        build_index(code_repo, index, model_name=FAKE_MODEL_NAME)
+        assert daemon_request("code", params, state_file=running_daemon)[0]["element_name"] == "divide_safely"
+
+    def test_concurrent_requests(self, running_daemon, code_repo, tmp_path):
+        index = str(tmp_path / "code.npz")
+        build_index(code_repo, index, model_name=FAKE_MODEL_NAME)
+        queries = ["multiply numbers", "divide numbers"] * 10
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(lambda q: daemon_request(
+                "code", {"query": q, "index_file_path": index, "k": 1, "query_model_name": FAKE_MODEL_NAME},
+                state_file=running_daemon)[0]["element_name"], queries))
+        assert answers == ["multiply_numbers", "divide_numbers"] * 10
+
+    def test_cold_load_does_not_block_cached_indices(self, code_repo, tmp_path, fake_model, monkeypatch):
+        warm, cold = str(tmp_path / "warm.npz"), str(tmp_path / "cold.npz")
+        for index in (warm, cold):
+            build_index(code_repo, index, model_name=FAKE_MODEL_NAME)
+        params = {"query": "divide numbers", "k": 1, "query_model_name": FAKE_MODEL_NAME}
+        assert get_code_context(index_file_path=warm, **params)[0]["element_name"] == "divide_numbers"
+        loads, started, release, load = [], threading.Event(), threading.Event(), context_store._load_index_from_file
+
+        def _slow_load(path):
+            loads.append(path.name)
+            started.set()
+            assert release.wait(10)
+            return load(path)
+
+        monkeypatch.setattr(context_store, "_load_index_from_file", _slow_load)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            cold_answers = [pool.submit(get_code_context, index_file_path=cold, **params) for _ in range(2)]
+            assert started.wait(10)
+            assert get_code_context(index_file_path=warm, **params)[0]["element_name"] == "divide_numbers"
+            release.set()
+            assert [f.result()[0]["element_name"] for f in cold_answers] == ["divide_numbers"] * 2
+        assert loads == ["cold.npz"]
+
+    def test_errors_are_raised_on_the_client(self, running_daemon, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            daemon_request("code", {"query": "x", "index_file_path": str(tmp_path / "nope.npz")},
+                           state_file=running_daemon)
+        with pytest.raises(RuntimeError):
+            daemon_request("no-such-kind", {}, state_file=running_daemon)
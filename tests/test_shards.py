@@ -0,0 +1,115 @@
+import json
+import time
+
+import pytest
+
+import context_store
+import context_store_shards
+from context_store import _cli_main, build_index, build_prose_index, get_code_context, get_prose_context
+from context_store_shards import add_shard, is_shard_manifest, load_manifest, remove_shard, scatter
+from conftest import FAKE_MODEL_NAME
+
+SERVICES = {
+    "billing": "def charge_invoice(invoice):\n    return invoice.total\n\ndef refund_payment(payment):\n    return -payment\n",
+    "search": "def rank_documents(query, documents):\n    return sorted(documents)\n\n"
+              "def tokenize_query(query):\n    return query.split()\n",
+}
+
+
+@pytest.fixture
+def shard_indices(tmp_path, fake_model):
+    paths = {}
+    for name, source in SERVICES.items():
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "service.py").write_text(source, encoding="utf-8")
+        paths[name] = tmp_path / "indices" / f"{name}.npz"
+        build_index(tmp_path / name, paths[name], model_name=FAKE_MODEL_NAME, workers=1)
+    return paths
+
+
+class TestShards:
+    def test_manifest_edits_leave_other_shards_alone(self, shard_indices, tmp_path):
+        manifest = tmp_path / "all.shards.json"
+        assert add_shard(manifest, "billing", shard_indices["billing"]) == "added"
+        assert add_shard(manifest, "search", shard_indices["search"]) == "added"
+        assert is_shard_manifest(manifest) and not is_shard_manifest(shard_indices["billing"])
+        assert json.loads(manifest.read_text())["shards"][0] == {"name": "billing", "path": "indices/billing.npz"}
+
+        assert add_shard(manifest, "billing", tmp_path / "billing_v2.npz") == "replaced"
+        assert [(s["name"], s["path"].name) for s in load_manifest(manifest)["shards"]] == [
+            ("billing", "billing_v2.npz"), ("search", "search.npz")]
+        remove_shard(manifest, "billing")
+        assert [s["name"] for s in load_manifest(manifest)["shards"]] == ["search"]
+        with pytest.raises(KeyError):
+            remove_shard(manifest, "billing")
+        with pytest.raises(ValueError):
+            add_shard(manifest, "docs", tmp_path / "docs", kind="prose")
+
+    def test_scatter_gather_matches_single_indices(self, shard_indices, tmp_path):
+        manifest = tmp_path / "all.shards.json"
+        for name, path in shard_indices.items():
+            add_shard(manifest, name, path)
+        combined = tmp_path / "combined.npz"
+        build_index(tmp_path, combined, model_name=FAKE_MODEL_NAME, workers=1)
+        for query in ("rank documents for a query", "refund the payment of an invoice"):
+            results = get_code_context(query, manifest, k=3, max_tokens=float("inf"), query_model_name=FAKE_MODEL_NAME)
+            expected = get_code_context(query, combined, k=3, max_tokens=float("inf"), query_model_name=FAKE_MODEL_NAME)
+            assert [(hit["shard"], hit["element_name"]) for hit in results] == [
+                (hit["file"].split("/")[0], hit["element_name"]) for hit in expected]
+
+    def test_slow_shard_times_out(self, shard_indices, tmp_path, monkeypatch, capsys):
+        manifest = tmp_path / "all.shards.json"
+        for name, path in shard_indices.items():
+            add_shard(manifest, name, path)
+        load = context_store._get_cached_index
+
+        def _slow_billing(idx_path):
+            if idx_path.name == "billing.npz": time.sleep(1.0)
+            return load(idx_path)
+
+        monkeypatch.setattr(context_store, "_get_cached_index", _slow_billing)
+        results = get_code_context("charge invoice", manifest, k=4, max_tokens=float("inf"),
+                                   query_model_name=FAKE_MODEL_NAME, shard_timeout=0.2)
+        assert results and {hit["shard"] for hit in results} == {"search"}
+        assert "Shard billing did not answer" in capsys.readouterr().err
+
+    def test_timeout_is_per_shard_from_its_start(self, monkeypatch, capsys):
+        monkeypatch.setattr(context_store_shards, "SCATTER_MAX_WORKERS", 2)
+        delays = {"a": 0.3, "b": 0.3, "c": 0.3, "hung": 2.0}
+        shards = [{"name": name} for name in delays]
+
+        def _search(shard):
+            time.sleep(delays[shard["name"]])
+            return shard["name"]
+
+        # Two workers: "c" only starts once "a" is done, but still gets its full 0.5s.
+        answered = scatter(shards, _search, timeout=0.5)
+        assert [result for _, result in answered] == ["a", "b", "c"]
+        assert capsys.readouterr().err.strip() == "Warning: Shard hung did not answer within 0.5s; skipping it."
+
+        # Queued shards get their full timeout once they start, however long they waited...
+        monkeypatch.setattr(context_store_shards, "SCATTER_MAX_WORKERS", 1)
+        delays.update(a=0.2, b=0.2, c=0.2)
+        answered = scatter([{"name": name} for name in "abc"], _search, timeout=0.3)
+        assert [result for _, result in answered] == ["a", "b", "c"] and capsys.readouterr().err == ""
+        # ...but not beyond one timeout per wave, when a hung shard holds the only worker.
+        assert scatter([{"name": "hung"}, {"name": "a"}], _search, timeout=0.3) == []
+        assert capsys.readouterr().err.splitlines() == ["Warning: Shard hung did not answer within 0.3s; skipping it.",
+                                                        "Warning: Shard a did not start within 0.6s; skipping it."]
+
+    def test_prose_shards_via_cli(self, tmp_path, fake_model, capsys):
+        manifest = tmp_path / "docs.shards.json"
+        for name, text in (("alpha", "# Deploy\nShip the container.\n"), ("beta", "# Backup\nCopy the database.\n")):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "README.md").write_text(text, encoding="utf-8")
+            build_prose_index(tmp_path / name, tmp_path / "prose", FAKE_MODEL_NAME)
+            _cli_main(["shard-add", "--manifest", str(manifest), "--name", name, "--kind", "prose",
+                       "--index", str(tmp_path / "prose" / f"{name}_prose_index.npz")])
+        capsys.readouterr()
+        _cli_main(["query-prose", "--index", str(manifest), "--query", "copy the database", "--k", "1",
+                   "--model", FAKE_MODEL_NAME, "--no-daemon"])
+        [hit] = json.loads(capsys.readouterr().out)
+        assert hit["shard"] == "beta" and hit["heading_path"] == "Backup"
+        with pytest.raises(ValueError):
+            get_code_context("copy", manifest, query_model_name=FAKE_MODEL_NAME)
+        assert len(get_prose_context("deploy", manifest, k=5, model_name=FAKE_MODEL_NAME)) == 2
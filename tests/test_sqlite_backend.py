@@ -0,0 +1,79 @@
+import os
+import sqlite3
+
+import pytest
+
+from context_store_json import build_json_indices, lookup_element, query_json_context, query_json_file
+from context_store_sqlite import build_sqlite_index, lookup_sqlite_element, upsert_files
+
+
+@pytest.fixture
+def sql_repo(tmp_path):
+    repo = tmp_path / "sql_repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "config.py").write_text(
+        "def parse_config_file(path):\n    \"\"\"Read the TOML configuration.\"\"\"\n    return path\n\n"
+        "def _load_raw(path):\n    return open(path).read()\n", encoding="utf-8")
+    (repo / "pkg" / "net.py").write_text(
+        "class HTTPClient:\n    \"\"\"Talks to the server.\"\"\"\n    def send(self, request):\n        return request\n\n"
+        "def parse_response(body):\n    \"\"\"Decode a server response.\"\"\"\n    return body\n", encoding="utf-8")
+    return repo
+
+
+def _bump(path, text):
+    path.write_text(text, encoding="utf-8")
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class TestSqliteBackend:
+    def test_queries_match_json_backend(self, sql_repo, tmp_path):
+        db = tmp_path / "sql_repo.db"
+        build_sqlite_index(sql_repo, db, workers=1)
+        build_json_indices(sql_repo, tmp_path, workers=1)
+        sig, full = tmp_path / "sql_repo_signatures.json", tmp_path / "sql_repo_fullsource.json"
+
+        assert [r["element_name"] for r in query_json_file("toml config", db, k=1)] == ["parse_config_file"]
+        assert "snippet" not in query_json_file("toml config", db, k=1)[0]
+        assert query_json_file("load raw", db) == []  # private elements stay out of ranked queries
+        from_sql = query_json_context("server response", db, None, k=1)
+        from_json = query_json_context("server response", sig, full, k=1)
+        assert from_sql == from_json
+
+    def test_exact_lookup_by_name_and_file(self, sql_repo, tmp_path):
+        db = tmp_path / "sql_repo.db"
+        build_sqlite_index(sql_repo, db, workers=1)
+        [hit] = lookup_sqlite_element("_load_raw", db, file_path="config.py")
+        assert hit["file"] == os.path.join("pkg", "config.py") and hit["snippet"].startswith("def _load_raw")
+        assert lookup_sqlite_element("_load_raw", db, file_path="net.py") == []
+        assert lookup_element("send", db, file_path="pkg/net.py")[0]["lines"] == "3-4"
+
+        build_json_indices(sql_repo, tmp_path, workers=1)
+        assert lookup_element("send", tmp_path / "sql_repo_signatures.json", file_path="net.py",
+                              source_file_path_str=tmp_path / "sql_repo_fullsource.json") == \
+            lookup_element("send", db, file_path="net.py")
+
+    def test_incremental_build_reparses_only_changed_files(self, sql_repo, tmp_path):
+        db = tmp_path / "sql_repo.db"
+        build_sqlite_index(sql_repo, db, workers=1)
+
+        _bump(sql_repo / "pkg" / "config.py", "def parse_yaml_file(path):\n    \"\"\"Read YAML.\"\"\"\n    return path\n")
+        (sql_repo / "pkg" / "net.py").unlink()
+        (sql_repo / "pkg" / "new.py").write_text("def fresh():\n    return 1\n", encoding="utf-8")
+        build_sqlite_index(sql_repo, db, workers=1, incremental=True)
+
+        conn = sqlite3.connect(db)
+        names = {row[0] for row in conn.execute("SELECT element_name FROM elements")}
+        assert names == {"parse_yaml_file", "fresh"}
+        assert conn.execute("SELECT COUNT(*) FROM elements_fts").fetchone()[0] == 2
+        assert [r["element_name"] for r in query_json_file("yaml", db)] == ["parse_yaml_file"]
+
+    def test_upsert_files_replaces_and_removes(self, sql_repo, tmp_path):
+        db = tmp_path / "sql_repo.db"
+        build_sqlite_index(sql_repo, db, workers=1)
+        (sql_repo / "pkg" / "config.py").write_text("def parse_ini(path):\n    return path\n", encoding="utf-8")
+        (sql_repo / "pkg" / "net.py").unlink()
+        upsert_files(db, sql_repo, [sql_repo / "pkg" / "config.py", sql_repo / "pkg" / "net.py"], workers=1)
+        assert lookup_element("parse_config_file", db) == []
+        assert lookup_element("HTTPClient", db) == []
+        assert [r["file"] for r in lookup_element("parse_ini", db)] == [os.path.join("pkg", "config.py")]
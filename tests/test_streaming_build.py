@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import context_store
+from context_store import build_index, build_prose_index
+from conftest import FAKE_MODEL_NAME
+
+
+@pytest.fixture
+def mixed_repo(tmp_path):
+    repo = tmp_path / "mixed_repo"
+    repo.mkdir()
+    for i in range(5):
+        (repo / f"mod{i}.py").write_text(
+            f"def first_{i}():\n    return {i}\n\ndef second_{i}():\n    return -{i}\n", encoding="utf-8")
+        (repo / f"doc{i}.md").write_text(f"# Doc {i}\nBody {i}\n## Part {i}\nMore {i}\n", encoding="utf-8")
+    return repo
+
+
+@pytest.fixture
+def encode_calls(fake_model, monkeypatch):
+    calls = []
+    original = fake_model.encode
+
+    def _recording_encode(texts, **kwargs):
+        calls.append(len(texts))
+        return original(texts, **kwargs)
+
+    monkeypatch.setattr(fake_model, "encode", _recording_encode)
+    return calls
+
+
+class TestStreamingBuild:
+    def test_code_index_is_embedded_in_bounded_batches(self, mixed_repo, tmp_path, encode_calls):
+        build_index(mixed_repo, tmp_path / "small.npz", model_name=FAKE_MODEL_NAME, batch_size=3)
+        assert max(encode_calls) <= 3 and sum(encode_calls) == 10
+        build_index(mixed_repo, tmp_path / "big.npz", model_name=FAKE_MODEL_NAME, batch_size=1000)
+        small = np.load(tmp_path / "small.npz", allow_pickle=True)
+        big = np.load(tmp_path / "big.npz", allow_pickle=True)
+        assert small["embeddings"].shape == (10, 64)
+        np.testing.assert_allclose(small["embeddings"], big["embeddings"])
+        assert list(small["meta"]) == list(big["meta"])
+
+    def test_prose_index_is_embedded_in_bounded_batches(self, mixed_repo, tmp_path, encode_calls):
+        build_prose_index(mixed_repo, tmp_path / "out", model_name=FAKE_MODEL_NAME, batch_size=4)
+        assert max(encode_calls) <= 4 and sum(encode_calls) == 10
+        data = np.load(tmp_path / "out" / "mixed_repo_prose_index.npz", allow_pickle=True)
+        assert len(data["texts"]) == len(data["metadata"]) == data["embeddings"].shape[0] == 10
+        assert data["texts"][0] == "# Doc 0\nBody 0\n"
+
+    def test_failed_build_leaves_no_partial_index(self, mixed_repo, tmp_path, fake_model, monkeypatch):
+        def _broken_encode(texts, **kwargs):
+            raise RuntimeError("encoder exploded")
+
+        monkeypatch.setattr(fake_model, "encode", _broken_encode)
+        with pytest.raises(RuntimeError, match="encoder exploded"):
+            build_index(mixed_repo, tmp_path / "idx.npz", model_name=FAKE_MODEL_NAME, batch_size=2)
+        assert list(tmp_path.iterdir()) == [mixed_repo]
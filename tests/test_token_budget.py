@@ -0,0 +1,96 @@
+import itertools
+import random
+import time
+
+import pytest
+
+import context_store_tokens
+from context_store import (_cli_main, _format_code_hits, _load_index_from_file, _pack_results, build_index,
+                           get_code_context)
+from context_store_tokens import count_tokens, register_tokenizer, select_within_budget
+from conftest import FAKE_MODEL_NAME
+
+
+def _brute_force(candidates, budget, k):
+    best = 0.0
+    for n in range(k + 1):
+        for subset in itertools.combinations(range(len(candidates)), n):
+            for choice in itertools.product(*(range(len(candidates[i])) for i in subset)):
+                picked = [candidates[i][j] for i, j in zip(subset, choice)]
+                if sum(cost for _, cost in picked) <= budget:
+                    best = max(best, sum(value for value, _ in picked))
+    return best
+
+
+@pytest.fixture
+def budget_index(tmp_path, fake_model):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    methods = "".join(f"    def handle_{i}(self, request):\n        return request.payload[{i}]\n\n" for i in range(40))
+    (repo / "server.py").write_text(
+        f"class RequestHandler:\n    \"\"\"Dispatches incoming websocket frames.\"\"\"\n\n{methods}"
+        "def handle_server_request(request):\n    return request\n\n"
+        "def log_server_request(request):\n    print(request)\n", encoding="utf-8")
+    index = tmp_path / "server.idx"
+    build_index(repo, index, model_name=FAKE_MODEL_NAME, workers=1)
+    return index
+
+
+class TestTokenBudget:
+    def test_approx_counts_code_more_closely_than_words(self):
+        code = "def parse_config(path):\n    return json.loads(open(path).read())['settings']\n"
+        assert count_tokens(code, "whitespace") == 4
+        assert count_tokens(code) > 15
+
+    def test_knapsack_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            candidates = [[(rng.uniform(0.1, 1.0), rng.randint(1, 60)) for _ in range(rng.randint(1, 2))]
+                          for _ in range(rng.randint(1, 6))]
+            budget, k = rng.randint(10, 120), rng.randint(1, 4)
+            chosen = select_within_budget(candidates, budget, k)
+            assert len(chosen) <= k and len({i for i, _ in chosen}) == len(chosen)
+            assert sum(candidates[i][j][1] for i, j in chosen) <= budget
+            assert sum(candidates[i][j][0] for i, j in chosen) == pytest.approx(_brute_force(candidates, budget, k))
+
+    def test_large_k_packs_quickly(self):
+        rng = random.Random(3)
+        for k in (10, 25, 50):
+            candidates = [[(rng.uniform(0.1, 1.0), rng.randint(20, 800)), (rng.uniform(0.05, 0.3), rng.randint(5, 60))]
+                          for _ in range(4 * k)]
+            started = time.perf_counter()
+            chosen = select_within_budget(candidates, 4000, k)
+            assert time.perf_counter() - started < 0.25
+            assert 0 < len(chosen) <= k and len({i for i, _ in chosen}) == len(chosen)
+            assert sum(candidates[i][j][1] for i, j in chosen) <= 4000
+
+    def test_counts_stored_at_build_and_budget_respected(self, budget_index, monkeypatch):
+        _, meta = _load_index_from_file(budget_index)
+        assert all(m["token_counts"]["approx"] == count_tokens(m["source_code"]) for m in meta)
+
+        monkeypatch.setattr(context_store_tokens, "_approx_tokens", lambda text: pytest.fail("re-tokenized"))
+        monkeypatch.setitem(context_store_tokens._TOKENIZERS, "approx", context_store_tokens._approx_tokens)
+        results = get_code_context("server request", budget_index, k=3, max_tokens=60,
+                                   query_model_name=FAKE_MODEL_NAME)
+        assert results and sum(r["token_count"] for r in results) <= 60
+        assert "RequestHandler" not in [r["element_name"] for r in results]
+
+    def test_trim_classes_and_custom_tokenizer(self, budget_index):
+        _, meta = _load_index_from_file(budget_index)
+        [cls] = _format_code_hits(meta, [0])
+        small = {"element_type": "FunctionDef", "snippet": "def ping():\n    return 1\n", "token_count": 8}
+        assert [r["element_type"] for r in _pack_results([cls, small], [0.9, 0.2], 2, 40)] == ["FunctionDef"]
+        hit, _ = _pack_results([cls, small], [0.9, 0.2], 2, 40, trim_classes=True)
+        assert hit["element_name"] == "RequestHandler" and hit["trimmed"] and hit["token_count"] <= 32
+        assert hit["snippet"] == 'class RequestHandler:\n    """Dispatches incoming websocket frames."""\n    ...\n'
+
+        register_tokenizer("chars", len)
+        results = get_code_context("server request", budget_index, k=3, max_tokens=100,
+                                   query_model_name=FAKE_MODEL_NAME, tokenizer="chars")
+        assert sum(len(r["snippet"]) for r in results) <= 100
+
+    def test_query_cli_honours_max_tokens(self, budget_index, capsys):
+        _cli_main(["query", "--index", str(budget_index), "--query", "server request", "--k", "3",
+                   "--max_tokens", "30", "--model", FAKE_MODEL_NAME, "--no-daemon"])
+        out = capsys.readouterr().out
+        assert "Result 1" in out and "class RequestHandler" not in out
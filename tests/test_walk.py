@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import context_store_walk
+from context_store import build_index, _load_index_from_file
+from context_store_walk import is_ignored, parse_gitignore, walk_files
+from conftest import FAKE_MODEL_NAME
+
+GITIGNORE = "# generated\n*.log\n/build_out/\ndata/**/raw\n!keep.log\nsecret?.py\n"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel_path in ("a.py", "keep.log", "run.log", "pkg/mod.py", "pkg/sub/deep.py", "pkg/secret1.py",
+                     "pkg/node_modules/dep.py", "build_out/gen.py", "lib/build_out/real.py",
+                     "data/x/raw/blob.py", "docs/_build/html.py", "docs/conf.py", "other/docs/_build/x.py",
+                     "nested/.gitignore", "nested/local.py", "nested/tmp.py", ".hidden/h.py"):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"def f_{len(rel_path)}():\n    return {rel_path!r}\n", encoding="utf-8")
+    (tmp_path / ".gitignore").write_text(GITIGNORE, encoding="utf-8")
+    (tmp_path / "nested" / ".gitignore").write_text("tmp.py\n", encoding="utf-8")
+    return tmp_path
+
+
+def _rel(walked):
+    return [w.rel_path.replace(os.sep, "/") for w in walked]
+
+
+class TestWalk:
+    def test_prunes_excluded_and_ignored_directories(self, tree, monkeypatch):
+        scanned, scandir = [], os.scandir
+        monkeypatch.setattr(context_store_walk.os, "scandir", lambda d: scanned.append(d) or scandir(d))
+        walked = walk_files(tree, (".py",), ["node_modules", "docs/_build"], skip_hidden=True)
+        assert _rel(walked) == ["a.py", "docs/conf.py", "lib/build_out/real.py", "nested/local.py",
+                                "pkg/mod.py", "pkg/sub/deep.py"]
+        assert not any(part in d for d in scanned for part in ("node_modules", "_build", "raw", ".hidden"))
+        assert all(w.stat == os.stat(w.path) and w.path.is_absolute() for w in walked)
+
+    def test_gitignore_optional_and_parallel_walk_matches_serial(self, tree):
+        everything = _rel(walk_files(tree, gitignore=False))
+        assert {"run.log", "build_out/gen.py", ".hidden/h.py", "nested/tmp.py"} <= set(everything)
+        assert everything == sorted(everything)
+        assert _rel(walk_files(tree, (".log",))) == ["keep.log"]
+        for gitignore in (True, False):
+            assert walk_files(tree, gitignore=gitignore, workers=4) == walk_files(tree, gitignore=gitignore)
+
+    def test_gitignore_patterns(self):
+        rules = parse_gitignore(["*.py[co]", "docs/**/*.html", "**/cache", "logs/", "!logs/"], base="")
+        assert is_ignored(rules, "a/b.pyc", False) and not is_ignored(rules, "a/b.py", False)
+        assert is_ignored(rules, "docs/x/y/page.html", False) and is_ignored(rules, "docs/page.html", False)
+        assert not is_ignored(rules, "src/docs/page.html", False)
+        assert is_ignored(rules, "cache", True) and is_ignored(rules, "a/cache", False)
+        assert not is_ignored(rules, "logs", True)
+        nested = parse_gitignore(["/only_here.py"], base="pkg")
+        assert is_ignored(nested, "pkg/only_here.py", False) and not is_ignored(nested, "pkg/sub/only_here.py", False)
+
+    def test_build_index_honours_gitignore(self, tree, tmp_path, fake_model):
+        index = tmp_path / "code.npz"
+        build_index(tree, index, model_name=FAKE_MODEL_NAME, workers=1)
+        _, meta = _load_index_from_file(index)
+        assert sorted({m["file_path"] for m in meta}) == [".hidden/h.py", "a.py", "docs/conf.py",
+                                                           "lib/build_out/real.py", "nested/local.py", "pkg/mod.py",
+                                                           "pkg/sub/deep.py"]
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import context_store_watch
+from context_store import build_prose_index, get_prose_context, watch_repo
+from context_store_json import build_json_indices, lookup_element
+from context_store_watch import RepoWatcher
+from conftest import FAKE_MODEL_NAME
+
+SHARED = "def parse_header(line):\n    key, _, value = line.partition(':')\n    return key.strip(), value.strip()\n"
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "http.py").write_text(SHARED + "\nclass Client:\n    def get(self):\n        return 1\n",
+                                          encoding="utf-8")
+    (repo / "pkg" / "mail.py").write_text("\n" + SHARED + "\ndef send():\n    return 2\n", encoding="utf-8")
+    (repo / "guide.md").write_text("# Guide\nInstall it.\n## Usage\nRun the client.\n", encoding="utf-8")
+    (repo / "notes.txt").write_text("scratch\n", encoding="utf-8")
+    return repo
+
+
+def _wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+class TestWatch:
+    @pytest.mark.parametrize("use_inotify", [False, True])
+    def test_watcher_reports_debounced_changes(self, repo, use_inotify):
+        watcher = RepoWatcher(repo, interval=0.05, debounce=0.2, use_inotify=use_inotify)
+        try:
+            assert watcher.wait_for_changes(timeout=0.2) == set()
+            (repo / "pkg" / "http.py").write_text("def get():\n    return 3\n", encoding="utf-8")
+            (repo / "notes.txt").unlink()
+            (repo / "pkg" / "sub").mkdir()
+            (repo / "pkg" / "sub" / "new.rst").write_text("Title\n=====\n", encoding="utf-8")
+            (repo / ".hidden").mkdir()
+            (repo / ".hidden" / "skip.py").write_text("x = 1\n", encoding="utf-8")
+            (repo / "data.csv").write_text("a,b\n", encoding="utf-8")
+            assert watcher.wait_for_changes(timeout=5) == {"pkg/http.py", "notes.txt", "pkg/sub/new.rst"}
+            (repo / "pkg" / "sub" / "new.rst").write_text("Other\n=====\n", encoding="utf-8")
+            assert watcher.wait_for_changes(timeout=5) == {"pkg/sub/new.rst"}
+        finally:
+            watcher.close()
+
+    def test_idle_inotify_watcher_does_not_rescan(self, repo, monkeypatch):
+        watcher = RepoWatcher(repo, interval=0.01, debounce=0.05)
+        if watcher.backend != "inotify":
+            watcher.close()
+            pytest.skip("inotify unavailable")
+        walks, walk = [], context_store_watch.snapshot
+        monkeypatch.setattr(context_store_watch, "snapshot", lambda *args: walks.append(1) or walk(*args))
+        try:
+            assert watcher.wait_for_changes(timeout=0.5) == set() and walks == []
+            (repo / "guide.md").write_text("# Guide\nChanged.\n", encoding="utf-8")
+            assert watcher.wait_for_changes(timeout=5) == {"guide.md"} and 0 < len(walks) < 5
+            watcher.resync = 0.1  # Idle again: only the periodic resync walks the tree.
+            walks.clear()
+            assert watcher.wait_for_changes(timeout=0.35) == set() and 1 <= len(walks) <= 4
+        finally:
+            watcher.close()
+
+    def test_incremental_json_build_matches_full_build(self, repo, tmp_path):
+        build_json_indices(repo, tmp_path / "live", workers=1, base_name="idx")
+        # The canonical copy of parse_header moves away, so the copy in mail.py becomes canonical.
+        (repo / "pkg" / "http.py").write_text("class Client:\n    def get(self):\n        return 1\n",
+                                              encoding="utf-8")
+        (repo / "pkg" / "extra.py").write_text("def extra():\n    return 4\n", encoding="utf-8")
+        build_json_indices(repo, tmp_path / "live", workers=1, base_name="idx",
+                           changed_files=["pkg/http.py", "pkg/extra.py"])
+        build_json_indices(repo, tmp_path / "clean", workers=1, base_name="idx")
+        for suffix in ("signatures", "fullsource"):
+            live = json.loads((tmp_path / "live" / f"idx_{suffix}.json").read_text())
+            assert live == json.loads((tmp_path / "clean" / f"idx_{suffix}.json").read_text())
+        [header] = lookup_element("parse_header", tmp_path / "live" / "idx_fullsource.json")
+        assert header["file"] == "pkg/mail.py" and "occurrences" not in header
+
+    def test_incremental_prose_build_reuses_unchanged_files(self, repo, tmp_path, fake_model):
+        build_prose_index(repo, tmp_path / "prose", FAKE_MODEL_NAME)
+        (repo / "notes.txt").write_text("# Notes\nRemember the milk.\n", encoding="utf-8")
+        fake_model.encoded_texts.clear()
+        build_prose_index(repo, tmp_path / "prose", FAKE_MODEL_NAME, incremental=True)
+        assert fake_model.encoded_texts == ["# Notes\nRemember the milk.\n"]
+        live = np.load(tmp_path / "prose" / "repo_prose_index.npz", allow_pickle=True)
+        build_prose_index(repo, tmp_path / "clean", FAKE_MODEL_NAME)
+        clean = np.load(tmp_path / "clean" / "repo_prose_index.npz", allow_pickle=True)
+        assert list(live["texts"]) == list(clean["texts"]) and list(live["metadata"]) == list(clean["metadata"])
+        np.testing.assert_allclose(live["embeddings"], clean["embeddings"])
+
+    def test_removing_every_prose_file_empties_the_index(self, repo, tmp_path, fake_model):
+        build_prose_index(repo, tmp_path / "prose", FAKE_MODEL_NAME)
+        index = tmp_path / "prose" / "repo_prose_index.npz"
+        assert get_prose_context("install", index, model_name=FAKE_MODEL_NAME)
+        (repo / "guide.md").unlink()
+        (repo / "notes.txt").unlink()
+        build_prose_index(repo, tmp_path / "prose", FAKE_MODEL_NAME, incremental=True)
+        assert len(np.load(index, allow_pickle=True)["texts"]) == 0
+        assert get_prose_context("install", index, model_name=FAKE_MODEL_NAME) == []
+        assert [p.name for p in (tmp_path / "prose").iterdir()] == ["repo_prose_index.npz"]
+
+    def test_watch_keeps_indices_current(self, repo, tmp_path, fake_model):
+        stop = threading.Event()
+        signatures = tmp_path / "lex_signatures.json"
+        thread = threading.Thread(target=watch_repo, args=(repo,), daemon=True, kwargs=dict(
+            index=tmp_path / "code.npz", lexical_base=tmp_path / "lex", model_name=FAKE_MODEL_NAME, workers=1,
+            interval=0.05, debounce=0.1, use_inotify=False, stop_event=stop))
+        thread.start()
+        try:
+            _wait_until(signatures.exists)
+            (repo / "pkg" / "retry.py").write_text("def backoff(attempt):\n    return 2 ** attempt\n",
+                                                   encoding="utf-8")
+            _wait_until(lambda: lookup_element("backoff", signatures))
+            _wait_until(lambda: any(m["element_name"] == "backoff" for m in
+                                    np.load(tmp_path / "code.npz", allow_pickle=True)["meta"]))
+        finally:
+            stop.set()
+            thread.join(timeout=10)
+        assert not thread.is_alive()